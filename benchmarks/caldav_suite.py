@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+# encoding: utf-8
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Time common operations against a local CalDAV server.
+
+The in-memory server from the test suite is seeded with a collection of
+synthetic events, and discovery, listing, UID lookups, imports (split.py)
+and rendering (printday.py, printcalendar.py) are timed against it. No
+network access is needed.
+
+Results are written as JSON, so that runs can be compared:
+
+    {"python": ..., "results": [{"name": ..., "size": ..., "samples": [...],
+                                 "min": ..., "median": ...}, ...]}
+
+Scripts are run in a subprocess, so their timings include interpreter
+startup.
+"""
+
+import datetime
+import json
+import optparse
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from dystros import caldav, filters, utils
+from dystros.tests.server import CalDAVServer
+
+import synthetic
+
+# Time discovery itself, rather than lookups in the discovery cache.
+utils.set_discovery_cache(None)
+
+# Events are spread over this many days from FIRST_DAY.
+FIRST_DAY = datetime.date(2017, 1, 1)
+DAYS = 365
+
+RENDER_DAY = FIRST_DAY + datetime.timedelta(days=100)
+
+
+def event(i, uid=None):
+    day = FIRST_DAY + datetime.timedelta(days=i % DAYS)
+    return synthetic.event(
+        i, uid, start=datetime.datetime.combine(
+            day, datetime.time(8 + i % 10, 0)),
+        # One in a hundred events recurs weekly.
+        extra='RRULE:FREQ=WEEKLY;COUNT=10\r\n' if i % 100 == 0 else '')
+
+
+def seed(server, size):
+    for i in range(size):
+        server.put_resource('/cal/event-%d.ics' % i, event(i))
+
+
+def measure(fn, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class Suite(object):
+
+    def __init__(self, server, size, env, uid_lookups=20, import_count=100):
+        self.server = server
+        self.size = size
+        self.env = env
+        self.url = server.url + 'cal/'
+        self.uid_lookups = uid_lookups
+        self.import_count = import_count
+
+    def discovery(self, i):
+        principal = utils.get_current_user_principal(self.url)
+        utils.get_inbox_url(principal)
+        for response in caldav.getprop(self.url, ['{DAV:}getetag'], '1'):
+            pass
+
+    def list(self, i):
+        count = sum(1 for ev in filters.event_records(
+            utils.get_all_calendars(self.url)))
+        assert count >= self.size, count
+
+    def list_partial(self, i):
+        calendar_data = caldav.partial_calendar_data(
+            'VEVENT', filters.EventRecord.PROPERTIES)
+        count = sum(1 for ev in filters.event_records(
+            utils.get_all_calendars(self.url, calendar_data=calendar_data)))
+        assert count >= self.size, count
+
+    def uid_lookup(self, i):
+        rng = random.Random(i)
+        for j in range(self.uid_lookups):
+            utils.get_by_uid(
+                self.url, 'VEVENT', 'event-%d' % rng.randrange(self.size))
+
+    def uid_index(self, i):
+        assert len(utils.get_uid_index(self.url)) >= self.size
+
+    def _import_file(self, i):
+        path = os.path.join(self.env['TMPDIR'], 'import-%d.ics' % i)
+        if not os.path.exists(path):
+            lines = [b'BEGIN:VCALENDAR\r\n', b'VERSION:2.0\r\n']
+            for j in range(self.import_count):
+                data = event(j, uid='import-%d-%d' % (i, j))
+                lines.extend(data.splitlines(True)[3:-1])
+            lines.append(b'END:VCALENDAR\r\n')
+            with open(path, 'wb') as f:
+                f.writelines(lines)
+        return path
+
+    def _run(self, args, stdin=None):
+        subprocess.run(
+            [sys.executable] + args, cwd=ROOT, env=self.env, stdin=stdin,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    def _split(self, i):
+        with open(self._import_file(i), 'rb') as f:
+            self._run(['split.py', '--url', self.url, '--jobs', '4'],
+                      stdin=f)
+
+    def import_new(self, i):
+        before = len(self.server.resources)
+        self._split(i)
+        added = len(self.server.resources) - before
+        assert added == self.import_count, added
+
+    def import_unchanged(self, i):
+        # Import files were already imported by import_new.
+        self._split(i)
+
+    def printday(self, i):
+        self._run(['printday.py', '--url', self.url,
+                   RENDER_DAY.strftime('%Y%m%d')])
+
+    def printcalendar(self, i):
+        end = RENDER_DAY + datetime.timedelta(days=6)
+        self._run(['printcalendar.py', '--url', self.url,
+                   '--from', RENDER_DAY.strftime('%Y%m%d'),
+                   '--to', end.strftime('%Y%m%d')])
+
+    OPERATIONS = ['discovery', 'list', 'list_partial', 'uid_lookup',
+                  'uid_index', 'import_new', 'import_unchanged', 'printday',
+                  'printcalendar']
+
+
+parser = optparse.OptionParser("caldav_suite")
+parser.add_option('--sizes', type=str, default='1000,10000,100000',
+                  help='Comma-separated list of collection sizes.')
+parser.add_option('--repeat', type=int, default=3,
+                  help='Number of times to run each operation.')
+parser.add_option('--operations', type=str,
+                  default=','.join(Suite.OPERATIONS),
+                  help='Comma-separated list of operations to run.')
+parser.add_option('--output', type=str, default=None,
+                  help='File to write the results to (default: stdout).')
+opts, args = parser.parse_args()
+
+operations = opts.operations.split(',')
+for name in operations:
+    if name not in Suite.OPERATIONS:
+        parser.error('unknown operation %r' % name)
+
+results = []
+for size in [int(s) for s in opts.sizes.split(',')]:
+    server = CalDAVServer()
+    server.start()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        seed(server, size)
+        # Scripts get their own configuration and cache.
+        env = dict(os.environ)
+        env['TMPDIR'] = tmpdir
+        env['XDG_CONFIG_HOME'] = os.path.join(tmpdir, 'config')
+        env['XDG_CACHE_HOME'] = os.path.join(tmpdir, 'cache')
+        suite = Suite(server, size, env)
+        for name in operations:
+            samples = measure(getattr(suite, name), opts.repeat)
+            results.append({
+                'name': name, 'size': size, 'samples': samples,
+                'min': min(samples), 'median': statistics.median(samples)})
+            sys.stderr.write('%-18s %7d  min %8.3fs  median %8.3fs\n' % (
+                name, size, min(samples), statistics.median(samples)))
+    finally:
+        server.stop()
+        shutil.rmtree(tmpdir)
+
+report = {
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'repeat': opts.repeat,
+    'results': results,
+    }
+if opts.output:
+    with open(opts.output, 'w') as f:
+        json.dump(report, f, indent=2)
+else:
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Compare eager and lazy parsing of a collection, and the property scanner.
+
+Models printcalendar.py and todo.py running against a collection with a
+mix of events and todos, where only some events are in the requested
+category.
+"""
+
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from icalendar.cal import Calendar
+
+from dystros import filters
+from dystros.lazy import LazyCalendar
+
+import synthetic
+
+TODO = """\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//dystros//benchmark//EN\r
+BEGIN:VTODO\r
+UID:todo-%(i)d\r
+DTSTAMP:20170101T000000Z\r
+SUMMARY:Todo %(i)d\r
+STATUS:NEEDS-ACTION\r
+PRIORITY:5\r
+END:VTODO\r
+END:VCALENDAR\r
+"""
+
+
+def generate(count):
+    for i in range(count):
+        if i % 2:
+            data = (TODO % {'i': i}).encode('utf-8')
+        else:
+            data = synthetic.event(i)
+        yield ('/cal/%d.ics' % i, data)
+
+
+def categories(component):
+    values = component.get('CATEGORIES', [])
+    if not isinstance(values, list):
+        values = [values]
+    return [str(cat) for value in values for cat in value.cats]
+
+
+def run(objects, factory, category):
+    cals = [(href, factory(data)) for (href, data) in objects]
+    if category:
+        cals = filters.with_category(cals, category)
+    vevents = filters.extract_vevents(cals)
+    if category:
+        vevents = [ev for ev in vevents if category in categories(ev)]
+    return sum(1 for ev in vevents)
+
+
+def measure(objects, factory, category):
+    start = time.process_time()
+    count = run(objects, factory, category)
+    return (count, time.process_time() - start)
+
+
+parser = optparse.OptionParser("lazy_calendars")
+parser.add_option('--count', type=int, default=20000,
+                  help='Number of objects in the collection.')
+opts, args = parser.parse_args()
+
+objects = list(generate(opts.count))
+sys.stdout.write('%d objects\n' % opts.count)
+for (name, category) in [('extract_vevents', None),
+                         ('extract_vevents, one category', 'Travel')]:
+    (eager_count, eager) = measure(objects, Calendar.from_ical, category)
+    (lazy_count, lazy) = measure(objects, LazyCalendar, category)
+    assert eager_count == lazy_count
+    sys.stdout.write(
+        '%-30s eager %6.2fs  lazy %6.2fs  saved %3d%%  (%d events)\n' % (
+            name, eager, lazy, 100 * (eager - lazy) / eager, lazy_count))
+
+start = time.process_time()
+count = sum(1 for values in filters.extract_vevents(
+    [(href, LazyCalendar(data)) for (href, data) in objects],
+    props=['SUMMARY', 'DTSTART', 'DTEND', 'LOCATION', 'CATEGORIES']))
+scanned = time.process_time() - start
+sys.stdout.write('%-30s scanner %6.2fs  (%d events)\n' % (
+    'extract_vevents, 5 properties', scanned, count))
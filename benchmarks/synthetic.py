@@ -0,0 +1,67 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Synthetic calendar objects for the benchmarks."""
+
+import datetime
+
+EVENT = """\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//dystros//benchmark//EN\r
+BEGIN:VEVENT\r
+UID:%(uid)s\r
+DTSTAMP:20170101T000000Z\r
+DTSTART:%(start)s\r
+DTEND:%(end)s\r
+SUMMARY:Event %(i)d\r
+LOCATION:Room %(i)d\r
+DESCRIPTION:A longer description of event %(i)d\\, which is typically\r
+  the largest property in an object.\r
+CATEGORIES:%(category)s\r
+%(extra)sEND:VEVENT\r
+END:VCALENDAR\r
+"""
+
+DEFAULT_START = datetime.datetime(2017, 1, 1, 10, 0)
+
+
+def event(i, uid=None, start=DEFAULT_START, extra=''):
+    """Generate a one hour event.
+
+    One in ten events is in the 'Travel' category, the others are in
+    'Work'.
+
+    :param i: Number of the event
+    :param uid: UID, defaults to event-<i>
+    :param start: Start of the event (naive datetime, in UTC)
+    :param extra: Extra content lines to add to the VEVENT
+    :return: Calendar object, as bytes
+    """
+    end = start + datetime.timedelta(hours=1)
+    return (EVENT % {
+        'uid': uid or 'event-%d' % i,
+        'i': i,
+        'start': start.strftime('%Y%m%dT%H%M%SZ'),
+        'end': end.strftime('%Y%m%dT%H%M%SZ'),
+        'category': 'Travel' if i % 10 == 0 else 'Work',
+        'extra': extra,
+        }).encode('utf-8')
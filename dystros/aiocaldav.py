@@ -0,0 +1,528 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""asyncio CalDAV client.
+
+This mirrors the operations in `dystros.caldav` and `dystros.utils`, but
+uses coroutines and async iterators so that many collections can be
+queried at once without a thread per request. HTTP is implemented on top
+of asyncio streams, so no third-party HTTP library is needed. Filters are
+built with the functions from `dystros.caldav`.
+"""
+
+import asyncio
+import base64
+import email.parser
+import http.client
+import io
+import urllib.error
+import urllib.parse
+import weakref
+
+from xml.etree import ElementTree as ET
+
+from dystros import caldav
+from dystros.session import (
+    ACCEPT_ENCODING,
+    DEFAULT_MAX_CONNECTIONS,
+    MAX_REDIRECTS,
+    RETRY_METHODS,
+    USER_AGENT,
+    ContentDecoder,
+    RequestRecorder,
+    redirect_target,
+    _DRAIN_LIMIT,
+    _lookup_credentials,
+    )
+
+
+class AsyncResponse(object):
+    """Response to a request sent through an `AsyncSession`.
+
+    Closing the response (or leaving its async context manager) returns the
+    underlying connection to the session pool. Bodies with a gzip or
+    deflate Content-Encoding are decoded as they are read.
+    """
+
+    def __init__(self, session, conn, method, url, version, status, reason,
+                 headers, recorder=None):
+        self._session = session
+        self._conn = conn
+        self._recorder = recorder
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.will_close = (
+            version == 'HTTP/1.0' or
+            headers.get('Connection', '').lower() == 'close')
+        self._chunked = (
+            'chunked' in headers.get('Transfer-Encoding', '').lower())
+        self._chunk_left = 0
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            self._remaining = 0
+        elif self._chunked:
+            self._remaining = None
+        elif headers.get('Content-Length') is not None:
+            self._remaining = int(headers['Content-Length'])
+        else:
+            self._remaining = None
+            self.will_close = True
+        self._eof = (self._remaining == 0)
+        self._decoder = ContentDecoder.for_headers(headers)
+        self._decoded = b''
+        self._decoded_eof = False
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    async def read(self, amt=None):
+        """Read (part of) the response body.
+
+        :param amt: Maximum number of bytes to read, or None to read
+            everything
+        :return: Bytes; empty at the end of the body
+        """
+        if self._decoder is None:
+            return await self._read_raw(amt)
+        while not self._decoded_eof and (
+                amt is None or len(self._decoded) < amt):
+            data = await self._read_raw(
+                None if amt is None else max(amt, 8192))
+            if data:
+                self._decoded += self._decoder.decompress(data)
+            else:
+                self._decoded += self._decoder.flush()
+                self._decoded_eof = True
+        if amt is None:
+            amt = len(self._decoded)
+        ret = self._decoded[:amt]
+        self._decoded = self._decoded[amt:]
+        return ret
+
+    async def _read_raw(self, amt=None):
+        if amt is None:
+            chunks = []
+            while True:
+                data = await self._read_raw(65536)
+                if not data:
+                    return b''.join(chunks)
+                chunks.append(data)
+        if self._eof:
+            return b''
+        reader = self._conn[0]
+        if self._chunked:
+            data = await self._read_chunked(reader, amt)
+        elif self._remaining is None:
+            data = await reader.read(amt)
+            if not data:
+                self._eof = True
+        else:
+            data = await reader.read(min(amt, self._remaining))
+            if not data:
+                raise http.client.IncompleteRead(b'', self._remaining)
+            self._remaining -= len(data)
+            if self._remaining == 0:
+                self._eof = True
+        if self._recorder is not None:
+            self._recorder.response_bytes += len(data)
+        return data
+
+    async def _read_chunked(self, reader, amt):
+        if self._chunk_left == 0:
+            line = await reader.readline()
+            size = int(line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # Skip any trailers.
+                while line not in (b'\r\n', b'\n', b''):
+                    line = await reader.readline()
+                self._eof = True
+                return b''
+            self._chunk_left = size
+        data = await reader.read(min(amt, self._chunk_left))
+        if not data:
+            raise http.client.IncompleteRead(b'', self._chunk_left)
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0:
+            await reader.readexactly(2)
+        return data
+
+    async def close(self):
+        conn = self._conn
+        if conn is None:
+            return
+        drained = 0
+        try:
+            while not self._eof and drained < _DRAIN_LIMIT:
+                drained += len(await self._read_raw(8192))
+        except (ConnectionError, http.client.IncompleteRead,
+                asyncio.IncompleteReadError):
+            pass
+        self._conn = None
+        if self._eof and not self.will_close:
+            self._session._release(conn)
+        else:
+            conn[1].close()
+        if self._recorder is not None:
+            self._recorder.finish()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncSession(object):
+    """A keep-alive HTTP session for a single host, for use with asyncio.
+
+    This is the asyncio counterpart of `dystros.session.Session`; a session
+    can only be used from the event loop it was created in. Unlike
+    `Session`, it always connects directly; *_proxy variables are not
+    honoured.
+
+    :param scheme: URL scheme ('http' or 'https')
+    :param netloc: Host (and optional port) to connect to
+    :param credentials: Optional (user, password) tuple for Basic auth
+    :param max_connections: Maximum number of idle connections to keep
+    :param accept_encoding: Content codings to accept for responses, or
+        None to only accept unencoded responses
+    """
+
+    def __init__(self, scheme, netloc, credentials=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 accept_encoding=ACCEPT_ENCODING):
+        if scheme not in ('http', 'https'):
+            raise ValueError('unsupported scheme %r' % scheme)
+        self.scheme = scheme
+        self.netloc = netloc
+        self.max_connections = max_connections
+        self.accept_encoding = accept_encoding
+        parsed = urllib.parse.urlsplit('//' + netloc)
+        self._host = parsed.hostname
+        self._port = parsed.port or (443 if scheme == 'https' else 80)
+        if credentials is not None:
+            self._authorization = 'Basic ' + base64.b64encode(
+                ('%s:%s' % credentials).encode('utf-8')).decode('ascii')
+        else:
+            self._authorization = None
+        self._idle = []
+
+    def _release(self, conn):
+        if len(self._idle) < self.max_connections:
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+
+    def close(self):
+        """Close all idle connections."""
+        idle, self._idle = self._idle, []
+        for (reader, writer) in idle:
+            writer.close()
+
+    async def _send(self, conn, head, body):
+        (reader, writer) = conn
+        writer.write(head)
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+    async def _read_head(self, conn):
+        reader = conn[0]
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by server')
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line)
+        return status_line, header_lines
+
+    async def request(self, method, url, body=None, headers=None):
+        """Send a request.
+
+        :param method: HTTP method
+        :param url: URL to request; must be on this session's host
+        :param body: Optional request body (as bytes)
+        :param headers: Optional dictionary with request headers
+        :return: An `AsyncResponse`
+        :raise urllib.error.HTTPError: if the server returned an error status
+        """
+        parsed = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(
+            ('', '', parsed.path or '/', parsed.query, ''))
+        request_headers = {
+            'Host': self.netloc,
+            'User-Agent': USER_AGENT,
+            'Content-Length': str(len(body or b'')),
+        }
+        if self.accept_encoding is not None:
+            request_headers['Accept-Encoding'] = self.accept_encoding
+        if self._authorization is not None:
+            request_headers['Authorization'] = self._authorization
+        if headers:
+            request_headers.update(headers)
+        head = ('%s %s HTTP/1.1\r\n' % (method, path) + ''.join(
+            '%s: %s\r\n' % item for item in request_headers.items()) +
+            '\r\n').encode('latin-1')
+        recorder = RequestRecorder(method, url, body)
+        while True:
+            conn = None
+            while self._idle:
+                conn = self._idle.pop()
+                if not (conn[0].at_eof() or conn[1].is_closing()):
+                    break
+                # The server closed the idle connection.
+                conn[1].close()
+                conn = None
+            reused = conn is not None
+            if conn is None:
+                conn = await asyncio.open_connection(
+                    self._host, self._port,
+                    ssl=True if self.scheme == 'https' else None)
+            sent = False
+            try:
+                await self._send(conn, head, body)
+                sent = True
+                (status_line, header_lines) = await self._read_head(conn)
+            except ConnectionError:
+                conn[1].close()
+                if reused and (not sent or method in RETRY_METHODS):
+                    # The server closed the idle connection; try another.
+                    recorder.retries += 1
+                    continue
+                recorder.finish()
+                raise
+            except BaseException:
+                conn[1].close()
+                recorder.finish()
+                raise
+            break
+        (version, status, reason) = (
+            status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) +
+            [''])[:3]
+        response_headers = email.parser.Parser(
+            _class=http.client.HTTPMessage).parsestr(
+                b''.join(header_lines).decode('latin-1'))
+        recorder.received(int(status))
+        ret = AsyncResponse(self, conn, method, url, version, int(status),
+                            reason, response_headers, recorder)
+        if ret.status >= 400:
+            async with ret:
+                body = await ret.read()
+            raise urllib.error.HTTPError(
+                url, ret.status, ret.reason, ret.headers, io.BytesIO(body))
+        return ret
+
+
+_sessions = weakref.WeakKeyDictionary()
+
+
+def get_session(url):
+    """Get the session for the host of a URL in the running event loop.
+
+    :param url: URL to get a session for
+    :return: An `AsyncSession`
+    """
+    sessions = _sessions.setdefault(asyncio.get_running_loop(), {})
+    parsed = urllib.parse.urlsplit(url)
+    key = (parsed.scheme, parsed.netloc)
+    try:
+        return sessions[key]
+    except KeyError:
+        session = sessions[key] = AsyncSession(
+            parsed.scheme, parsed.netloc,
+            credentials=_lookup_credentials(url))
+        return session
+
+
+def close_sessions():
+    """Close idle connections of all sessions in the running event loop."""
+    for session in _sessions.pop(asyncio.get_running_loop(), {}).values():
+        session.close()
+
+
+async def request(method, url, body=None, headers=None):
+    """Send a request using the session for its host.
+
+    Redirects are followed, like `dystros.session.request` does. See
+    `AsyncSession.request` for the parameters.
+    """
+    for i in range(MAX_REDIRECTS + 1):
+        response = await get_session(url).request(
+            method, url, body=body, headers=headers)
+        target = redirect_target(method, url, response.status,
+                                 response.headers)
+        if target is None:
+            return response
+        await response.close()
+        url = target
+    raise urllib.error.HTTPError(
+        url, response.status, 'too many redirects', response.headers, None)
+
+
+async def report(url, req, depth=None):
+    """Send a CalDAV report request.
+
+    :param url: URL to request against.
+    :param req: Request as XML element
+    :param depth: Optional depth. Defaults to '1'
+    :return: An `AsyncResponse`
+    """
+    if depth is None:
+        depth = '1'
+    return await request(
+        'REPORT', url, body=ET.tostring(req),
+        headers={'Content-Type': 'application/xml', 'Depth': depth})
+
+
+async def _multistatus_responses(response):
+    async with response as f:
+        assert f.status == 207, f.status
+        parser = caldav.MultistatusParser()
+        while True:
+            data = await f.read(16384)
+            if not data:
+                break
+            for element in parser.feed(data):
+                if element.tag == '{DAV:}response':
+                    yield caldav.multistat_extract_response(element)
+        for element in parser.close():
+            if element.tag == '{DAV:}response':
+                yield caldav.multistat_extract_response(element)
+
+
+async def calendar_query(url, props, filter=None, depth=None):
+    """Send a calendar-query request.
+
+    :param url: URL to request against
+    :param props: Properties to request (as XML elements or strings
+    :param filter: Optional filter to apply
+    :param depth: Optional Depth
+    :return: Async iterator over (href, status, propstat) tuples
+    """
+    reqxml = caldav._calendar_query_request(props, filter)
+    async for response in _multistatus_responses(
+            await report(url, reqxml, depth)):
+        yield response
+
+
+async def getprop(url, props, depth=None):
+    """Retrieve properties on a URL or set of URLs.
+
+    :param url: URL to query
+    :param props: List of properties to retrieve
+    :param depth: Optional depth
+    :return: Async iterator over (href, status, propstat) tuples
+    """
+    reqxml = ET.Element('{DAV:}propfind')
+    caldav._add_props(reqxml, props)
+    if depth is None:
+        depth = '0'
+    f = await request(
+        'PROPFIND', url, body=ET.tostring(reqxml),
+        headers={'Content-Type': 'application/xml', 'Depth': depth})
+    async for response in _multistatus_responses(f):
+        yield response
+
+
+async def get_all_calendars(url, depth=None, filter=None,
+                            calendar_data=None):
+    """Retrieve all calendar objects in a collection.
+
+    :param url: URL of the collection
+    :param depth: Optional depth
+    :param filter: Optional filter to apply
+    :param calendar_data: Optional calendar-data element, to retrieve only
+        some components and properties (see `caldav.calendar_data`)
+    :return: Async iterator over (href, LazyCalendar) tuples
+    """
+    from dystros.lazy import LazyCalendar
+    if calendar_data is None:
+        calendar_data = '{urn:ietf:params:xml:ns:caldav}calendar-data'
+    async for (href, status, propstat) in calendar_query(
+            url, ['{DAV:}getetag', calendar_data], filter, depth):
+        data = None
+        etag = None
+        for prop, prop_status in propstat:
+            if prop.tag == '{urn:ietf:params:xml:ns:caldav}calendar-data':
+                data = prop.text
+            elif prop.tag == '{DAV:}getetag':
+                etag = prop.text
+        assert data is not None, "data missing for %r" % href
+        yield href, LazyCalendar(data, etag)
+
+
+async def get(url):
+    """Retrieve a resource.
+
+    :param url: URL of the resource
+    :return: Tuple with etag and contents (as bytes)
+    """
+    async with await request('GET', url) as f:
+        assert f.status == 200, f.status
+        return (f.getheader('ETag'), await f.read())
+
+
+async def _write(method, url, content_type, data, if_match=None):
+    headers = {'Content-Type': content_type}
+    if if_match is not None:
+        headers['If-Match'] = ', '.join(if_match)
+    async with await request(method, url, body=data, headers=headers) as f:
+        pass
+    assert f.status in (201, 204, 200), f.status
+    return f.status
+
+
+async def put(url, content_type, data, if_match=None):
+    return await _write('PUT', url, content_type, data, if_match)
+
+
+async def post(url, content_type, data, if_match=None):
+    return await _write('POST', url, content_type, data, if_match)
+
+
+async def get_addmember_url(url):
+    ret = None
+    async for (href, href_status, propstat) in getprop(
+            url, ['{DAV:}add-member']):
+        if href_status == 'HTTP/1.1 404 Not Found':
+            continue
+        for prop, propstatus in propstat:
+            if prop.tag == '{DAV:}add-member':
+                if propstatus == 'HTTP/1.1 200 OK' and ret is None:
+                    ret = urllib.parse.urljoin(url, list(prop)[0].text)
+    if ret is None:
+        raise KeyError(url)
+    return ret
+
+
+async def add_member(url, content_type, content):
+    """Add a new member to a collection.
+
+    :param url: URL of collection
+    :param content_type; Content type of new member
+    :param content: Content (as bytes)
+    """
+    addmember_url = await get_addmember_url(url)
+    return await post(addmember_url, content_type, content)
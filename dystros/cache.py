@@ -0,0 +1,139 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""On-disk cache of calendar object contents, validated by etag."""
+
+import hashlib
+import os
+import threading
+
+from xdg.BaseDirectory import xdg_cache_home
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+
+class ObjectCache(object):
+    """Cache of object contents, keyed by (collection URL, href, etag).
+
+    Partial contents (e.g. from a calendar-data request that selects only
+    some properties) are cached separately for each variant. Only the most
+    recent etag is kept for each object. When the total size exceeds
+    max_size, the least recently used entries are evicted.
+
+    :param path: Directory to store the cache in
+    :param max_size: Maximum total size of the cache, in bytes
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls, max_size=DEFAULT_MAX_SIZE):
+        """Open the default cache, under the XDG cache directory."""
+        return cls(os.path.join(xdg_cache_home, 'dystros', 'objects'),
+                   max_size=max_size)
+
+    def _entry_path(self, url, href, variant=None):
+        key = hashlib.sha256(
+            ('%s\n%s\n%s' % (url, href, variant or '')).encode(
+                'utf-8')).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, url, href, etag, variant=None):
+        """Look up the contents of an object.
+
+        :param url: URL of the collection
+        :param href: Href of the object
+        :param etag: Current etag of the object
+        :param variant: Optional string identifying partial contents
+        :return: Contents (as bytes), or None if there is no entry for
+            this etag
+        """
+        path = self._entry_path(url, href, variant)
+        try:
+            with open(path, 'rb') as f:
+                cached_etag = f.readline().rstrip(b'\n').decode('utf-8')
+                if cached_etag != etag:
+                    return None
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def set(self, url, href, etag, data, variant=None):
+        """Store the contents of an object.
+
+        :param url: URL of the collection
+        :param href: Href of the object
+        :param etag: Etag of the object
+        :param data: Contents (as bytes)
+        :param variant: Optional string identifying partial contents
+        """
+        if etag is None:
+            return
+        path = self._entry_path(url, href, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = etag.encode('utf-8') + b'\n' + data
+        with open(path + '.tmp', 'wb') as f:
+            f.write(entry)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(e[2] for e in self._entries())
+            try:
+                self._size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(path + '.tmp', path)
+            self._size += len(entry)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        try:
+            subdirs = list(os.scandir(self.path))
+        except FileNotFoundError:
+            return
+        for subdir in subdirs:
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                st = entry.stat()
+                yield (st.st_mtime, entry.path, st.st_size)
+
+    def _evict(self):
+        target = self.max_size * 0.9
+        for (mtime, path, size) in sorted(self._entries()):
+            if self._size <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            self._size -= size
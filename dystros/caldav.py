@@ -20,13 +20,22 @@
 # MA  02110-1301, USA.
 
 
-from defusedxml.ElementTree import fromstring as xmlparse
 # Hmm, defusedxml doesn't have XML generation functions? :(
 from xml.etree import ElementTree as ET
 
+import datetime
+import itertools
+import urllib.error
 import urllib.parse
-import urllib.request
 
+from dystros import session
+
+
+class InvalidSyncToken(Exception):
+    """The server no longer accepts a sync token."""
+
+    def __init__(self, token):
+        self.token = token
 
 
 def report(url, req, depth=None):
@@ -39,11 +48,9 @@ def report(url, req, depth=None):
     """
     if depth is None:
         depth = '1'
-    req = urllib.request.Request(
-        url=url, headers={'Content-Type': 'application/xml'},
-        data=ET.tostring(req), method='REPORT')
-    req.add_header('Depth', depth)
-    return urllib.request.urlopen(req)
+    return session.request(
+        'REPORT', url, body=ET.tostring(req),
+        headers={'Content-Type': 'application/xml', 'Depth': depth})
 
 
 def expect_tag(element, name):
@@ -54,6 +61,36 @@ def expect_tag(element, name):
         assert element.tag in name, "expected one of %s, got %s: %r" % (', '.join(name), element.tag, element)
 
 
+def multistat_extract_response(response):
+    """Extract href, status and properties from a response element.
+
+    :param response: {DAV:}response element
+    :return: (href, status, propstat) tuple
+    """
+    expect_tag(response, '{DAV:}response')
+    href = None
+    status = None
+    propstat = None
+    for responsesub in response:
+        expect_tag(responsesub, ('{DAV:}href', '{DAV:}propstat', '{DAV:}status'))
+        if responsesub.tag == '{DAV:}href':
+            href = responsesub.text
+        elif responsesub.tag == '{DAV:}propstat':
+            propstat = []
+            for propstatsub in responsesub:
+                expect_tag(propstatsub, ('{DAV:}status', '{DAV:}prop'))
+            for propstatsub in responsesub:
+                if propstatsub.tag == '{DAV:}status':
+                    prop_status = propstatsub.text
+            for propstatsub in responsesub:
+                if propstatsub.tag == '{DAV:}prop':
+                    for actualprop in propstatsub:
+                        propstat.append((actualprop, prop_status))
+        elif responsesub.tag == '{DAV:}status':
+            status = responsesub.text
+    return (href, status, propstat)
+
+
 def multistat_extract_responses(multistatus):
     """Extract response from a multistat element.
 
@@ -62,40 +99,102 @@ def multistat_extract_responses(multistatus):
     """
     expect_tag(multistatus, '{DAV:}multistatus')
     for response in multistatus:
-        expect_tag(response, '{DAV:}response')
-        href = None
-        status = None
-        propstat = None
-        for responsesub in response:
-            expect_tag(responsesub, ('{DAV:}href', '{DAV:}propstat', '{DAV:}status'))
-            if responsesub.tag == '{DAV:}href':
-                href = responsesub.text
-            elif responsesub.tag == '{DAV:}propstat':
-                propstat = []
-                for propstatsub in responsesub:
-                    expect_tag(propstatsub, ('{DAV:}status', '{DAV:}prop'))
-                for propstatsub in responsesub:
-                    if propstatsub.tag == '{DAV:}status':
-                        prop_status = propstatsub.text
-                for propstatsub in responsesub:
-                    if propstatsub.tag == '{DAV:}prop':
-                        for actualprop in propstatsub:
-                            propstat.append((actualprop, prop_status))
-            elif responsesub.tag == '{DAV:}status':
-                status = responsesub.text
-        yield (href, status, propstat)
+        yield multistat_extract_response(response)
 
 
-def calendar_query(url, props, filter=None, depth=None):
-    """Send a calendar-query request.
+def multistat_iterparse_responses(f):
+    """Incrementally extract responses from a multistatus document.
 
-    :param url: URL to request against
-    :param props: Properties to request (as XML elements or strings
-    :param filter: Optional filter to apply
-    :param depth: Optional Depth
-    :return: Multistat response
+    Each response is yielded as soon as it has been parsed and is then
+    detached from the document, so memory use does not grow with the
+    number of responses.
+
+    :param f: File-like object to read the multistatus document from
+    :return: Iterator over (href, status, propstat) tuples
     """
-    reqxml = ET.Element('{urn:ietf:params:xml:ns:caldav}calendar-query')
+    for element in _iterparse_multistatus(f):
+        if element.tag == '{DAV:}response':
+            yield multistat_extract_response(element)
+
+
+class _MultistatusTreeBuilder(ET.TreeBuilder):
+
+    def __init__(self):
+        ET.TreeBuilder.__init__(self)
+        self._root = None
+        self._level = 0
+        self.completed = []
+
+    def start(self, tag, attrs):
+        element = ET.TreeBuilder.start(self, tag, attrs)
+        if self._root is None:
+            expect_tag(element, '{DAV:}multistatus')
+            self._root = element
+        self._level += 1
+        return element
+
+    def end(self, tag):
+        element = ET.TreeBuilder.end(self, tag)
+        self._level -= 1
+        if self._level == 1:
+            self._root.remove(element)
+            self.completed.append(element)
+        return element
+
+
+class MultistatusParser(object):
+    """Incremental, defused parser for multistatus documents.
+
+    Data can be fed to the parser as it arrives. Completed children of the
+    multistatus element are returned as soon as they have been parsed and
+    are then detached from the document.
+    """
+
+    def __init__(self):
+        from defusedxml.ElementTree import DefusedXMLParser
+        self._builder = _MultistatusTreeBuilder()
+        self._parser = DefusedXMLParser(target=self._builder)
+
+    def _completed(self):
+        ret = self._builder.completed
+        self._builder.completed = []
+        return ret
+
+    def feed(self, data):
+        """Feed data to the parser.
+
+        :param data: Bytes to parse
+        :return: List of completed child elements
+        """
+        self._parser.feed(data)
+        return self._completed()
+
+    def close(self):
+        """Finish parsing.
+
+        :return: List of completed child elements
+        """
+        self._parser.close()
+        return self._completed()
+
+
+def _iterparse_multistatus(f, chunk_size=16384):
+    parser = MultistatusParser()
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        yield from parser.feed(data)
+    yield from parser.close()
+
+
+def _multistatus_request(response):
+    with response as f:
+        assert f.status == 207, f.status
+        yield from multistat_iterparse_responses(f)
+
+
+def _add_props(reqxml, props):
     propxml = ET.SubElement(reqxml, '{DAV:}prop')
     for prop in props:
         if isinstance(prop, str):
@@ -103,34 +202,113 @@ def calendar_query(url, props, filter=None, depth=None):
         else:
             propxml.append(prop)
 
+
+def _calendar_query_request(props, filter=None):
+    reqxml = ET.Element('{urn:ietf:params:xml:ns:caldav}calendar-query')
+    _add_props(reqxml, props)
+
     if filter is not None:
         filterxml = ET.SubElement(reqxml, '{urn:ietf:params:xml:ns:caldav}filter')
         filterxml.append(filter)
+    return reqxml
 
-    with report(url, reqxml, depth) as f:
+
+def calendar_query(url, props, filter=None, depth=None):
+    """Send a calendar-query request.
+
+    :param url: URL to request against
+    :param props: Properties to request (as XML elements or strings
+    :param filter: Optional filter to apply
+    :param depth: Optional Depth
+    :return: Iterator over (href, status, propstat) tuples, see
+        `multistat_iterparse_responses`
+    """
+    reqxml = _calendar_query_request(props, filter)
+    return _multistatus_request(report(url, reqxml, depth))
+
+
+DEFAULT_MULTIGET_BATCH_SIZE = 100
+
+
+def calendar_multiget(url, hrefs, props, batch_size=None):
+    """Retrieve a set of calendar objects with calendar-multiget requests.
+
+    The hrefs are split into batches, with one request per batch; results
+    are yielded as they arrive.
+
+    :param url: URL of the collection to request against
+    :param hrefs: Iterable over hrefs of the objects to retrieve
+    :param props: Properties to request (as XML elements or strings)
+    :param batch_size: Maximum number of hrefs per request
+    :return: Iterator over (href, status, propstat) tuples
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_MULTIGET_BATCH_SIZE
+    hrefs = iter(hrefs)
+    while True:
+        batch = list(itertools.islice(hrefs, batch_size))
+        if not batch:
+            break
+        reqxml = ET.Element(
+            '{urn:ietf:params:xml:ns:caldav}calendar-multiget')
+        _add_props(reqxml, props)
+        for href in batch:
+            ET.SubElement(reqxml, '{DAV:}href').text = href
+        yield from _multistatus_request(report(url, reqxml, depth='1'))
+
+
+def sync_collection(url, props, sync_token=None, sync_level='1'):
+    """Send a sync-collection request (RFC 6578).
+
+    :param url: URL of the collection
+    :param props: Properties to request (as XML elements or strings)
+    :param sync_token: Sync token from a previous request, or None for an
+        initial synchronization
+    :param sync_level: Sync level ('1' or 'infinite')
+    :raise InvalidSyncToken: if the server rejected the sync token
+    :return: Tuple with the new sync token and a list of
+        (href, status, propstat) tuples for members that have changed
+    """
+    reqxml = ET.Element('{DAV:}sync-collection')
+    ET.SubElement(reqxml, '{DAV:}sync-token').text = sync_token
+    ET.SubElement(reqxml, '{DAV:}sync-level').text = sync_level
+    _add_props(reqxml, props)
+
+    try:
+        f = report(url, reqxml, depth='0')
+    except urllib.error.HTTPError as e:
+        if (sync_token is not None and e.code in (403, 409) and
+                b'valid-sync-token' in e.read()):
+            raise InvalidSyncToken(sync_token)
+        raise
+    new_token = None
+    responses = []
+    with f:
         assert f.status == 207, f.status
-        respxml = xmlparse(f.read())
-    return multistat_extract_responses(respxml)
+        for element in _iterparse_multistatus(f):
+            if element.tag == '{DAV:}sync-token':
+                new_token = element.text
+            else:
+                responses.append(multistat_extract_response(element))
+    return (new_token, responses)
 
 
 def freebusy_query(url, start, end, depth=None):
     """Query freebusy information.
 
+    :param url: URL of the collection
     :param start: optional start time
     :param end: Optional end time
     :param depth: Optional depth
-    :return: Freebusy results (as string)
+    :return: Freebusy results, as a VCALENDAR (bytes)
     """
     reqxml = ET.Element('{urn:ietf:params:xml:ns:caldav}free-busy-query')
-    propxml = ET.SubElement(reqxml, '{urn:ietf:params:xml:ns:caldav}time-range')
-    if start is not None:
-        propxml.set('start', vDDDTypes(start).to_ical().decode('ascii'))
-    if end is not None:
-        propxml.set('end', vDDDTypes(end).to_ical().decode('ascii'))
-    with caldav.report(url, reqxml, depth) as f:
+    reqxml.append(time_range(start, end))
+    with report(url, reqxml, depth) as f:
         assert f.status == 200, f.status
         return f.read()
 
+
 def _extend_inner_filter(et, inner_filter):
     if inner_filter is None:
         return
@@ -182,30 +360,100 @@ def text_match(text, collation=None):
     return ret
 
 
+def comp(name, props=None, comps=None):
+    """Select a component for a partial calendar-data request.
+
+    :param name: Component name
+    :param props: Names of properties to return, or None for all
+    :param comps: Subcomponents to return (as returned by `comp`), or None
+        for all
+    :return: A comp element
+    """
+    ret = ET.Element('{urn:ietf:params:xml:ns:caldav}comp')
+    ret.set('name', name)
+    if props is None:
+        ET.SubElement(ret, '{urn:ietf:params:xml:ns:caldav}allprop')
+    else:
+        for prop in props:
+            ET.SubElement(
+                ret, '{urn:ietf:params:xml:ns:caldav}prop').set('name', prop)
+    if comps is None:
+        ET.SubElement(ret, '{urn:ietf:params:xml:ns:caldav}allcomp')
+    else:
+        for subcomp in comps:
+            ret.append(subcomp)
+    return ret
+
+
+def calendar_data(comp=None):
+    """Create a calendar-data property for a request.
+
+    :param comp: Optional component selection (see `comp`); if not
+        specified, full calendar objects are returned
+    :return: A calendar-data element
+    """
+    ret = ET.Element('{urn:ietf:params:xml:ns:caldav}calendar-data')
+    if comp is not None:
+        ret.append(comp)
+    return ret
+
+
+def partial_calendar_data(component, props):
+    """Request only a set of properties of one type of component.
+
+    Timezone definitions are always included in full, so that dates with
+    a TZID can still be interpreted.
+
+    :param component: Component name (e.g. 'VEVENT')
+    :param props: Names of properties to return; UID is always included
+    :return: A calendar-data element
+    """
+    props = list(props)
+    if 'UID' not in props:
+        props.append('UID')
+    return calendar_data(comp('VCALENDAR', comps=[
+        comp('VTIMEZONE'), comp(component, props=props, comps=[])]))
+
+
+def _format_utc(dt):
+    if not isinstance(dt, datetime.datetime):
+        dt = datetime.datetime.combine(dt, datetime.time())
+    return dt.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def time_range(start=None, end=None):
+    """Match components that overlap with a time range.
+
+    Dates and naive datetimes are interpreted in local time.
+
+    :param start: Optional start of the range (date or datetime)
+    :param end: Optional end of the range (exclusive; date or datetime)
+    :return: A filter
+    """
+    ret = ET.Element('{urn:ietf:params:xml:ns:caldav}time-range')
+    if start is not None:
+        ret.set('start', _format_utc(start))
+    if end is not None:
+        ret.set('end', _format_utc(end))
+    return ret
+
+
 def getprop(url, props, depth=None):
     """Retrieve properties on a URL or set of URLs.
 
     :param url: URL to query
     :param props: List of properties to retrieve
     :param depth: Optional depth
-    :return: See `multistat_extract_responses`
+    :return: See `multistat_iterparse_responses`
     """
     reqxml = ET.Element('{DAV:}propfind')
-    propxml = ET.SubElement(reqxml, '{DAV:}prop')
-    for prop in props:
-        if isinstance(prop, str):
-            ET.SubElement(propxml, prop)
-        else:
-            propxml.append(prop)
+    _add_props(reqxml, props)
 
     if depth is None:
         depth = '0'
-    req = urllib.request.Request(url=url, headers={'Content-Type': 'application/xml'}, data=ET.tostring(reqxml), method='PROPFIND')
-    req.add_header('Depth', depth)
-    with urllib.request.urlopen(req) as f:
-        assert f.status == 207, f.status
-        respxml = xmlparse(f.read())
-    return multistat_extract_responses(respxml)
+    return _multistatus_request(session.request(
+        'PROPFIND', url, body=ET.tostring(reqxml),
+        headers={'Content-Type': 'application/xml', 'Depth': depth}))
 
 
 def get_current_user_principal(url):
@@ -19,14 +19,21 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA  02110-1301, USA.
 
+import functools
 import os
 
-from configobj import ConfigObj
-
 from xdg.BaseDirectory import xdg_config_home
 
+
+@functools.lru_cache(maxsize=None)
 def GetConfig():
-    config_dir_path = os.path.join(xdg_config_home, 'dystros')
-    os.makedirs(config_dir_path, exist_ok=True)
-    config_file_path = os.path.join(config_dir_path, 'config')
-    return ConfigObj(config_file_path, create_empty=True)
+    """Load the configuration.
+
+    The configuration is only read once; later calls return the same
+    object.
+
+    :return: A `ConfigObj`; empty if there is no configuration file
+    """
+    from configobj import ConfigObj
+    config_file_path = os.path.join(xdg_config_home, 'dystros', 'config')
+    return ConfigObj(config_file_path)
@@ -17,26 +17,295 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA  02110-1301, USA.
 
+import datetime
 
-def extract_vevents(calendars):
-    """Filter out vevents from an iterator over calendars.
+from dystros import scanner
 
-    :param calendars: Iterator over (href, calendar) tuples
-    :return: Iterator over Calendar subcomponents
+DEFAULT_PRIORITY = 10
+DEFAULT_DUE_DATE = datetime.date(datetime.MAXYEAR, 1, 1)
+
+
+def _may_contain(calendar, name):
+    """Check whether a calendar may contain a component.
+
+    For lazy calendars this uses the pre-scan, so that objects without
+    matching components are never parsed.
     """
+    component_names = getattr(calendar, 'component_names', None)
+    if component_names is None:
+        return True
+    return name in component_names
+
+
+def _extract(calendars, name, props=None):
     for href, calendar in calendars:
+        if not _may_contain(calendar, name):
+            continue
+        if props is not None:
+            scan = getattr(calendar, 'scan_components', None)
+            if scan is not None:
+                scanned = scan([name], props)
+            else:
+                scanned = scanner.scan_components(
+                    calendar.to_ical(), [name], props)
+            for (component, values) in scanned:
+                yield values
+            continue
         for component in calendar.subcomponents:
-            if component.name == 'VEVENT':
+            if component.name == name:
                 yield component
 
 
-def extract_vtodos(calendars):
+def extract_vevents(calendars, props=None):
+    """Filter out vevents from an iterator over calendars.
+
+    :param calendars: Iterator over (href, calendar) tuples
+    :param props: Optional list of property names. If set, components are
+        not parsed by icalendar; instead, the properties are extracted
+        with `scanner.scan_components`.
+    :return: Iterator over Calendar subcomponents, or over tuples with a
+        `scanner.Property` (or None) for each of props
+    """
+    return _extract(calendars, 'VEVENT', props)
+
+
+def extract_vtodos(calendars, props=None):
     """Filter out vtodos from an iterator over calendars.
 
     :param calendars: Iterator over (href, calendar) tuples
-    :return: Iterator over Calendar subcomponents
+    :param props: Optional list of property names. If set, components are
+        not parsed by icalendar; instead, the properties are extracted
+        with `scanner.scan_components`.
+    :return: Iterator over Calendar subcomponents, or over tuples with a
+        `scanner.Property` (or None) for each of props
+    """
+    return _extract(calendars, 'VTODO', props)
+
+
+def with_category(calendars, category):
+    """Filter out calendars with a component in a category.
+
+    Calendars that have not been pre-scanned (i.e. are not lazy) are
+    passed through unchanged; callers should still check the category of
+    individual components.
+
+    :param calendars: Iterator over (href, calendar) tuples
+    :param category: Category name
+    :return: Iterator over (href, calendar) tuples
     """
     for href, calendar in calendars:
-        for component in calendar.subcomponents:
-            if component.name == 'VTODO':
-                yield component
+        scan = getattr(calendar, 'scan', None)
+        if scan is not None and not any(
+                category in summary.categories for summary in scan()):
+            continue
+        yield href, calendar
+
+
+def event_sort_key(dtstart):
+    """Create a sort key for an event.
+
+    :param dtstart: Start of the event (date or datetime)
+    :return: Tuple with date and (hour, minute)
+    """
+    if getattr(dtstart, "date", None):
+        return (dtstart.date(), (dtstart.hour, dtstart.minute))
+    return (dtstart, (0, 0))
+
+
+def todo_sort_key(priority, due, summary):
+    """Create a sort key for a todo.
+
+    :param priority: Priority, or None
+    :param due: Due date (date or datetime), or None
+    :param summary: Summary
+    :return: Tuple with priority, due date, due time and summary
+    """
+    if priority is None:
+        priority = DEFAULT_PRIORITY
+    if due:
+        if getattr(due, "date", None):
+            due_date = due.date()
+            due_time = (due.hour, due.minute)
+        else:
+            due_date = due
+            due_time = (0, 0)
+    else:
+        due_date = DEFAULT_DUE_DATE
+        due_time = None
+    return (priority, due_date, due_time, summary)
+
+
+def days_overlap(dtstart, dtend, start, end):
+    """Check whether a component overlaps with a range of days.
+
+    :param dtstart: Start of the component (date or datetime)
+    :param dtend: End of the component, or None
+    :param start: First day of the range, or None
+    :param end: Last day of the range (inclusive), or None
+    :return: Boolean
+    """
+    if getattr(dtstart, "date", None):
+        dtstart = dtstart.date()
+    if dtend is None:
+        dtend = dtstart
+    elif getattr(dtend, "date", None):
+        dtend = dtend.date()
+    if start is not None and dtend < start:
+        return False
+    if end is not None and dtstart > end:
+        return False
+    return True
+
+
+def _value(prop, default=None):
+    if prop is None:
+        return default
+    return prop.value
+
+
+def _scan_component(component, props):
+    data = b'BEGIN:VCALENDAR\r\n' + component.to_ical() + b'END:VCALENDAR\r\n'
+    [(name, values)] = scanner.scan_components(data, None, props)
+    return values
+
+
+class EventRecord(object):
+    """Properties of an event, as needed for sorting and filtering.
+
+    The end is normalised: if there is no DTEND, it is derived from
+    DURATION. For occurrences of recurring events (see `recur`),
+    recurrence_id is set to the original start of the occurrence.
+
+    :ivar sort_key: Precomputed sort key (see `event_sort_key`)
+    """
+
+    __slots__ = ('uid', 'summary', 'start', 'end', 'location', 'status',
+                 'classification', 'categories', 'url', 'transparency',
+                 'recurrence_id', 'sort_key')
+
+    # Properties needed to create a record, in the order expected by
+    # `from_values`.
+    PROPERTIES = ['UID', 'SUMMARY', 'DTSTART', 'DTEND', 'DURATION',
+                  'LOCATION', 'STATUS', 'CLASS', 'CATEGORIES', 'URL',
+                  'TRANSP']
+
+    def __init__(self, uid, summary, start, end=None, location=None,
+                 status=None, classification=None, categories=(), url=None,
+                 transparency=None, recurrence_id=None):
+        self.uid = uid
+        self.summary = summary
+        self.start = start
+        self.end = end
+        self.location = location
+        self.status = status
+        self.classification = classification
+        self.categories = categories
+        self.url = url
+        self.transparency = transparency
+        self.recurrence_id = recurrence_id
+        self.sort_key = event_sort_key(start)
+
+    def __repr__(self):
+        return "<%s(%r, %r, %r)>" % (
+            type(self).__name__, self.uid, self.summary, self.start)
+
+    @classmethod
+    def from_values(cls, values):
+        """Create a record from scanned properties.
+
+        :param values: Tuple of `scanner.Property` objects, for `PROPERTIES`
+        :return: An `EventRecord`
+        """
+        (uid, summary, start, end, duration, location, status,
+         classification, categories, url, transparency) = values
+        start = _value(start)
+        end = _value(end)
+        if end is None and duration is not None:
+            end = start + duration.value
+        return cls(
+            _value(uid), _value(summary), start, end, _value(location),
+            _value(status), _value(classification), _value(categories, []),
+            _value(url), _value(transparency))
+
+    @classmethod
+    def from_component(cls, component):
+        """Create a record from an icalendar component.
+
+        :param component: A VEVENT
+        :return: An `EventRecord`
+        """
+        return cls.from_values(_scan_component(component, cls.PROPERTIES))
+
+    def overlaps(self, start, end):
+        """Check whether this event overlaps with a range of days.
+
+        :param start: First day of the range, or None
+        :param end: Last day of the range (inclusive), or None
+        :return: Boolean
+        """
+        return days_overlap(self.start, self.end, start, end)
+
+
+class TodoRecord(object):
+    """Properties of a todo, as needed for sorting and filtering.
+
+    :ivar sort_key: Precomputed sort key (see `todo_sort_key`)
+    """
+
+    __slots__ = ('uid', 'summary', 'location', 'status', 'priority', 'due',
+                 'sort_key')
+
+    # Properties needed to create a record, in the order expected by
+    # `from_values`.
+    PROPERTIES = ['UID', 'SUMMARY', 'LOCATION', 'STATUS', 'PRIORITY', 'DUE']
+
+    def __init__(self, uid, summary, location=None, status=None,
+                 priority=None, due=None):
+        self.uid = uid
+        self.summary = summary
+        self.location = location
+        self.status = status
+        self.priority = priority
+        self.due = due
+        self.sort_key = todo_sort_key(priority, due, summary)
+
+    def __repr__(self):
+        return "<%s(%r, %r)>" % (type(self).__name__, self.uid, self.summary)
+
+    @classmethod
+    def from_values(cls, values):
+        """Create a record from scanned properties.
+
+        :param values: Tuple of `scanner.Property` objects, for `PROPERTIES`
+        :return: A `TodoRecord`
+        """
+        return cls(*[_value(value) for value in values])
+
+    @classmethod
+    def from_component(cls, component):
+        """Create a record from an icalendar component.
+
+        :param component: A VTODO
+        :return: A `TodoRecord`
+        """
+        return cls.from_values(_scan_component(component, cls.PROPERTIES))
+
+
+def event_records(calendars):
+    """Extract event records from an iterator over calendars.
+
+    :param calendars: Iterator over (href, calendar) tuples
+    :return: Iterator over `EventRecord` objects
+    """
+    for values in extract_vevents(calendars, props=EventRecord.PROPERTIES):
+        yield EventRecord.from_values(values)
+
+
+def todo_records(calendars):
+    """Extract todo records from an iterator over calendars.
+
+    :param calendars: Iterator over (href, calendar) tuples
+    :return: Iterator over `TodoRecord` objects
+    """
+    for values in extract_vtodos(calendars, props=TodoRecord.PROPERTIES):
+        yield TodoRecord.from_values(values)
@@ -0,0 +1,162 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Local free/busy computation.
+
+This computes the same information as a CalDAV free-busy-query (RFC 4791,
+section 7.10), from calendar objects that are already available locally.
+"""
+
+import datetime
+
+from icalendar.cal import Calendar, FreeBusy
+
+from dystros import recur
+
+BUSY = 'BUSY'
+BUSY_TENTATIVE = 'BUSY-TENTATIVE'
+
+# Precedence of free/busy types, for overlapping periods.
+_RANK = {BUSY_TENTATIVE: 1, BUSY: 2}
+
+
+def _utc(dt):
+    """Convert a date or datetime to an aware datetime in UTC.
+
+    Dates and floating times are interpreted in local time.
+    """
+    if not isinstance(dt, datetime.datetime):
+        dt = datetime.datetime.combine(dt, datetime.time())
+    return dt.astimezone(datetime.timezone.utc)
+
+
+def fbtype(event):
+    """Determine the free/busy type of an event.
+
+    :param event: An `filters.EventRecord`
+    :return: BUSY or BUSY_TENTATIVE, or None if the event does not take
+        up time
+    """
+    if event.transparency == 'TRANSPARENT' or event.status == 'CANCELLED':
+        return None
+    if event.status == 'TENTATIVE':
+        return BUSY_TENTATIVE
+    return BUSY
+
+
+def busy_periods(events, start, end):
+    """Compute merged busy periods.
+
+    Overlapping and adjacent periods are merged with a sweep over the
+    period boundaries. Where busy and tentative periods overlap, the
+    overlap is busy.
+
+    :param events: Iterable over `filters.EventRecord` objects
+    :param start: Start of the window (datetime)
+    :param end: End of the window (datetime)
+    :return: List of (start, end, fbtype) tuples, in UTC and in order
+    """
+    start = _utc(start)
+    end = _utc(end)
+    boundaries = []
+    for event in events:
+        kind = fbtype(event)
+        if kind is None:
+            continue
+        ev_start = _utc(event.start)
+        if event.end is not None:
+            ev_end = _utc(event.end)
+        elif isinstance(event.start, datetime.datetime):
+            # Events without an end take up no time.
+            continue
+        else:
+            ev_end = _utc(event.start + datetime.timedelta(1))
+        ev_start = max(ev_start, start)
+        ev_end = min(ev_end, end)
+        if ev_start >= ev_end:
+            continue
+        boundaries.append((ev_start, 1, _RANK[kind]))
+        boundaries.append((ev_end, -1, _RANK[kind]))
+    boundaries.sort()
+    ret = []
+    counts = {1: 0, 2: 0}
+    current = None
+    current_start = None
+    for (when, delta, rank) in boundaries:
+        counts[rank] += delta
+        if counts[2]:
+            state = BUSY
+        elif counts[1]:
+            state = BUSY_TENTATIVE
+        else:
+            state = None
+        if state == current:
+            continue
+        if current is not None and current_start < when:
+            if ret and ret[-1][1] == current_start and ret[-1][2] == current:
+                ret[-1] = (ret[-1][0], when, current)
+            else:
+                ret.append((current_start, when, current))
+        current = state
+        current_start = when
+    return ret
+
+
+def freebusy(events, start, end):
+    """Create a VFREEBUSY for a set of events.
+
+    :param events: Iterable over `filters.EventRecord` objects
+    :param start: Start of the window (datetime)
+    :param end: End of the window (datetime)
+    :return: A `Calendar` with a single VFREEBUSY
+    """
+    fb = FreeBusy()
+    fb.add('DTSTAMP', datetime.datetime.now(datetime.timezone.utc))
+    fb.add('DTSTART', _utc(start))
+    fb.add('DTEND', _utc(end))
+    for (period_start, period_end, kind) in busy_periods(events, start, end):
+        fb.add('FREEBUSY', (period_start, period_end),
+               parameters={'FBTYPE': kind})
+    cal = Calendar()
+    cal.add('VERSION', '2.0')
+    cal.add('PRODID', '-//dystros//freebusy//EN')
+    cal.add_component(fb)
+    return cal
+
+
+def local_freebusy(calendars, start, end, cache=None):
+    """Compute free/busy information from calendar objects.
+
+    Recurring events are expanded (see `recur.occurrences`).
+
+    :param calendars: Iterator over (href, calendar) tuples
+    :param start: Start of the window (datetime)
+    :param end: End of the window (datetime)
+    :param cache: Optional `recur.ExpansionCache`
+    :return: A `Calendar` with a single VFREEBUSY
+    """
+    # Occurrences are found by day, in local time; busy_periods clips them
+    # to the exact window.
+    first = _utc(start).astimezone().date() - datetime.timedelta(1)
+    last = _utc(end).astimezone().date() + datetime.timedelta(1)
+    events = recur.occurrences(
+        calendars, first, last + datetime.timedelta(1), cache)
+    return freebusy(events, start, end)
@@ -0,0 +1,232 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Synchronization of GitHub issues to todo items.
+
+The GitHub client is passed in by the caller, so that anything with the
+same interface as `github.Github` (`search_issues`) can be used.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import urllib.parse
+
+from icalendar.prop import vDatetime
+from xdg.BaseDirectory import xdg_cache_home
+
+from dystros import utils
+
+STATE_MAP = {
+    "open": "NEEDS-ACTION",
+    "closed": "COMPLETED",
+    }
+
+# How often to do a full reconcile, rather than an incremental sync.
+DEFAULT_FULL_INTERVAL = datetime.timedelta(days=7)
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _format_timestamp(dt):
+    return dt.astimezone(datetime.timezone.utc).strftime(_TIMESTAMP_FORMAT)
+
+
+def _parse_timestamp(text):
+    if text is None:
+        return None
+    return datetime.datetime.strptime(text, _TIMESTAMP_FORMAT).replace(
+        tzinfo=datetime.timezone.utc)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class Watermark(object):
+    """Times of the last successful synchronizations.
+
+    :ivar last_success: Start time of the last successful run, or None
+    :ivar last_full: Start time of the last successful full run, or None
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_success = None
+        self.last_full = None
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            pass
+        else:
+            self.last_success = _parse_timestamp(state['last_success'])
+            self.last_full = _parse_timestamp(state['last_full'])
+
+    @classmethod
+    def for_query(cls, url, assignee):
+        """Open the watermark for syncing the issues of an assignee.
+
+        :param url: URL of the collection the todo items are stored in
+        :param assignee: GitHub login of the assignee
+        :return: A `Watermark`
+        """
+        key = hashlib.sha256(
+            ('%s\n%s' % (url, assignee)).encode('utf-8')).hexdigest()
+        return cls(os.path.join(
+            xdg_cache_home, 'dystros', 'github', key + '.json'))
+
+    def full_due(self, interval=DEFAULT_FULL_INTERVAL, now=None):
+        """Check whether a full reconcile is due.
+
+        :param interval: Time between full reconciles
+        :param now: Current time (defaults to the actual time)
+        :return: Boolean
+        """
+        if now is None:
+            now = _now()
+        return self.last_full is None or now - self.last_full >= interval
+
+    def save(self, started, full=False):
+        """Record a successful run.
+
+        :param started: Time at which the run started
+        :param full: Whether this was a full run
+        """
+        self.last_success = started
+        if full:
+            self.last_full = started
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        state = {}
+        for name in ('last_success', 'last_full'):
+            value = getattr(self, name)
+            state[name] = value and _format_timestamp(value)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def issue_query(assignee, since=None):
+    """Build the search query for the issues assigned to someone.
+
+    :param assignee: GitHub login of the assignee
+    :param since: Only include issues updated at or after this time
+    :return: Query string
+    """
+    query = "assignee:%s" % assignee
+    if since is not None:
+        query += " updated:>=%s" % _format_timestamp(since)
+    return query
+
+
+def update_todo(todo, issue):
+    """Update a todo item from an issue.
+
+    :param todo: A `Todo` component
+    :param issue: A GitHub issue
+    """
+    todo["CLASS"] = "PUBLIC"
+    todo["DESCRIPTION"] = issue.body
+    todo["URL"] = issue.html_url
+    todo["SUMMARY"] = "%s: %s" % (issue.repository.name, issue.title)
+    todo["X-GITHUB-URL"] = issue.url
+    todo["STATUS"] = STATE_MAP[issue.state]
+    if issue.milestone and issue.milestone.url:
+        todo["X-MILESTONE"] = issue.milestone.url
+    if issue.created_at:
+        todo["CREATED"] = vDatetime(issue.created_at)
+    if issue.closed_at:
+        todo["COMPLETED"] = vDatetime(issue.closed_at)
+    for label in issue.labels:
+        todo["X-LABEL"] = label.name
+
+
+def sync_issues(client, url, query, executor, index=None):
+    """Submit writes for the todo items of the issues matching a query.
+
+    Only items that are new or have changed are written.
+
+    :param client: GitHub client
+    :param url: URL of the collection to store todo items in
+    :param query: Search query, e.g. from `issue_query`
+    :param executor: `utils.WriteExecutor` to submit writes to
+    :param index: Optional UID index of the collection (see
+        `utils.get_uid_index`); if not specified, the server is queried for
+        each issue
+    :return: Number of issues seen
+    """
+    seen = 0
+    for issue in client.search_issues(query=query):
+        seen += 1
+        (old, new, href, etag, todo) = utils.create_or_update_calendar_item(
+            url, "VTODO", issue.url, index=index)
+        update_todo(todo, issue)
+        if etag is None:
+            logging.info("Adding todo item for %r", issue.title)
+            executor.add_member(url, 'text/calendar', new.to_ical(),
+                                key=issue.title)
+        elif utils.fingerprint(new) != utils.fingerprint(old):
+            logging.info("Updating todo item for %r", issue.title)
+            executor.put(urllib.parse.urljoin(url, href), 'text/calendar',
+                         new.to_ical(), if_match=[etag], key=issue.title)
+    return seen
+
+
+def synchronize(client, url, assignee, executor, watermark, full=False,
+                full_interval=DEFAULT_FULL_INTERVAL, now=None):
+    """Synchronize the issues assigned to someone.
+
+    Only issues updated since the last successful run are retrieved,
+    unless this is the first run, a full run was requested, or the last
+    full run is more than full_interval ago. For full runs, the collection
+    is indexed once rather than queried for each issue.
+
+    The watermark is only advanced if all writes succeed.
+
+    :param client: GitHub client
+    :param url: URL of the collection to store todo items in
+    :param assignee: GitHub login of the assignee
+    :param executor: `utils.WriteExecutor` to submit writes to
+    :param watermark: A `Watermark`
+    :param full: Whether to force a full reconcile
+    :param full_interval: Time between full reconciles
+    :param now: Start time of this run (defaults to the actual time)
+    :return: List of `utils.WriteResult` objects
+    """
+    if now is None:
+        now = _now()
+    full = (full or watermark.last_success is None or
+            watermark.full_due(full_interval, now))
+    if full:
+        index = utils.get_uid_index(url)
+        query = issue_query(assignee)
+    else:
+        index = None
+        query = issue_query(assignee, watermark.last_success)
+    seen = sync_issues(client, url, query, executor, index=index)
+    logging.info('Processed %d issues (%s)', seen,
+                 'full' if full else 'incremental')
+    results = executor.wait()
+    if all(result.ok for result in results):
+        watermark.save(now, full=full)
+    return results
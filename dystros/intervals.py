@@ -0,0 +1,107 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Index of events by the days they cover."""
+
+import datetime
+
+
+def _day(dt):
+    if getattr(dt, "date", None):
+        return dt.date()
+    return dt
+
+
+class IntervalIndex(object):
+    """Index for finding the events that overlap with a range of days.
+
+    This is an interval tree, stored as a sorted array: the subtree for
+    the range [lo, hi) has its root at the middle, and for each root the
+    last day covered by any event in its subtree is kept. Lookups take
+    O(log n + k) time, for k results.
+
+    As elsewhere, an event covers the days from the date of its start up
+    to and including the date of its end.
+
+    :param events: Iterable over event records (see
+        `filters.event_records`)
+    """
+
+    def __init__(self, events):
+        self._events = sorted(events, key=lambda ev: ev.sort_key)
+        self._first = [_day(ev.start) for ev in self._events]
+        self._last = [
+            _day(ev.end) if ev.end is not None else first
+            for (ev, first) in zip(self._events, self._first)]
+        self._max_last = list(self._last)
+        self._build(0, len(self._events))
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        ret = self._last[mid]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > ret:
+                ret = child
+        self._max_last[mid] = ret
+        return ret
+
+    def __len__(self):
+        return len(self._events)
+
+    def __iter__(self):
+        return iter(self._events)
+
+    def overlapping(self, start, end):
+        """Find the events that overlap with a range of days.
+
+        :param start: First day of the range
+        :param end: Day after the last day of the range
+        :return: List of events, in order of their sort key
+        """
+        ret = []
+        stack = [(0, len(self._events), False)]
+        while stack:
+            (lo, hi, visited) = stack.pop()
+            mid = (lo + hi) // 2
+            if visited:
+                if self._last[mid] >= start:
+                    ret.append(self._events[mid])
+                stack.append((mid + 1, hi, False))
+                continue
+            if lo >= hi or self._max_last[mid] < start:
+                continue
+            if self._first[mid] >= end:
+                # Everything from here on starts too late.
+                stack.append((lo, mid, False))
+                continue
+            stack.append((lo, hi, True))
+            stack.append((lo, mid, False))
+        return ret
+
+    def on_day(self, day):
+        """Find the events on a day.
+
+        :param day: A date
+        :return: List of events, in order of their sort key
+        """
+        return self.overlapping(day, day + datetime.timedelta(1))
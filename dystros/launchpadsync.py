@@ -0,0 +1,177 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Synchronization of Launchpad bug tasks to todo items.
+
+Attributes of launchpadlib objects are fetched lazily, one request at a
+time. The attributes needed for a todo item are therefore prefetched for
+several tasks concurrently, before the todo items are built.
+
+launchpadlib clients (and the httplib2 connections underneath them) are
+not thread-safe, so each worker thread uses a client of its own.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import threading
+import urllib.parse
+
+from dystros import utils
+
+STATUSES = [
+    'New',
+    'Incomplete',
+    'Confirmed',
+    'Triaged',
+    'In Progress',
+    'Fix Committed',
+    'Fix Released',
+    'Won\'t Fix',
+]
+
+DEFAULT_PREFETCH_JOBS = 8
+
+TaskInfo = collections.namedtuple(
+    'TaskInfo', ['self_link', 'web_link', 'bug_id', 'bug_title',
+                 'target_name', 'is_complete', 'tags', 'description'])
+TaskInfo.__doc__ = """Attributes of a bug task that are used for todo items.
+
+:ivar self_link: API URL of the task; used as UID
+:ivar web_link: URL of the task on the web
+:ivar bug_id: Bug number
+:ivar bug_title: Title of the bug
+:ivar target_name: Name of the target (e.g. project) of the task
+:ivar is_complete: Whether the task is complete
+:ivar tags: List of bug tags
+:ivar description: Bug description
+"""
+
+
+def fetch_task(task):
+    """Fetch the attributes of a bug task.
+
+    :param task: A launchpadlib bug task
+    :return: A `TaskInfo`
+    """
+    bug = task.bug
+    return TaskInfo(
+        self_link=task.self_link, web_link=task.web_link, bug_id=bug.id,
+        bug_title=bug.title, target_name=task.target.name,
+        is_complete=task.is_complete, tags=list(bug.tags),
+        description=bug.description)
+
+
+def prefetch(tasks, jobs=DEFAULT_PREFETCH_JOBS, login=None):
+    """Fetch the attributes of bug tasks concurrently.
+
+    At most `jobs` tasks are fetched at a time, and only that many are
+    read ahead of the consumer. Each worker thread calls `login` once to
+    get a launchpadlib client of its own, and loads the tasks it fetches
+    through that client. Without `login`, tasks are fetched one at a time
+    using the client they came from.
+
+    :param tasks: Iterable over launchpadlib bug tasks
+    :param jobs: Number of concurrent fetches
+    :param login: Callable returning a new launchpadlib client, or None
+    :return: Iterator over `TaskInfo` objects, in the order of tasks
+    """
+    if login is None or jobs <= 1:
+        for task in tasks:
+            yield fetch_task(task)
+        return
+    local = threading.local()
+
+    def fetch(self_link):
+        try:
+            client = local.client
+        except AttributeError:
+            client = local.client = login()
+        return fetch_task(client.load(self_link))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for task in tasks:
+            if len(pending) >= jobs:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fetch, task.self_link))
+        while pending:
+            yield pending.popleft().result()
+
+
+def update_todo(todo, info):
+    """Update a todo item from a bug task.
+
+    :param todo: A `Todo` component
+    :param info: A `TaskInfo`
+    """
+    todo["CLASS"] = "PUBLIC"
+    todo["URL"] = info.web_link
+    todo["SUMMARY"] = "%s: %s" % (info.target_name, info.bug_title)
+
+    if info.is_complete:
+        todo["STATUS"] = "COMPLETED"
+    else:
+        todo["STATUS"] = "NEEDS-ACTION"
+
+    # TODO(jelmer): Set CREATED and COMPLETED based on task.date_created
+    # and task.date_closed
+
+    # TODO(jelmer): Set RELATED-TO (SIBLING) based on task.related_tasks
+
+    # TODO(jelmer): Set COMMENT field based on task.messages
+
+    todo["CATEGORIES"] = info.tags
+
+    todo["DESCRIPTION"] = info.description
+
+
+def sync_tasks(tasks, url, executor, jobs=DEFAULT_PREFETCH_JOBS, login=None):
+    """Submit writes for the todo items of bug tasks.
+
+    The collection is indexed by UID once, rather than queried for each
+    task. Only items that are new or have changed are written.
+
+    :param tasks: Iterable over launchpadlib bug tasks
+    :param url: URL of the collection to store todo items in
+    :param executor: `utils.WriteExecutor` to submit writes to
+    :param jobs: Number of concurrent attribute fetches
+    :param login: Callable returning a new launchpadlib client, for use
+        by prefetch workers; without it, tasks are fetched serially
+    :return: Number of tasks seen
+    """
+    index = utils.get_uid_index(url)
+    seen = 0
+    for info in prefetch(tasks, jobs, login):
+        seen += 1
+        logging.info("Processing %s", info.bug_id)
+        (old, new, href, etag, todo) = utils.create_or_update_calendar_item(
+            url, "VTODO", info.self_link, index=index)
+        update_todo(todo, info)
+        if etag is None:
+            logging.info("Adding todo item for %r", info.self_link)
+            executor.add_member(url, 'text/calendar', new.to_ical(),
+                                key=info.self_link)
+        elif utils.fingerprint(new) != utils.fingerprint(old):
+            logging.info("Updating todo item for %r", info.bug_title)
+            executor.put(urllib.parse.urljoin(url, href), 'text/calendar',
+                         new.to_ical(), if_match=[etag], key=info.bug_title)
+    return seen
@@ -0,0 +1,171 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Calendar objects that are only parsed when needed."""
+
+import collections
+
+from dystros.scanner import (
+    decode_text,
+    decode_value,
+    scan_components,
+    split_line,
+    unfolded_lines,
+    )
+
+_SCANNED = (b'BEGIN', b'END', b'UID', b'DTSTART', b'CATEGORIES')
+
+ComponentSummary = collections.namedtuple(
+    'ComponentSummary', ['name', 'uid', 'dtstart', 'categories'])
+ComponentSummary.__doc__ = """Summary of a component, from a pre-scan.
+
+:ivar name: Component name (e.g. 'VEVENT')
+:ivar uid: UID, or None
+:ivar dtstart: Raw DTSTART value (e.g. '20170101T100000Z'), or None
+:ivar categories: List of categories
+"""
+
+
+def scan(data):
+    """Scan a calendar object for its components.
+
+    Only the properties needed to decide whether an object is interesting
+    are extracted; nothing else is decoded.
+
+    :param data: Calendar object, as bytes
+    :return: List of `ComponentSummary` objects, one for each component
+        directly inside the VCALENDAR
+    """
+    ret = []
+    depth = 0
+    current = None
+    for line in unfolded_lines(data):
+        if not line.upper().startswith(_SCANNED):
+            continue
+        (name, params, value) = split_line(line)
+        if name == b'BEGIN':
+            depth += 1
+            if depth == 2:
+                current = {'name': value.decode('utf-8').upper(),
+                           'uid': None, 'dtstart': None, 'categories': []}
+        elif name == b'END':
+            if depth == 2:
+                ret.append(ComponentSummary(**current))
+                current = None
+            depth -= 1
+        elif depth != 2:
+            continue
+        elif name == b'UID':
+            current['uid'] = decode_text(value.decode('utf-8'))
+        elif name == b'DTSTART':
+            current['dtstart'] = value.decode('utf-8')
+        elif name == b'CATEGORIES':
+            current['categories'].extend(
+                decode_value('CATEGORIES', {}, value.decode('utf-8')))
+    return ret
+
+
+class LazyCalendar(object):
+    """A calendar object that is only parsed when it is accessed.
+
+    Attribute and item access is passed on to the parsed `Calendar`, so
+    this can be used wherever a Calendar is expected. `scan` and
+    `component_names` do not require a full parse.
+
+    :param data: Calendar object, as bytes or str
+    :param etag: Optional etag of the object
+    """
+
+    def __init__(self, data, etag=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.data = data
+        self.etag = etag
+        self._summaries = None
+        self._scanned = {}
+        self._calendar = None
+
+    def __repr__(self):
+        return "<%s(%r)>" % (type(self).__name__, self.data[:40])
+
+    def scan(self):
+        """Pre-scan the components in this object.
+
+        :return: List of `ComponentSummary` objects
+        """
+        if self._summaries is None:
+            self._summaries = scan(self.data)
+        return self._summaries
+
+    def scan_components(self, names, props):
+        """Extract properties from the components in this object.
+
+        Results are kept, so repeated scans for the same properties are
+        cheap.
+
+        :param names: Names of components to return, or None for all
+        :param props: Names of properties to extract
+        :return: List of (component name, values) tuples; see
+            `scanner.scan_components`
+        """
+        key = (None if names is None else tuple(names), tuple(props))
+        try:
+            return self._scanned[key]
+        except KeyError:
+            ret = self._scanned[key] = list(
+                scan_components(self.data, names, props))
+            return ret
+
+    @property
+    def component_names(self):
+        """Set of names of the components in this object."""
+        return set(summary.name for summary in self.scan())
+
+    @property
+    def parsed(self):
+        """Whether this object has been fully parsed."""
+        return self._calendar is not None
+
+    @property
+    def calendar(self):
+        """The parsed `Calendar`."""
+        if self._calendar is None:
+            from icalendar.cal import Calendar
+            self._calendar = Calendar.from_ical(self.data)
+        return self._calendar
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.calendar, name)
+
+    def __getitem__(self, name):
+        return self.calendar[name]
+
+    def __contains__(self, name):
+        return name in self.calendar
+
+    def __eq__(self, other):
+        if isinstance(other, LazyCalendar):
+            other = other.calendar
+        return self.calendar == other
+
+    __hash__ = None
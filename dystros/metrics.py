@@ -0,0 +1,95 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Prometheus metrics for HTTP requests.
+
+This requires prometheus_client, which is only imported when a collector
+is created.
+"""
+
+from dystros import session
+
+LATENCY_BUCKETS = (
+    .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+# Powers of four, from 256 bytes to 64 MiB.
+SIZE_BUCKETS = tuple(4 ** i for i in range(4, 14))
+
+_LABELS = ['method', 'url_template', 'status']
+
+
+class RequestMetrics(object):
+    """Records requests in Prometheus histograms.
+
+    The metrics are registered in the given registry, so they are pushed
+    together with the other metrics of a job. Use `install` to start
+    recording requests.
+
+    :param registry: A `prometheus_client.CollectorRegistry`
+    :param prefix: Prefix for the metric names
+    """
+
+    def __init__(self, registry, prefix='dystros_http_request'):
+        from prometheus_client import Counter, Histogram
+        self.latency = Histogram(
+            prefix + '_latency_seconds',
+            'Time until the response headers were received',
+            _LABELS, buckets=LATENCY_BUCKETS, registry=registry)
+        self.duration = Histogram(
+            prefix + '_duration_seconds',
+            'Time until the response was read',
+            _LABELS, buckets=LATENCY_BUCKETS, registry=registry)
+        self.request_bytes = Histogram(
+            prefix + '_size_bytes', 'Size of request bodies',
+            _LABELS, buckets=SIZE_BUCKETS, registry=registry)
+        self.response_bytes = Histogram(
+            prefix + '_response_size_bytes', 'Size of response bodies',
+            _LABELS, buckets=SIZE_BUCKETS, registry=registry)
+        self.retries = Counter(
+            prefix + '_retries', 'Requests resent on a new connection',
+            _LABELS, registry=registry)
+
+    def __call__(self, info):
+        """Record a request.
+
+        :param info: A `session.RequestInfo`
+        """
+        labels = (info.method, info.url_template,
+                  str(info.status) if info.status is not None else 'error')
+        if info.latency is not None:
+            self.latency.labels(*labels).observe(info.latency)
+        self.duration.labels(*labels).observe(info.duration)
+        self.request_bytes.labels(*labels).observe(info.request_bytes)
+        self.response_bytes.labels(*labels).observe(info.response_bytes)
+        if info.retries:
+            self.retries.labels(*labels).inc(info.retries)
+
+    def install(self):
+        """Start recording requests.
+
+        :return: self
+        """
+        session.add_request_hook(self)
+        return self
+
+    def uninstall(self):
+        """Stop recording requests."""
+        session.remove_request_hook(self)
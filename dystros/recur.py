@@ -0,0 +1,281 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Expansion of recurring events."""
+
+import collections
+import datetime
+import re
+import threading
+
+from dateutil import rrule
+
+from dystros import filters, scanner
+
+# Properties needed to expand events, in the order expected by `expand`.
+PROPERTIES = filters.EventRecord.PROPERTIES + [
+    'RRULE', 'RDATE', 'EXDATE', 'RECURRENCE-ID']
+
+_RECORD_PROPERTIES = len(filters.EventRecord.PROPERTIES)
+_UID = PROPERTIES.index('UID')
+(_RRULE, _RDATE, _EXDATE, _RECURRENCE_ID) = range(
+    _RECORD_PROPERTIES, len(PROPERTIES))
+
+_UNTIL = re.compile(r'(?:^|;)UNTIL=([0-9TZ]+)', re.IGNORECASE)
+
+DEFAULT_CACHE_SIZE = 1024
+
+
+def _as_datetime(dt, tzinfo=None):
+    if isinstance(dt, datetime.datetime):
+        return dt
+    return datetime.datetime.combine(dt, datetime.time(), tzinfo)
+
+
+def _key(dt):
+    """Normalise a start time, for matching RECURRENCE-ID and EXDATE."""
+    if isinstance(dt, datetime.datetime) and dt.tzinfo is not None:
+        return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _value(values, i):
+    if values[i] is None:
+        return None
+    return values[i].value
+
+
+def _parse_rrule(text, dtstart):
+    """Parse a RRULE, with UNTIL interpreted relative to DTSTART.
+
+    dateutil requires UNTIL to be aware if and only if DTSTART is aware,
+    which calendars in the wild do not always get right.
+    """
+    m = _UNTIL.search(text)
+    if m is None:
+        return rrule.rrulestr(text, dtstart=dtstart)
+    until = scanner.decode_date(m.group(1).upper())
+    if not isinstance(until, datetime.datetime):
+        until = datetime.datetime.combine(
+            until, datetime.time(23, 59, 59), dtstart.tzinfo)
+    elif dtstart.tzinfo is None:
+        until = until.replace(tzinfo=None)
+    elif until.tzinfo is None:
+        until = until.replace(tzinfo=dtstart.tzinfo)
+    text = (text[:m.start()] + text[m.end():]).strip(';')
+    return rrule.rrulestr(text, dtstart=dtstart).replace(until=until)
+
+
+def _record(values, start=None, recurrence_id=None):
+    record = filters.EventRecord.from_values(values[:_RECORD_PROPERTIES])
+    if start is None:
+        return record
+    end = None
+    if record.end is not None:
+        end = start + (record.end - record.start)
+    return filters.EventRecord(
+        record.uid, record.summary, start, end, record.location,
+        record.status, record.classification, record.categories,
+        record.url, record.transparency, recurrence_id)
+
+
+def _in_window(record, start, end):
+    return filters.days_overlap(
+        record.start, record.end, start, end - datetime.timedelta(1))
+
+
+def is_recurring(components):
+    """Check whether a set of components with the same UID recur.
+
+    :param components: List of value tuples, for `PROPERTIES`
+    :return: Boolean
+    """
+    for values in components:
+        if (values[_RRULE] is not None or values[_RDATE] is not None or
+                values[_RECURRENCE_ID] is not None):
+            return True
+    return False
+
+
+def expand(components, start, end):
+    """Expand the occurrences of an event within a window.
+
+    Occurrences are generated lazily, and only up to the end of the
+    window. Overridden occurrences (with a RECURRENCE-ID) replace the
+    generated ones, and EXDATEs are removed.
+
+    :param components: List of value tuples (for `PROPERTIES`) for the
+        components with one UID, i.e. the master and any overrides
+    :param start: First day of the window
+    :param end: Day after the last day of the window
+    :return: Iterator over `filters.EventRecord` objects, not necessarily
+        in order
+    """
+    master = None
+    overrides = {}
+    for values in components:
+        recurrence_id = _value(values, _RECURRENCE_ID)
+        if recurrence_id is None:
+            master = values
+        else:
+            overrides[_key(recurrence_id)] = values
+    if master is not None:
+        for record in _expand_master(master, overrides, start, end):
+            yield record
+    # Overrides that were moved into the window from elsewhere.
+    for values in overrides.values():
+        record = _record(values)
+        record.recurrence_id = _value(values, _RECURRENCE_ID)
+        if _in_window(record, start, end):
+            yield record
+
+
+def _expand_master(master, overrides, start, end):
+    record = _record(master)
+    rule = _value(master, _RRULE)
+    rdates = _value(master, _RDATE)
+    if rule is None and not rdates:
+        if _in_window(record, start, end):
+            yield record
+        return
+    dtstart = record.start
+    is_date = not isinstance(dtstart, datetime.datetime)
+    dtstart = _as_datetime(dtstart)
+    rset = rrule.rruleset()
+    if rule is not None:
+        rset.rrule(_parse_rrule(rule, dtstart))
+    else:
+        rset.rdate(dtstart)
+    for rdate in rdates or []:
+        rdate = _as_datetime(rdate, dtstart.tzinfo)
+        if dtstart.tzinfo is None and rdate.tzinfo is not None:
+            rdate = rdate.replace(tzinfo=None)
+        rset.rdate(rdate)
+    exdates = set(_key(d) for d in _value(master, _EXDATE) or [])
+    duration = datetime.timedelta(0)
+    if record.end is not None:
+        duration = record.end - record.start
+    after = _as_datetime(start, dtstart.tzinfo) - duration
+    before = _as_datetime(end, dtstart.tzinfo)
+    for occurrence in rset.xafter(after, inc=True):
+        if occurrence >= before:
+            break
+        if is_date:
+            occurrence = occurrence.date()
+        key = _key(occurrence)
+        if key in exdates:
+            continue
+        if key in overrides:
+            values = overrides.pop(key)
+            ret = _record(values)
+            ret.recurrence_id = occurrence
+        else:
+            ret = _record(master, occurrence, occurrence)
+        if _in_window(ret, start, end):
+            yield ret
+
+
+class ExpansionCache(object):
+    """Cache of expanded occurrences, keyed by (UID, etag, window).
+
+    :param max_size: Maximum number of expansions to keep
+    :ivar hits: Number of lookups that were answered from the cache
+    :ivar misses: Number of lookups that were not
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Look up an expansion.
+
+        :param key: (uid, etag, start, end) tuple
+        :return: List of records, or None
+        """
+        with self._lock:
+            try:
+                ret = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return ret
+
+    def set(self, key, records):
+        """Store an expansion.
+
+        :param key: (uid, etag, start, end) tuple
+        :param records: List of records
+        """
+        with self._lock:
+            self._entries[key] = records
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+_default_cache = ExpansionCache()
+
+
+def occurrences(calendars, start, end, cache=None):
+    """Find the event occurrences within a window.
+
+    Expansions of recurring events are cached if the etag of the calendar
+    object is known (see `LazyCalendar`).
+
+    :param calendars: Iterator over (href, calendar) tuples
+    :param start: First day of the window
+    :param end: Day after the last day of the window
+    :param cache: Optional `ExpansionCache`; defaults to a cache shared by
+        all callers in this process
+    :return: Iterator over `filters.EventRecord` objects
+    """
+    if cache is None:
+        cache = _default_cache
+    for href, calendar in calendars:
+        etag = getattr(calendar, 'etag', None)
+        by_uid = collections.OrderedDict()
+        for values in filters.extract_vevents(
+                [(href, calendar)], props=PROPERTIES):
+            by_uid.setdefault(_value(values, _UID), []).append(values)
+        for (uid, components) in by_uid.items():
+            if not is_recurring(components):
+                for values in components:
+                    record = _record(values)
+                    if _in_window(record, start, end):
+                        yield record
+                continue
+            if etag is None:
+                for record in expand(components, start, end):
+                    yield record
+                continue
+            key = (uid, etag, start, end)
+            records = cache.get(key)
+            if records is None:
+                records = list(expand(components, start, end))
+                cache.set(key, records)
+            for record in records:
+                yield record
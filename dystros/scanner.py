@@ -0,0 +1,545 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Read-only scanner for iCalendar properties.
+
+This extracts a fixed set of properties from calendar objects into plain
+tuples, without building icalendar objects. It is meant for reporting,
+where only a few properties of each component are looked at.
+
+`split_calendar` uses the same line handling to split large feeds into
+calendar objects, one at a time.
+"""
+
+import collections
+import datetime
+import functools
+import re
+
+try:
+    import zoneinfo
+except ImportError:  # Python < 3.9
+    zoneinfo = None
+
+_FOLD = re.compile(br'\r?\n[ \t]')
+_TEXT_ESCAPE = re.compile(r'\\([\\;,nN])')
+_DURATION = re.compile(
+    r'^([-+]?)P(?:(\d+)W)?(?:(\d+)D)?'
+    r'(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+DATE_PROPERTIES = frozenset([
+    'COMPLETED', 'CREATED', 'DTEND', 'DTSTAMP', 'DTSTART', 'DUE',
+    'LAST-MODIFIED', 'RECURRENCE-ID'])
+DATE_LIST_PROPERTIES = frozenset(['EXDATE', 'RDATE'])
+INTEGER_PROPERTIES = frozenset(['PERCENT-COMPLETE', 'PRIORITY', 'SEQUENCE'])
+TEXT_LIST_PROPERTIES = frozenset(['CATEGORIES', 'RESOURCES'])
+DURATION_PROPERTIES = frozenset(['DURATION'])
+RAW_PROPERTIES = frozenset(['RRULE', 'URL'])
+
+# Properties that may occur more than once; their values are concatenated.
+MULTIPLE_PROPERTIES = DATE_LIST_PROPERTIES | TEXT_LIST_PROPERTIES
+
+Property = collections.namedtuple('Property', ['value', 'params'])
+Property.__doc__ = """A decoded property.
+
+:ivar value: Decoded value
+:ivar params: Dictionary with parameters
+"""
+
+
+def unfolded_lines(data):
+    """Iterate over the unfolded content lines in a calendar object.
+
+    :param data: Calendar object, as bytes, or an iterable over lines (e.g.
+        a file)
+    :return: Iterator over lines, as bytes
+    """
+    if isinstance(data, bytes):
+        for line in _FOLD.sub(b'', data).splitlines():
+            if line:
+                yield line
+        return
+    current = None
+    for line in data:
+        line = line.rstrip(b'\r\n')
+        if line[:1] in (b' ', b'\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def split_line(line):
+    """Split a content line.
+
+    :param line: Unfolded content line, as bytes
+    :return: Tuple with upper case name, parameters and value (all bytes);
+        parameters include the leading semicolon
+    """
+    end = len(line)
+    for c in b';:':
+        i = line.find(c)
+        if i != -1 and i < end:
+            end = i
+    quoted = False
+    for i in range(end, len(line)):
+        c = line[i]
+        if c == 0x22:
+            quoted = not quoted
+        elif c == 0x3a and not quoted:
+            return line[:end].upper(), line[end:i], line[i+1:]
+    return line[:end].upper(), line[end:], b''
+
+
+def parse_params(params):
+    """Parse the parameters of a content line.
+
+    :param params: Parameters, as returned by `split_line`
+    :return: Dictionary mapping upper case names to values
+    """
+    ret = {}
+    if not params:
+        return ret
+    for param in _split_unquoted(params.decode('utf-8'), ';')[1:]:
+        (name, sep, value) = param.partition('=')
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        ret[name.upper()] = value
+    return ret
+
+
+def _split_unquoted(text, sep):
+    ret = []
+    current = []
+    quoted = False
+    for c in text:
+        if c == '"':
+            quoted = not quoted
+        elif c == sep and not quoted:
+            ret.append(''.join(current))
+            current = []
+            continue
+        current.append(c)
+    ret.append(''.join(current))
+    return ret
+
+
+def _split_text_list(value):
+    ret = []
+    start = 0
+    i = 0
+    while i < len(value):
+        if value[i] == '\\':
+            i += 2
+            continue
+        if value[i] == ',':
+            ret.append(decode_text(value[start:i]))
+            start = i + 1
+        i += 1
+    ret.append(decode_text(value[start:]))
+    return ret
+
+
+def _unescape(m):
+    c = m.group(1)
+    if c in 'nN':
+        return '\n'
+    return c
+
+
+def encode_text(text):
+    """Encode a TEXT value.
+
+    :param text: Text
+    :return: Escaped value
+    """
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def decode_text(value):
+    """Decode a TEXT value.
+
+    :param value: Escaped value
+    :return: Unescaped text
+    """
+    return _TEXT_ESCAPE.sub(_unescape, value)
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(tzid):
+    """Look up a timezone by TZID.
+
+    Timezones are looked up with zoneinfo, or with dateutil on Pythons
+    that lack zoneinfo.
+
+    :param tzid: TZID, as used in a TZID parameter
+    :return: A tzinfo object, or None if the timezone is unknown
+    """
+    if zoneinfo is None:
+        from dateutil import tz
+        return tz.gettz(tzid) if tzid else None
+    try:
+        return zoneinfo.ZoneInfo(tzid)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def vtimezone_tzinfo(lines):
+    """Create a tzinfo object from a VTIMEZONE component.
+
+    :param lines: Unfolded content lines of the VTIMEZONE, as bytes
+    :return: A tzinfo object, or None if the VTIMEZONE can not be parsed
+    """
+    from icalendar.cal import Timezone
+    try:
+        return Timezone.from_ical(b'\r\n'.join(lines) + b'\r\n').to_tz()
+    except (KeyError, ValueError):
+        return None
+
+
+def decode_date(value, tzid=None, tzinfos=None):
+    """Decode a DATE or DATE-TIME value.
+
+    UTC times are returned as aware datetimes, as are times with a TZID
+    that is in tzinfos or known to zoneinfo. Floating times, and times in
+    unknown timezones, are returned as naive datetimes.
+
+    :param value: Value (e.g. '20170101T100000Z')
+    :param tzid: Optional TZID parameter
+    :param tzinfos: Optional dictionary mapping TZIDs to tzinfo objects,
+        e.g. for VTIMEZONEs in the calendar object
+    :return: A date or datetime
+    """
+    if len(value) == 8:
+        return datetime.date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+    dt = datetime.datetime(
+        int(value[:4]), int(value[4:6]), int(value[6:8]),
+        int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    if value.endswith('Z'):
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    if tzid is not None:
+        tz = None
+        if tzinfos:
+            tz = tzinfos.get(tzid)
+        if tz is None:
+            tz = get_timezone(tzid)
+        if tz is not None:
+            return dt.replace(tzinfo=tz)
+    return dt
+
+
+def decode_duration(value):
+    """Decode a DURATION value.
+
+    :param value: Value (e.g. 'PT1H30M')
+    :return: A timedelta
+    """
+    m = _DURATION.match(value)
+    if m is None:
+        raise ValueError('invalid duration %r' % value)
+    (sign, weeks, days, hours, minutes, seconds) = m.groups()
+    ret = datetime.timedelta(
+        weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+        minutes=int(minutes or 0), seconds=int(seconds or 0))
+    if sign == '-':
+        return -ret
+    return ret
+
+
+def decode_value(name, params, value, tzinfos=None):
+    """Decode a property value.
+
+    :param name: Property name
+    :param params: Dictionary with parameters
+    :param value: Raw value, as str
+    :param tzinfos: Optional dictionary mapping TZIDs to tzinfo objects
+    :return: Decoded value; a list for properties that can have multiple
+        values (e.g. CATEGORIES and EXDATE)
+    """
+    if name in DATE_PROPERTIES:
+        return decode_date(value, params.get('TZID'), tzinfos)
+    elif name in DATE_LIST_PROPERTIES:
+        # For periods (VALUE=PERIOD), only the start is kept.
+        return [decode_date(v.split('/', 1)[0], params.get('TZID'), tzinfos)
+                for v in value.split(',')]
+    elif name in INTEGER_PROPERTIES:
+        return int(value)
+    elif name in TEXT_LIST_PROPERTIES:
+        return _split_text_list(value)
+    elif name in DURATION_PROPERTIES:
+        return decode_duration(value)
+    elif name in RAW_PROPERTIES:
+        return value
+    else:
+        return decode_text(value)
+
+
+def _decode_values(props, entries, vtimezones, tzinfos):
+    for (i, params, value) in entries:
+        tzid = params.get('TZID')
+        if (tzid is not None and tzid not in tzinfos and
+                tzid in vtimezones and get_timezone(tzid) is None):
+            tzinfos[tzid] = vtimezone_tzinfo(vtimezones[tzid])
+    ret = [None] * len(props)
+    for (i, params, value) in entries:
+        prop = props[i]
+        decoded = decode_value(prop, params, value.decode('utf-8'), tzinfos)
+        if ret[i] is None:
+            ret[i] = Property(decoded, params)
+        elif prop in MULTIPLE_PROPERTIES:
+            ret[i].value.extend(decoded)
+    return tuple(ret)
+
+
+def scan_components(data, names, props):
+    """Extract properties from the components in a calendar object.
+
+    Only components directly inside the VCALENDAR are considered;
+    properties of nested components (e.g. VALARM) are ignored.
+
+    TZIDs that zoneinfo does not know (e.g. "W. Europe Standard Time") are
+    resolved using the VTIMEZONEs in the calendar object. Components with
+    a TZID that can not be resolved yet, because its VTIMEZONE comes later
+    or is missing, are returned at the end of the calendar object.
+
+    :param data: Calendar object, as bytes or an iterable over lines
+    :param names: Names of components to return, or None for all
+    :param props: Names of properties to extract
+    :return: Iterator over (component name, values) tuples; values is a
+        tuple with a `Property` (or None, if absent) for each name in props
+    """
+    wanted = dict((prop.encode('ascii'), i) for (i, prop) in enumerate(props))
+    depth = 0
+    # Raw properties of the component being read: (index, params, value)
+    entries = None
+    unresolved = False
+    # Unfolded lines of the VTIMEZONE being read
+    timezone = None
+    vtimezones = {}
+    tzinfos = {}
+    held = []
+    for line in unfolded_lines(data):
+        (name, params, value) = split_line(line)
+        if timezone is not None:
+            timezone.append(line)
+        if name == b'BEGIN':
+            depth += 1
+            if depth == 2:
+                component = value.decode('utf-8').upper()
+                if component == 'VTIMEZONE':
+                    timezone = [line]
+                    tzid = None
+                if names is None or component in names:
+                    entries = []
+                    unresolved = False
+        elif name == b'END':
+            if depth == 2:
+                if timezone is not None:
+                    if tzid is not None:
+                        vtimezones[tzid] = timezone
+                    timezone = None
+                if entries is not None and unresolved:
+                    held.append((component, entries))
+                elif entries is not None:
+                    yield component, _decode_values(
+                        props, entries, vtimezones, tzinfos)
+                entries = None
+            elif depth == 1:
+                for (held_component, held_entries) in held:
+                    yield held_component, _decode_values(
+                        props, held_entries, vtimezones, tzinfos)
+                held = []
+            depth -= 1
+        elif depth == 2:
+            if timezone is not None and name == b'TZID':
+                tzid = decode_text(value.decode('utf-8'))
+            if entries is not None and name in wanted:
+                params = parse_params(params)
+                ref = params.get('TZID')
+                if (ref is not None and ref not in vtimezones and
+                        get_timezone(ref) is None):
+                    unresolved = True
+                entries.append((wanted[name], params, value))
+    for (held_component, held_entries) in held:
+        yield held_component, _decode_values(
+            props, held_entries, vtimezones, tzinfos)
+
+
+def _content_lines(lines):
+    """Iterate over content lines, keeping their folded form.
+
+    :param lines: Iterable over physical lines, as bytes
+    :return: Iterator over (unfolded line, raw lines) tuples; the raw
+        lines are bytes, with CRLF line endings
+    """
+    unfolded = None
+    raw = []
+    for line in lines:
+        line = line.rstrip(b'\r\n')
+        if line[:1] in (b' ', b'\t'):
+            if unfolded is not None:
+                unfolded += line[1:]
+                raw.append(line + b'\r\n')
+            continue
+        if unfolded:
+            yield unfolded, b''.join(raw)
+        unfolded = line
+        raw = [line + b'\r\n']
+    if unfolded:
+        yield unfolded, b''.join(raw)
+
+
+def split_calendar(lines, names=('VEVENT', 'VTODO')):
+    """Split a calendar feed into calendar objects, one per UID.
+
+    The feed is read incrementally, so only the component being read, the
+    calendar properties and the timezones are kept in memory. Each object
+    gets the properties of the VCALENDAR that were seen so far, and the
+    VTIMEZONEs its components refer to. Exporters put VTIMEZONEs before
+    the components that use them; timezones that are defined later are
+    not included. Consecutive components with the same UID (e.g. a
+    recurring event and its overrides) end up in the same object. Other
+    components (e.g. VJOURNAL) are skipped.
+
+    Components are not held back to wait for others with the same UID, as
+    that would mean keeping the whole feed in memory. If they are not
+    adjacent, e.g. a RECURRENCE-ID override that appears after unrelated
+    events, the UID is reported more than once, each time with only the
+    components in that run.
+
+    :param lines: Iterable over lines, as bytes (e.g. a file)
+    :param names: Names of components to split out
+    :return: Iterator over (component name, UID, data) tuples; data is a
+        calendar object, as bytes
+    :raise KeyError: if a component does not have a UID
+    """
+    header = []
+    timezones = {}
+    # The object being built: [component name, UID, TZIDs, raw lines]
+    current = None
+    # The component being read, in the same form
+    component = None
+    depth = 0
+
+    def build(item):
+        (name, uid, tzids, raw) = item
+        return (name, uid, b''.join(
+            [b'BEGIN:VCALENDAR\r\n'] + header +
+            [timezones[tzid] for tzid in sorted(tzids) if tzid in timezones] +
+            raw + [b'END:VCALENDAR\r\n']))
+
+    for (line, raw) in _content_lines(lines):
+        (name, params, value) = split_line(line)
+        if name == b'BEGIN':
+            depth += 1
+            if depth == 2:
+                component = [value.decode('utf-8').upper(), None, set(), []]
+        elif name == b'END':
+            depth -= 1
+            if depth == 0:
+                if current is not None:
+                    yield build(current)
+                    current = None
+                del header[:]
+                timezones.clear()
+                continue
+        elif depth == 1:
+            header.append(raw)
+            continue
+        if component is None:
+            continue
+        component[3].append(raw)
+        if name in (b'UID', b'TZID') and depth == 2:
+            # For VTIMEZONEs, the TZID takes the place of the UID.
+            component[1] = decode_text(value.decode('utf-8'))
+        elif b'TZID' in params:
+            tzid = parse_params(params).get('TZID')
+            if tzid is not None:
+                component[2].add(tzid)
+        if name != b'END' or depth != 1:
+            continue
+        (comp_name, uid, tzids, comp_raw) = component
+        component = None
+        if comp_name == 'VTIMEZONE':
+            timezones[uid] = b''.join(comp_raw)
+        elif comp_name in names:
+            if uid is None:
+                raise KeyError('missing UID for %s' % comp_name)
+            if current is not None and current[1] == uid:
+                current[2].update(tzids)
+                current[3].extend(comp_raw)
+                continue
+            if current is not None:
+                yield build(current)
+            current = [comp_name, uid, set(tzids), comp_raw]
+
+
+def add_properties(data, calendar_props=(), component_props=(),
+                   names=None):
+    """Add properties to a calendar object, without parsing it.
+
+    Properties that are already set are left alone, unless they can occur
+    more than once (e.g. CATEGORIES).
+
+    :param data: Calendar object, as bytes (e.g. from `split_calendar`)
+    :param calendar_props: List of (name, value) tuples to add to the
+        VCALENDAR; values are str, and already escaped
+    :param component_props: List of (name, value) tuples to add to the
+        components directly inside the VCALENDAR
+    :param names: Names of the components to add properties to, or None
+        for all
+    :return: Calendar object, as bytes
+    """
+    ret = []
+    depth = 0
+    # Names of the properties of the VCALENDAR and the current component
+    present = [set(), set()]
+    component = None
+
+    def missing(props, present):
+        return [('%s:%s\r\n' % (name, value)).encode('utf-8')
+                for (name, value) in props
+                if name not in present or name in MULTIPLE_PROPERTIES]
+    for line in data.splitlines(True):
+        if line[:1] in (b' ', b'\t'):
+            ret.append(line)
+            continue
+        (name, params, value) = split_line(line.rstrip(b'\r\n'))
+        if name == b'BEGIN':
+            depth += 1
+            if depth == 2:
+                component = value.decode('utf-8').upper()
+                present[1] = set()
+        elif name == b'END':
+            if depth == 1:
+                ret.extend(missing(calendar_props, present[0]))
+            elif depth == 2 and (names is None or component in names):
+                ret.extend(missing(component_props, present[1]))
+            depth -= 1
+        elif depth in (1, 2):
+            present[depth - 1].add(name.decode('utf-8'))
+        ret.append(line)
+    return b''.join(ret)
@@ -0,0 +1,539 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Persistent keep-alive HTTP sessions."""
+
+import base64
+import collections
+import http.client
+import io
+import logging
+import re
+import select
+import threading
+import time
+import urllib.error
+import urllib.parse
+import zlib
+
+USER_AGENT = 'dystros/calutils'
+
+# Content codings that responses may use; see `ContentDecoder`.
+ACCEPT_ENCODING = 'gzip, deflate'
+
+DEFAULT_MAX_CONNECTIONS = 4
+
+# Methods that are sent again on a new connection if a pooled connection
+# fails after the request was sent. Other methods (e.g. POST, or PUT with
+# an If-Match header that only holds once) are only resent if sending the
+# request failed.
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PROPFIND', 'REPORT'])
+
+MAX_REDIRECTS = 5
+
+REDIRECT_STATUSES = frozenset([301, 302, 303, 307, 308])
+
+# Maximum number of unread bytes to drain from a response so that its
+# connection can be reused.
+_DRAIN_LIMIT = 65536
+
+_OBJECT_NAME = re.compile(r'/[^/]+\.(?:ics|vcf)$')
+
+RequestInfo = collections.namedtuple(
+    'RequestInfo', ['method', 'url', 'url_template', 'status', 'latency',
+                    'duration', 'request_bytes', 'response_bytes',
+                    'retries'])
+RequestInfo.__doc__ = """Measurements of a request, as passed to request hooks.
+
+:ivar method: HTTP method
+:ivar url: URL that was requested
+:ivar url_template: URL path with object names replaced (see
+    `url_template`)
+:ivar status: HTTP status, or None if no response was received
+:ivar latency: Seconds until the response headers were received, or None
+:ivar duration: Seconds until the response was closed, or the request
+    failed
+:ivar request_bytes: Size of the request body
+:ivar response_bytes: Number of bytes of the response body that were read
+:ivar retries: Number of times the request was resent because an idle
+    connection had been closed by the server
+"""
+
+_request_hooks = []
+
+
+def redirect_target(method, url, status, headers):
+    """Determine where to follow a redirect to.
+
+    301, 302 and 303 redirects are only followed for GET and HEAD, like
+    urllib does; 307 and 308 redirects are followed for all methods, with
+    the same request body.
+
+    :param method: HTTP method of the request
+    :param url: URL of the request
+    :param status: HTTP status of the response
+    :param headers: Response headers
+    :return: URL to send the request to instead, or None
+    """
+    if status not in REDIRECT_STATUSES:
+        return None
+    if status in (301, 302, 303) and method not in ('GET', 'HEAD'):
+        return None
+    location = headers.get('Location')
+    if not location:
+        return None
+    return urllib.parse.urljoin(url, location)
+
+
+def add_request_hook(hook):
+    """Register a function to call for each request.
+
+    Hooks are called with a `RequestInfo` when the response is closed, or
+    when the request fails without a response. Exceptions raised by hooks
+    are logged and otherwise ignored.
+
+    :param hook: Callable that takes a `RequestInfo`
+    """
+    _request_hooks.append(hook)
+
+
+def remove_request_hook(hook):
+    """Unregister a function registered with `add_request_hook`.
+
+    :param hook: The hook to remove
+    """
+    _request_hooks.remove(hook)
+
+
+def url_template(url):
+    """Reduce a URL to a template, for grouping requests.
+
+    The host is dropped, and the names of calendar objects and vCards are
+    replaced by '{object}'.
+
+    :param url: URL
+    :return: Template, e.g. '/cal/{object}'
+    """
+    parsed = urllib.parse.urlsplit(url)
+    ret = _OBJECT_NAME.sub('/{object}', parsed.path or '/')
+    if parsed.query:
+        ret += '?' + parsed.query
+    return ret
+
+
+class ContentDecoder(object):
+    """Streaming decoder for a gzip or deflate content coding.
+
+    :param encoding: Content-Encoding of the response
+    :raise ValueError: if the encoding is not supported
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding in ('gzip', 'x-gzip'):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            # Decided when the first data arrives.
+            self._obj = None
+        else:
+            raise ValueError('unsupported content coding %r' % encoding)
+
+    @classmethod
+    def for_headers(cls, headers):
+        """Create a decoder for a response, if needed.
+
+        :param headers: Response headers
+        :return: A `ContentDecoder`, or None if the body is not encoded
+        """
+        encoding = (headers.get('Content-Encoding') or '').strip().lower()
+        if encoding in ('', 'identity'):
+            return None
+        return cls(encoding)
+
+    def decompress(self, data):
+        """Decode the next part of the body.
+
+        :param data: Encoded data
+        :return: Decoded data
+        """
+        if self._obj is None:
+            # "deflate" is meant to be zlib-wrapped, but some servers send
+            # raw deflate data.
+            self._obj = zlib.decompressobj()
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data)
+
+    def flush(self):
+        """Return any remaining decoded data, at the end of the body."""
+        if self._obj is None:
+            return b''
+        return self._obj.flush()
+
+
+class RequestRecorder(object):
+    """Measures a single request, and passes the results to the hooks.
+
+    :param method: HTTP method
+    :param url: URL that is requested
+    :param body: Request body, or None
+    """
+
+    def __init__(self, method, url, body=None):
+        self.method = method
+        self.url = url
+        self.request_bytes = len(body or b'')
+        self.response_bytes = 0
+        self.retries = 0
+        self.status = None
+        self.latency = None
+        self._started = time.perf_counter()
+
+    def received(self, status):
+        """Record that the response headers were received."""
+        self.status = status
+        self.latency = time.perf_counter() - self._started
+
+    def finish(self):
+        """Record the end of the request, and call the hooks."""
+        if not _request_hooks:
+            return
+        info = RequestInfo(
+            self.method, self.url, url_template(self.url), self.status,
+            self.latency, time.perf_counter() - self._started,
+            self.request_bytes, self.response_bytes, self.retries)
+        for hook in list(_request_hooks):
+            try:
+                hook(info)
+            except Exception:
+                logging.exception('request hook %r failed', hook)
+
+
+class Response(object):
+    """Response to a request sent through a `Session`.
+
+    Closing the response (or leaving its context manager) returns the
+    underlying connection to the session pool. Bodies with a gzip or
+    deflate Content-Encoding are decoded as they are read.
+    """
+
+    def __init__(self, session, conn, response, url, recorder=None):
+        self._session = session
+        self._conn = conn
+        self._response = response
+        self._recorder = recorder
+        self._decoder = ContentDecoder.for_headers(response.headers)
+        self._decoded = b''
+        self._eof = False
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def _read_raw(self, amt=None):
+        data = self._response.read(amt)
+        if self._recorder is not None:
+            self._recorder.response_bytes += len(data)
+        return data
+
+    def read(self, amt=None):
+        if self._decoder is None:
+            return self._read_raw(amt)
+        while not self._eof and (amt is None or len(self._decoded) < amt):
+            data = self._read_raw(None if amt is None else max(amt, 8192))
+            if data:
+                self._decoded += self._decoder.decompress(data)
+            else:
+                self._decoded += self._decoder.flush()
+                self._eof = True
+        if amt is None:
+            amt = len(self._decoded)
+        ret = self._decoded[:amt]
+        self._decoded = self._decoded[amt:]
+        return ret
+
+    def close(self):
+        conn = self._conn
+        if conn is None:
+            return
+        self._conn = None
+        response = self._response
+        drained = 0
+        while not response.isclosed() and drained < _DRAIN_LIMIT:
+            chunk = response.read(8192)
+            if not chunk:
+                response.close()
+                break
+            drained += len(chunk)
+        if response.isclosed() and not response.will_close:
+            self._session._release(conn)
+        else:
+            response.close()
+            conn.close()
+        if self._recorder is not None:
+            self._recorder.response_bytes += drained
+            self._recorder.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Session(object):
+    """A keep-alive HTTP session for a single host.
+
+    Idle connections are pooled and reused, and a session can be shared
+    between threads. If credentials are set, they are sent pre-emptively
+    rather than after a 401 round trip. Like urllib, the *_proxy
+    environment variables are honoured. Redirects are returned to the
+    caller; `request` follows them.
+
+    :param scheme: URL scheme ('http' or 'https')
+    :param netloc: Host (and optional port) to connect to
+    :param credentials: Optional (user, password) tuple for Basic auth
+    :param max_connections: Maximum number of idle connections to keep
+    :param timeout: Optional socket timeout
+    :param accept_encoding: Content codings to accept for responses, or
+        None to only accept unencoded responses
+    """
+
+    def __init__(self, scheme, netloc, credentials=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, timeout=None,
+                 accept_encoding=ACCEPT_ENCODING):
+        if scheme not in ('http', 'https'):
+            raise ValueError('unsupported scheme %r' % scheme)
+        self.scheme = scheme
+        self.netloc = netloc
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.accept_encoding = accept_encoding
+        if credentials is not None:
+            self._authorization = 'Basic ' + base64.b64encode(
+                ('%s:%s' % credentials).encode('utf-8')).decode('ascii')
+        else:
+            self._authorization = None
+        self._lock = threading.Lock()
+        self._idle = []
+        self._proxy = _UNSET
+
+    def _get_proxy(self):
+        if self._proxy is _UNSET:
+            self._proxy = _proxy_for(self.scheme, self.netloc)
+        return self._proxy
+
+    def _connect(self):
+        proxy = self._get_proxy()
+        if proxy is None:
+            netloc = self.netloc
+        else:
+            netloc = proxy.netloc
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            if proxy is not None:
+                conn.set_tunnel(self.netloc, headers=proxy.headers)
+            return conn
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            if not _connection_dropped(conn):
+                return conn, True
+            conn.close()
+        return self._connect(), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """Send a request.
+
+        :param method: HTTP method
+        :param url: URL to request; must be on this session's host
+        :param body: Optional request body (as bytes)
+        :param headers: Optional dictionary with request headers
+        :return: A `Response`
+        :raise urllib.error.HTTPError: if the server returned an error status
+        """
+        parsed = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(
+            ('', '', parsed.path or '/', parsed.query, ''))
+        request_headers = {'User-Agent': USER_AGENT}
+        proxy = self._get_proxy()
+        if proxy is not None and self.scheme == 'http':
+            # Plain HTTP proxies take the full URL.
+            path = urllib.parse.urlunsplit(
+                (self.scheme, self.netloc, parsed.path or '/', parsed.query,
+                 ''))
+            request_headers.update(proxy.headers)
+        if self.accept_encoding is not None:
+            request_headers['Accept-Encoding'] = self.accept_encoding
+        if self._authorization is not None:
+            request_headers['Authorization'] = self._authorization
+        if headers:
+            request_headers.update(headers)
+        recorder = RequestRecorder(method, url, body)
+        while True:
+            conn, reused = self._acquire()
+            sent = False
+            try:
+                conn.request(method, path, body=body, headers=request_headers)
+                sent = True
+                response = conn.getresponse()
+            except ConnectionError:
+                conn.close()
+                if reused and (not sent or method in RETRY_METHODS):
+                    # The server closed the idle connection; try another.
+                    recorder.retries += 1
+                    continue
+                recorder.finish()
+                raise
+            except BaseException:
+                conn.close()
+                recorder.finish()
+                raise
+            break
+        recorder.received(response.status)
+        ret = Response(self, conn, response, url, recorder)
+        if ret.status >= 400:
+            with ret:
+                body = ret.read(_DRAIN_LIMIT)
+            raise urllib.error.HTTPError(
+                url, ret.status, ret.reason, ret.headers, io.BytesIO(body))
+        return ret
+
+
+_UNSET = object()
+
+Proxy = collections.namedtuple('Proxy', ['netloc', 'headers'])
+
+
+def _proxy_for(scheme, netloc):
+    """Find the proxy to use for a host, from the *_proxy variables.
+
+    :return: A `Proxy`, or None to connect directly
+    """
+    import urllib.request
+    proxy_url = urllib.request.getproxies().get(scheme)
+    host = urllib.parse.urlsplit('//' + netloc).hostname
+    if not proxy_url or urllib.request.proxy_bypass(host):
+        return None
+    parsed = urllib.parse.urlsplit(
+        proxy_url if '//' in proxy_url else '//' + proxy_url)
+    headers = {}
+    if parsed.username is not None:
+        credentials = '%s:%s' % (
+            urllib.parse.unquote(parsed.username),
+            urllib.parse.unquote(parsed.password or ''))
+        headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(
+            credentials.encode('utf-8')).decode('ascii')
+    netloc = parsed.hostname
+    if parsed.port is not None:
+        netloc = '%s:%d' % (netloc, parsed.port)
+    return Proxy(netloc, headers)
+
+
+def _connection_dropped(conn):
+    """Check whether an idle connection was closed by the server.
+
+    An idle connection should have nothing to read; if it is readable,
+    the server has closed it (or sent something unexpected).
+    """
+    if conn.sock is None:
+        return True
+    try:
+        readable = select.select([conn.sock], [], [], 0)[0]
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _lookup_credentials(url):
+    from dystros.config import GetConfig
+    config = GetConfig()
+    if 'user' not in config or 'password' not in config:
+        return None
+    base = urllib.parse.urlsplit(config.get('base_url', ''))
+    if base.netloc != urllib.parse.urlsplit(url).netloc:
+        return None
+    return (config['user'], config['password'])
+
+
+def get_session(url):
+    """Get the shared session for the host of a URL.
+
+    :param url: URL to get a session for
+    :return: A `Session`
+    """
+    parsed = urllib.parse.urlsplit(url)
+    key = (parsed.scheme, parsed.netloc)
+    with _sessions_lock:
+        try:
+            return _sessions[key]
+        except KeyError:
+            session = _sessions[key] = Session(
+                parsed.scheme, parsed.netloc,
+                credentials=_lookup_credentials(url))
+            return session
+
+
+def request(method, url, body=None, headers=None):
+    """Send a request using the shared session for its host.
+
+    Redirects are followed (see `redirect_target`), also to other hosts.
+    See `Session.request` for the parameters.
+    """
+    for i in range(MAX_REDIRECTS + 1):
+        response = get_session(url).request(
+            method, url, body=body, headers=headers)
+        target = redirect_target(method, url, response.status,
+                                 response.headers)
+        if target is None:
+            return response
+        response.close()
+        url = target
+    raise urllib.error.HTTPError(
+        url, response.status, 'too many redirects', response.headers, None)
@@ -0,0 +1,226 @@
+# encoding: utf-8
+#
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooĳ <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Local copies of collections, kept up to date using sync-collection."""
+
+import hashlib
+import json
+import logging
+import os
+import urllib.parse
+
+from xdg.BaseDirectory import xdg_cache_home
+
+from dystros import caldav
+
+
+def _hash(s):
+    return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+
+class SyncState(object):
+    """Sync token and local copy of the members of a collection.
+
+    :ivar token: Sync token of the last synchronization, or None
+    :ivar etags: Dictionary mapping hrefs to etags of the local copies
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.token = None
+        self.etags = {}
+        try:
+            with open(os.path.join(self.path, 'index.json'), 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            pass
+        else:
+            self.token = index['token']
+            self.etags = index['etags']
+
+    @classmethod
+    def for_collection(cls, url):
+        """Open the sync state for a collection.
+
+        :param url: URL of the collection
+        :return: A `SyncState`
+        """
+        return cls(os.path.join(xdg_cache_home, 'dystros', 'sync', _hash(url)))
+
+    def _object_path(self, href):
+        return os.path.join(self.path, 'objects', _hash(href))
+
+    def get(self, href):
+        """Return the local copy of a member.
+
+        :param href: Href of the member
+        :return: Contents (as bytes)
+        """
+        with open(self._object_path(href), 'rb') as f:
+            return f.read()
+
+    def set(self, href, etag, data):
+        """Store the local copy of a member.
+
+        :param href: Href of the member
+        :param etag: ETag of the member
+        :param data: Contents (as bytes)
+        """
+        path = self._object_path(href)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.etags[href] = etag
+
+    def remove(self, href):
+        """Remove the local copy of a member.
+
+        :param href: Href of the member
+        """
+        try:
+            os.unlink(self._object_path(href))
+        except FileNotFoundError:
+            pass
+        self.etags.pop(href, None)
+
+    def save(self):
+        """Write the index to disk."""
+        os.makedirs(self.path, exist_ok=True)
+        index_path = os.path.join(self.path, 'index.json')
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump({'token': self.token, 'etags': self.etags}, f)
+        os.replace(index_path + '.tmp', index_path)
+
+
+def fetch_objects(url, hrefs, batch_size=None, calendar_data=None):
+    """Fetch the contents of a set of calendar objects.
+
+    :param url: URL of the collection
+    :param hrefs: Hrefs of the objects to fetch
+    :param batch_size: Optional maximum number of objects per request
+    :param calendar_data: Optional calendar-data element, to request only
+        some components and properties (see `caldav.calendar_data`)
+    :return: Iterator over (href, etag, data) tuples; data is None for
+        objects that no longer exist
+    """
+    if calendar_data is None:
+        calendar_data = '{urn:ietf:params:xml:ns:caldav}calendar-data'
+    for (href, status, propstat) in caldav.calendar_multiget(
+            url, hrefs, ['{DAV:}getetag', calendar_data],
+            batch_size=batch_size):
+        etag = None
+        data = None
+        for prop, prop_status in propstat or []:
+            if prop_status != 'HTTP/1.1 200 OK':
+                continue
+            if prop.tag == '{DAV:}getetag':
+                etag = prop.text
+            elif prop.tag == '{urn:ietf:params:xml:ns:caldav}calendar-data':
+                data = prop.text.encode('utf-8')
+        yield (href, etag, data)
+
+
+def _is_truncated(url, href, status):
+    """Check whether a sync-collection response reports truncation.
+
+    Servers report a truncated result with a 507 status for the request
+    URI (RFC 6578, section 3.6).
+    """
+    if status is None or status.split(' ')[1:2] != ['507']:
+        return False
+    path = urllib.parse.urlsplit(urllib.parse.urljoin(url, href)).path
+    return path.rstrip('/') == urllib.parse.urlsplit(url).path.rstrip('/')
+
+
+def synchronize(url, state):
+    """Bring the local copy of a collection up to date.
+
+    Only members that were changed since the last synchronization are
+    fetched. If the server no longer accepts the stored sync token, the
+    full membership is listed again; local copies with matching etags
+    are kept. Truncated results are continued with the new sync token
+    until they are complete.
+
+    :param url: URL of the collection
+    :param state: A `SyncState`
+    """
+    full = state.token is None
+    token = state.token
+    seen = set()
+    stale = []
+    truncated = True
+    while truncated:
+        previous = token
+        try:
+            (token, responses) = caldav.sync_collection(
+                url, ['{DAV:}getetag'], token)
+        except caldav.InvalidSyncToken:
+            logging.info('Sync token for %s expired; doing full sync.', url)
+            full = True
+            (token, responses) = caldav.sync_collection(
+                url, ['{DAV:}getetag'])
+        truncated = False
+        for (href, status, propstat) in responses:
+            if _is_truncated(url, href, status):
+                truncated = True
+                continue
+            if status == 'HTTP/1.1 404 Not Found':
+                state.remove(href)
+                seen.discard(href)
+                continue
+            if propstat is None:
+                continue
+            etag = None
+            for prop, prop_status in propstat:
+                if prop.tag == '{DAV:}getetag':
+                    etag = prop.text
+            seen.add(href)
+            if etag is None or state.etags.get(href) != etag:
+                stale.append(href)
+        if truncated and token == previous:
+            # The server is not making progress; keep the old token, so
+            # that the remaining changes are listed again next time.
+            logging.warning(
+                'Truncated sync-collection result for %s did not advance '
+                'the sync token.', url)
+            token = state.token
+            full = False
+            break
+    for (href, etag, data) in fetch_objects(url, sorted(set(stale))):
+        if data is None:
+            state.remove(href)
+        else:
+            state.set(href, etag, data)
+    if full:
+        for href in set(state.etags) - seen:
+            state.remove(href)
+    state.token = token
+    state.save()
+
+
+def iter_objects(state):
+    """Iterate over the local copies of the members of a collection.
+
+    :param state: A `SyncState`
+    :return: Iterator over (href, data) tuples
+    """
+    for href in sorted(state.etags):
+        yield href, state.get(href)
@@ -22,7 +22,22 @@ import unittest
 
 def test_suite():
     names = [
+        'aiocaldav',
+        'cache',
+        'caldav',
         'filters',
+        'freebusy',
+        'githubsync',
+        'intervals',
+        'launchpadsync',
+        'lazy',
+        'metrics',
+        'recur',
+        'scanner',
+        'session',
+        'startup',
+        'sync',
+        'utils',
         ]
     module_names = ['dystros.tests.test_' + name for name in names]
     loader = unittest.TestLoader()
@@ -0,0 +1,512 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""A minimal in-memory CalDAV stand-in server for tests."""
+
+import base64
+import gzip
+import hashlib
+import http.server
+import threading
+import unittest
+import zlib
+from xml.etree import ElementTree as ET
+
+from dystros import session
+
+CALDAV_NS = 'urn:ietf:params:xml:ns:caldav'
+
+
+_ALL = object()
+
+
+def _subcomp(spec, name):
+    if spec is None:
+        return None
+    if spec is _ALL or spec.find('{%s}allcomp' % CALDAV_NS) is not None:
+        return _ALL
+    for comp in spec.findall('{%s}comp' % CALDAV_NS):
+        if comp.get('name') == name:
+            return comp
+    return None
+
+
+def _wants_prop(spec, name):
+    if spec is _ALL or spec.find('{%s}allprop' % CALDAV_NS) is not None:
+        return True
+    return name in [
+        prop.get('name') for prop in spec.findall('{%s}prop' % CALDAV_NS)]
+
+
+def _select(lines, comp):
+    """Select components and properties as in a partial calendar-data."""
+    stack = []
+    keep = False
+    for line in lines:
+        if line[:1] in (' ', '\t'):
+            if keep:
+                yield line
+            continue
+        name = line.split(':', 1)[0].split(';')[0]
+        if name == 'BEGIN':
+            compname = line.split(':', 1)[1].strip()
+            if stack:
+                spec = _subcomp(stack[-1], compname)
+            else:
+                spec = comp if comp.get('name') == compname else None
+            stack.append(spec)
+            keep = spec is not None
+        elif name == 'END':
+            keep = stack.pop() is not None
+        else:
+            keep = bool(stack) and stack[-1] is not None and _wants_prop(
+                stack[-1], name)
+        if keep:
+            yield line
+
+
+class CalDAVServer(http.server.ThreadingHTTPServer):
+    """In-memory CalDAV server.
+
+    :ivar resources: Dictionary mapping paths to (etag, content_type, data)
+    :ivar requests: List of (method, path) tuples for all requests received
+    :ivar connections: Number of TCP connections accepted
+    :ivar fetched: List of hrefs requested in calendar-multiget reports
+    :ivar chunked: Whether to send response bodies with chunked encoding
+    :ivar changes: Dictionary mapping paths to the revision in which they
+        were last changed or removed
+    :ivar content_encoding: Content coding ('gzip' or 'deflate') to use for
+        responses, if the client accepts it; None to not encode responses
+    :ivar compressed_uploads: Whether to accept gzip-encoded request bodies
+        (otherwise, 415 is returned)
+    :ivar principal: Path of the current user principal
+    :ivar inbox: Path of the scheduling inbox of the principal
+    :ivar redirects: Dictionary mapping paths to (status, location) tuples
+        for redirects
+    :ivar drop_requests: Number of upcoming requests for which the
+        connection is closed after reading the request, without a response
+    :ivar sync_limit: Maximum number of members in a sync-collection
+        response; longer results are truncated (RFC 6578, section 3.6)
+    """
+
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, credentials=None):
+        http.server.ThreadingHTTPServer.__init__(
+            self, ('127.0.0.1', 0), CalDAVRequestHandler)
+        self.credentials = credentials
+        self.resources = {}
+        self.requests = []
+        self.connections = 0
+        self.fetched = []
+        self.added = 0
+        self.chunked = False
+        self.revision = 0
+        self.changes = {}
+        self.content_encoding = None
+        self.compressed_uploads = False
+        self.principal = '/principal/'
+        self.inbox = '/inbox/'
+        self.redirects = {}
+        self.drop_requests = 0
+        self.sync_limit = None
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def put_resource(self, path, data, content_type='text/calendar'):
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        with self.lock:
+            self.resources[path] = (etag, content_type, data)
+            self.revision += 1
+            self.changes[path] = self.revision
+        return etag
+
+    def delete_resource(self, path):
+        with self.lock:
+            del self.resources[path]
+            self.revision += 1
+            self.changes[path] = self.revision
+
+    def sync_token(self, revision=None):
+        return '%ssync/%d' % (
+            self.url, self.revision if revision is None else revision)
+
+
+class ServerTestCase(unittest.TestCase):
+    """Test case that runs a `CalDAVServer` for each test.
+
+    Idle connections of the shared session for the server are closed
+    after each test.
+
+    :ivar server: The running `CalDAVServer`
+    :ivar url: URL of the calendar collection on the server
+    """
+
+    server_credentials = None
+
+    def setUp(self):
+        super(ServerTestCase, self).setUp()
+        self.server = CalDAVServer(credentials=self.server_credentials)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.addCleanup(self._close_session)
+        self.url = self.server.url + 'cal/'
+
+    def _close_session(self):
+        session.get_session(self.server.url).close()
+
+
+class CalDAVRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        http.server.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length)
+
+    def _send(self, status, body=b'', content_type=None, headers=None):
+        encoding = self.server.content_encoding
+        if (body and encoding is not None and
+                encoding in self.headers.get('Accept-Encoding', '')):
+            if encoding == 'gzip':
+                body = gzip.compress(body)
+            else:
+                body = zlib.compress(body)
+            headers = dict(headers or {})
+            headers['Content-Encoding'] = encoding
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.server.chunked and body:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 1000):
+                chunk = body[i:i+1000]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _check_auth(self):
+        if self.server.credentials is None:
+            return True
+        expected = 'Basic ' + base64.b64encode(
+            ('%s:%s' % self.server.credentials).encode('utf-8')).decode(
+                'ascii')
+        if self.headers.get('Authorization') == expected:
+            return True
+        self._send(401, headers={'WWW-Authenticate': 'Basic realm="test"'})
+        return False
+
+    def _dispatch(self):
+        body = self._read_body()
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path))
+            drop = self.server.drop_requests > 0
+            if drop:
+                self.server.drop_requests -= 1
+        if drop:
+            self.close_connection = True
+            return
+        if not self._check_auth():
+            return
+        if self.path in self.server.redirects:
+            (status, location) = self.server.redirects[self.path]
+            self._send(status, headers={'Location': location})
+            return
+        if self.headers.get('Content-Encoding'):
+            if (self.headers['Content-Encoding'] != 'gzip' or
+                    not self.server.compressed_uploads):
+                self._send(415)
+                return
+            body = gzip.decompress(body)
+        handler = getattr(self, 'handle_' + self.command, None)
+        if handler is None:
+            self._send(405)
+        else:
+            handler(body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _dispatch
+    do_PROPFIND = do_REPORT = _dispatch
+
+    def _members(self, path):
+        if not path.endswith('/'):
+            return []
+        with self.server.lock:
+            return sorted(
+                p for p in self.server.resources
+                if p.startswith(path) and '/' not in p[len(path):])
+
+    def _get_prop(self, path, prop):
+        """Return the value of a property, as a string or XML element."""
+        name = prop.tag
+        resource = self.server.resources.get(path)
+        if name == '{DAV:}getetag' and resource is not None:
+            return resource[0]
+        if name == '{%s}calendar-data' % CALDAV_NS and resource is not None:
+            data = resource[2].decode('utf-8')
+            comp = prop.find('{%s}comp' % CALDAV_NS)
+            if comp is not None:
+                data = ''.join(_select(data.splitlines(True), comp))
+            return data
+        if name == '{DAV:}add-member' and path.endswith('/'):
+            href = ET.Element('{DAV:}href')
+            href.text = path + '?add-member'
+            return href
+        if name == '{DAV:}current-user-principal':
+            href = ET.Element('{DAV:}href')
+            href.text = self.server.principal
+            return href
+        if (name == '{%s}schedule-inbox-URL' % CALDAV_NS and
+                path == self.server.principal):
+            href = ET.Element('{DAV:}href')
+            href.text = self.server.inbox
+            return href
+        return None
+
+    def _send_multistatus(self, hrefs, props, sync_token=None,
+                          truncated=False):
+        multistatus = ET.Element('{DAV:}multistatus')
+        for href in hrefs:
+            response = ET.SubElement(multistatus, '{DAV:}response')
+            ET.SubElement(response, '{DAV:}href').text = href
+            if href not in self.server.resources and href != self.path:
+                ET.SubElement(response, '{DAV:}status').text = (
+                    'HTTP/1.1 404 Not Found')
+                continue
+            found = ET.Element('{DAV:}prop')
+            missing = ET.Element('{DAV:}prop')
+            for prop in props:
+                value = self._get_prop(href, prop)
+                if value is None:
+                    ET.SubElement(missing, prop.tag)
+                    continue
+                el = ET.SubElement(found, prop.tag)
+                if isinstance(value, str):
+                    el.text = value
+                else:
+                    el.append(value)
+            for (prop, status) in [(found, '200 OK'),
+                                   (missing, '404 Not Found')]:
+                if len(prop):
+                    propstat = ET.SubElement(response, '{DAV:}propstat')
+                    ET.SubElement(propstat, '{DAV:}status').text = (
+                        'HTTP/1.1 %s' % status)
+                    propstat.append(prop)
+        if truncated:
+            response = ET.SubElement(multistatus, '{DAV:}response')
+            ET.SubElement(response, '{DAV:}href').text = self.path
+            ET.SubElement(response, '{DAV:}status').text = (
+                'HTTP/1.1 507 Insufficient Storage')
+        if sync_token is not None:
+            ET.SubElement(multistatus, '{DAV:}sync-token').text = sync_token
+        self._send(207, ET.tostring(multistatus), 'application/xml')
+
+    def handle_PROPFIND(self, body):
+        props = list(ET.fromstring(body).find('{DAV:}prop'))
+        hrefs = [self.path]
+        if self.headers.get('Depth', 'infinity') != '0':
+            hrefs.extend(self._members(self.path))
+        self._send_multistatus(hrefs, props)
+
+    def _matches(self, data, filter):
+        lines = data.decode('utf-8').splitlines()
+        for el in filter:
+            if el.tag == '{%s}comp-filter' % CALDAV_NS:
+                if 'BEGIN:%s' % el.get('name') not in lines:
+                    return False
+                if not self._matches(data, el):
+                    return False
+            elif el.tag == '{%s}prop-filter' % CALDAV_NS:
+                values = [line.split(':', 1)[1] for line in lines
+                          if line.split(':', 1)[0].split(';')[0] ==
+                          el.get('name')]
+                if not values:
+                    return False
+                match = el.find('{%s}text-match' % CALDAV_NS)
+                if match is not None and match.text not in values:
+                    return False
+            elif el.tag == '{%s}time-range' % CALDAV_NS:
+                if not self._in_time_range(lines, el):
+                    return False
+        return True
+
+    def _in_time_range(self, lines, el):
+        def value(name):
+            for line in lines:
+                if line.split(':', 1)[0].split(';')[0] == name:
+                    v = line.split(':', 1)[1].rstrip('Z')
+                    return (v + 'T000000')[:15] + 'Z'
+        start = value('DTSTART')
+        if start is None:
+            return False
+        end = value('DTEND') or start
+        if el.get('end') is not None and start >= el.get('end'):
+            return False
+        if any(line.startswith(('RRULE', 'RDATE')) for line in lines):
+            # Recurrences are not expanded; later ones may overlap.
+            return True
+        if el.get('start') is not None and end <= el.get('start'):
+            return el.get('start') == start == end
+        return True
+
+    def handle_REPORT(self, body):
+        req = ET.fromstring(body)
+        if req.tag == '{%s}calendar-query' % CALDAV_NS:
+            props = list(req.find('{DAV:}prop'))
+            filter = req.find('{%s}filter' % CALDAV_NS)
+            hrefs = [
+                href for href in self._members(self.path)
+                if filter is None or
+                self._matches(self.server.resources[href][2], filter)]
+            self._send_multistatus(hrefs, props)
+        elif req.tag == '{%s}calendar-multiget' % CALDAV_NS:
+            props = list(req.find('{DAV:}prop'))
+            hrefs = [el.text for el in req.findall('{DAV:}href')]
+            with self.server.lock:
+                self.server.fetched.extend(hrefs)
+            self._send_multistatus(hrefs, props)
+        elif req.tag == '{DAV:}sync-collection':
+            self._sync_collection(req)
+        elif req.tag == '{%s}free-busy-query' % CALDAV_NS:
+            self._free_busy_query(req.find('{%s}time-range' % CALDAV_NS))
+        else:
+            self._send(403)
+
+    def _free_busy_query(self, time_range):
+        # Only events with UTC start and end times are taken into account.
+        lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'BEGIN:VFREEBUSY',
+                 'DTSTART:%s' % time_range.get('start'),
+                 'DTEND:%s' % time_range.get('end')]
+        for href in self._members(self.path):
+            event = self.server.resources[href][2].decode('utf-8').splitlines()
+            if not self._in_time_range(event, time_range):
+                continue
+            values = dict(
+                (line.split(':', 1)[0].split(';')[0], line.split(':', 1)[1])
+                for line in event if ':' in line)
+            if (values.get('DTSTART', '').endswith('Z') and
+                    values.get('DTEND', '').endswith('Z')):
+                lines.append('FREEBUSY:%s/%s' % (
+                    values['DTSTART'], values['DTEND']))
+        lines.extend(['END:VFREEBUSY', 'END:VCALENDAR', ''])
+        self._send(200, '\r\n'.join(lines).encode('utf-8'),
+                   'text/calendar')
+
+    def _sync_collection(self, req):
+        props = list(req.find('{DAV:}prop'))
+        token = req.find('{DAV:}sync-token').text
+        with self.server.lock:
+            current_token = self.server.sync_token()
+            if token:
+                prefix = self.server.sync_token(0)[:-1]
+                try:
+                    if not token.startswith(prefix):
+                        raise ValueError(token)
+                    since = int(token[len(prefix):])
+                except ValueError:
+                    self._send(
+                        403, b'<d:error xmlns:d="DAV:"><d:valid-sync-token/>'
+                        b'</d:error>', 'application/xml')
+                    return
+            else:
+                since = 0
+            changes = sorted(
+                (revision, path)
+                for (path, revision) in self.server.changes.items()
+                if revision > since and path.startswith(self.path) and
+                '/' not in path[len(self.path):] and
+                (since or path in self.server.resources))
+            limit = self.server.sync_limit
+            truncated = limit is not None and len(changes) > limit
+            if truncated:
+                changes = changes[:limit]
+                current_token = self.server.sync_token(changes[-1][0])
+        self._send_multistatus(
+            sorted(path for (revision, path) in changes), props,
+            current_token, truncated)
+
+    def handle_GET(self, body):
+        try:
+            (etag, content_type, data) = self.server.resources[self.path]
+        except KeyError:
+            self._send(404)
+        else:
+            self._send(200, data, content_type, {'ETag': etag})
+
+    def handle_PUT(self, body):
+        current = self.server.resources.get(self.path)
+        if_match = self.headers.get('If-Match')
+        if if_match is not None and (
+                current is None or current[0] not in [
+                    t.strip() for t in if_match.split(',')]):
+            self._send(412)
+            return
+        etag = self.server.put_resource(
+            self.path, body, self.headers.get('Content-Type'))
+        self._send(204 if current else 201, headers={'ETag': etag})
+
+    def handle_POST(self, body):
+        if not self.path.endswith('?add-member'):
+            # Other queries stand in for add-member URLs that have moved.
+            self._send(404 if '?' in self.path else 405)
+            return
+        with self.server.lock:
+            self.server.added += 1
+            path = '%snew-%d.ics' % (
+                self.path[:-len('?add-member')], self.server.added)
+        etag = self.server.put_resource(
+            path, body, self.headers.get('Content-Type'))
+        self._send(201, headers={'ETag': etag, 'Location': path})
+
+    def handle_DELETE(self, body):
+        try:
+            self.server.delete_resource(self.path)
+        except KeyError:
+            self._send(404)
+        else:
+            self._send(204)
@@ -0,0 +1,154 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import asyncio
+import urllib.error
+
+from dystros import aiocaldav, caldav
+from dystros.tests.server import ServerTestCase
+from dystros.tests.test_utils import example
+
+
+class AsyncCalDAVTests(ServerTestCase):
+
+    def run_async(self, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                aiocaldav.close_sessions()
+        return asyncio.run(run())
+
+    def test_calendar_query(self):
+        self.server.put_resource('/cal/1.ics', example('uid1'))
+        self.server.put_resource('/cal/2.ics', example('uid2', 'other'))
+
+        async def query():
+            return [href async for (href, status, propstat) in
+                    aiocaldav.calendar_query(
+                        self.url, ['{DAV:}getetag'],
+                        caldav.comp_filter(
+                            'VCALENDAR', caldav.comp_filter(
+                                'VEVENT', caldav.prop_filter(
+                                    'UID', caldav.text_match('uid2')))))]
+        self.assertEqual(['/cal/2.ics'], self.run_async(query()))
+
+    def test_get_all_calendars_concurrently(self):
+        for i in range(10):
+            self.server.put_resource(
+                '/cal%d/1.ics' % i, example('uid%d' % i))
+        self.server.chunked = True
+
+        async def fetch(url):
+            return [str(cal.subcomponents[0]['UID']) async for (href, cal) in
+                    aiocaldav.get_all_calendars(url)]
+
+        async def fetch_all():
+            return await asyncio.gather(*[
+                fetch(self.server.url + 'cal%d/' % i) for i in range(10)])
+        self.assertEqual(
+            [['uid%d' % i] for i in range(10)], self.run_async(fetch_all()))
+
+    def test_get_all_calendars_partial(self):
+        self.server.put_resource('/cal/1.ics', example('uid1'))
+
+        async def fetch():
+            return [cal.subcomponents[0] async for (href, cal) in
+                    aiocaldav.get_all_calendars(
+                        self.url, calendar_data=caldav.partial_calendar_data(
+                            'VEVENT', ['UID']))]
+        [vevent] = self.run_async(fetch())
+        self.assertEqual('uid1', vevent['UID'])
+        self.assertNotIn('SUMMARY', vevent)
+
+    def test_getprop(self):
+        etag = self.server.put_resource('/cal/1.ics', example('uid1'))
+
+        async def getprop():
+            return [(href, propstat[0][0].text) async for
+                    (href, status, propstat) in aiocaldav.getprop(
+                        self.url + '1.ics', ['{DAV:}getetag'])]
+        self.assertEqual([('/cal/1.ics', etag)], self.run_async(getprop()))
+
+    def test_get_put_add_member(self):
+        etag = self.server.put_resource('/cal/1.ics', example('uid1'))
+
+        async def write():
+            await aiocaldav.put(
+                self.url + '1.ics', 'text/calendar', example('uid1', 'new'),
+                if_match=[etag])
+            await aiocaldav.add_member(
+                self.url, 'text/calendar', example('uid2'))
+            return await aiocaldav.get(self.url + '1.ics')
+        (new_etag, data) = self.run_async(write())
+        self.assertEqual(example('uid1', 'new'), data)
+        self.assertEqual(self.server.resources['/cal/1.ics'][0], new_etag)
+        self.assertEqual(
+            example('uid2'), self.server.resources['/cal/new-1.ics'][2])
+        self.assertEqual(1, self.server.connections)
+
+    def test_error(self):
+        async def get():
+            return await aiocaldav.get(self.url + 'missing.ics')
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.run_async(get())
+        self.assertEqual(404, cm.exception.code)
+
+    def test_compressed(self):
+        self.server.content_encoding = 'gzip'
+        self.server.put_resource('/cal/1.ics', example('uid1'))
+
+        async def get():
+            return await aiocaldav.get(self.url + '1.ics')
+        (etag, data) = self.run_async(get())
+        self.assertEqual(example('uid1'), data)
+
+    def test_redirect(self):
+        self.server.put_resource('/cal/1.ics', example('uid1'))
+        self.server.redirects['/old/1.ics'] = (301, '/cal/1.ics')
+
+        async def get():
+            return await aiocaldav.get(self.server.url + 'old/1.ics')
+        (etag, data) = self.run_async(get())
+        self.assertEqual(example('uid1'), data)
+
+    def test_retry(self):
+        self.server.put_resource('/cal/1.ics', example('uid1'))
+
+        async def get_twice():
+            await aiocaldav.get(self.url + '1.ics')
+            self.server.drop_requests = 1
+            return await aiocaldav.get(self.url + '1.ics')
+        (etag, data) = self.run_async(get_twice())
+        self.assertEqual(example('uid1'), data)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_no_retry_after_send(self):
+        self.server.put_resource('/cal/1.ics', example('uid1'))
+
+        async def get_and_add():
+            await aiocaldav.get(self.url + '1.ics')
+            self.server.drop_requests = 1
+            await aiocaldav.post(self.url + '?add-member', 'text/calendar',
+                                 example('uid2'))
+        with self.assertRaises(ConnectionError):
+            self.run_async(get_and_add())
+        self.assertEqual(
+            [('GET', '/cal/1.ics'), ('POST', '/cal/?add-member')],
+            self.server.requests)
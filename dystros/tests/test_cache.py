@@ -0,0 +1,104 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import os
+import shutil
+import tempfile
+
+from dystros import utils
+from dystros.cache import ObjectCache
+from dystros.tests.server import ServerTestCase
+
+import unittest
+
+EXAMPLE = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:%s\r
+SUMMARY:%s\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+class ObjectCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        super(ObjectCacheTests, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_get_set(self):
+        cache = ObjectCache(self.path)
+        self.assertIs(None, cache.get('http://a/cal/', '/cal/1.ics', '"1"'))
+        cache.set('http://a/cal/', '/cal/1.ics', '"1"', b'data')
+        self.assertEqual(
+            b'data', cache.get('http://a/cal/', '/cal/1.ics', '"1"'))
+        self.assertIs(None, cache.get('http://a/cal/', '/cal/1.ics', '"2"'))
+        self.assertIs(None, cache.get('http://b/cal/', '/cal/1.ics', '"1"'))
+
+    def test_variant(self):
+        cache = ObjectCache(self.path)
+        cache.set('http://a/cal/', '/cal/1.ics', '"1"', b'full')
+        cache.set('http://a/cal/', '/cal/1.ics', '"1"', b'partial', 'summary')
+        self.assertEqual(
+            b'full', cache.get('http://a/cal/', '/cal/1.ics', '"1"'))
+        self.assertEqual(
+            b'partial',
+            cache.get('http://a/cal/', '/cal/1.ics', '"1"', 'summary'))
+
+    def test_evict(self):
+        cache = ObjectCache(self.path, max_size=1000)
+        for i in range(10):
+            href = '/cal/%d.ics' % i
+            cache.set('http://a/cal/', href, '"1"', b'x' * 200)
+            os.utime(cache._entry_path('http://a/cal/', href), (i, i))
+        self.assertIs(None, cache.get('http://a/cal/', '/cal/0.ics', '"1"'))
+        self.assertEqual(
+            b'x' * 200, cache.get('http://a/cal/', '/cal/9.ics', '"1"'))
+        self.assertLessEqual(
+            sum(e[2] for e in cache._entries()), cache.max_size)
+
+
+class GetAllCalendarsCacheTests(ServerTestCase):
+
+    def setUp(self):
+        super(GetAllCalendarsCacheTests, self).setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.cache = ObjectCache(path)
+
+    def summaries(self):
+        del self.server.fetched[:]
+        return sorted(
+            str(cal.subcomponents[0]['SUMMARY'])
+            for (href, cal) in utils.get_all_calendars(
+                self.url, cache=self.cache))
+
+    def test_only_fetches_changed(self):
+        self.server.put_resource('/cal/a.ics', EXAMPLE % (b'a', b'A'))
+        self.server.put_resource('/cal/b.ics', EXAMPLE % (b'b', b'B'))
+        self.assertEqual(['A', 'B'], self.summaries())
+        self.assertEqual(['/cal/a.ics', '/cal/b.ics'], self.server.fetched)
+        self.server.put_resource('/cal/b.ics', EXAMPLE % (b'b', b'B2'))
+        self.assertEqual(['A', 'B2'], self.summaries())
+        self.assertEqual(['/cal/b.ics'], self.server.fetched)
+        self.assertEqual(['A', 'B2'], self.summaries())
+        self.assertEqual([], self.server.fetched)
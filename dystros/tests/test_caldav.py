@@ -17,5 +17,207 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA  02110-1301, USA.
 
+import datetime
+import io
+from xml.etree import ElementTree as ET
+
+from dystros import caldav, utils
+from dystros.tests.server import ServerTestCase
+
 import unittest
 
+RESPONSE = b"""\
+<d:response xmlns:d="DAV:">
+<d:href>/cal/%d.ics</d:href>
+<d:propstat>
+<d:prop><d:getetag>"%d"</d:getetag></d:prop>
+<d:status>HTTP/1.1 200 OK</d:status>
+</d:propstat>
+</d:response>
+"""
+
+
+def multistatus(count):
+    return (b'<?xml version="1.0"?>\n<d:multistatus xmlns:d="DAV:">\n' +
+            b''.join(RESPONSE % (i, i) for i in range(count)) +
+            b'</d:multistatus>\n')
+
+
+class ReadCountingFile(io.BytesIO):
+
+    def __init__(self, data):
+        io.BytesIO.__init__(self, data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        ret = io.BytesIO.read(self, size)
+        self.bytes_read += len(ret)
+        return ret
+
+
+class MultistatusTests(unittest.TestCase):
+
+    def test_iterparse(self):
+        responses = list(caldav.multistat_iterparse_responses(
+            io.BytesIO(multistatus(3))))
+        self.assertEqual(
+            ['/cal/0.ics', '/cal/1.ics', '/cal/2.ics'],
+            [href for (href, status, propstat) in responses])
+        (href, status, propstat) = responses[1]
+        self.assertIs(None, status)
+        [(prop, prop_status)] = propstat
+        self.assertEqual('{DAV:}getetag', prop.tag)
+        self.assertEqual('"1"', prop.text)
+        self.assertEqual('HTTP/1.1 200 OK', prop_status)
+
+    def test_iterparse_matches_extract(self):
+        data = multistatus(5)
+        self.assertEqual(
+            [(href, status, [(p.text, s) for (p, s) in propstat])
+             for (href, status, propstat) in
+             caldav.multistat_extract_responses(ET.fromstring(data))],
+            [(href, status, [(p.text, s) for (p, s) in propstat])
+             for (href, status, propstat) in
+             caldav.multistat_iterparse_responses(io.BytesIO(data))])
+
+    def test_iterparse_incremental(self):
+        f = ReadCountingFile(multistatus(5000))
+        responses = caldav.multistat_iterparse_responses(f)
+        self.assertEqual('/cal/0.ics', next(responses)[0])
+        self.assertLess(f.bytes_read, len(f.getvalue()) // 2)
+
+    def test_iterparse_forbids_entities(self):
+        data = (b'<?xml version="1.0"?>\n'
+                b'<!DOCTYPE d [<!ENTITY e "boom">]>\n'
+                b'<d:multistatus xmlns:d="DAV:">&e;</d:multistatus>')
+        self.assertRaises(
+            Exception, list,
+            caldav.multistat_iterparse_responses(io.BytesIO(data)))
+
+
+class FilterTests(unittest.TestCase):
+
+    def test_time_range(self):
+        utc = datetime.timezone.utc
+        el = caldav.time_range(
+            datetime.datetime(2017, 1, 2, 10, 30, tzinfo=utc),
+            datetime.datetime(2017, 1, 3, tzinfo=datetime.timezone(
+                datetime.timedelta(hours=2))))
+        self.assertEqual(
+            '{urn:ietf:params:xml:ns:caldav}time-range', el.tag)
+        self.assertEqual('20170102T103000Z', el.get('start'))
+        self.assertEqual('20170102T220000Z', el.get('end'))
+
+    def test_time_range_open(self):
+        el = caldav.time_range(end=datetime.date(2017, 1, 3))
+        self.assertIs(None, el.get('start'))
+        self.assertEqual(
+            datetime.datetime(2017, 1, 3).astimezone(
+                datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ'),
+            el.get('end'))
+
+    def test_partial_calendar_data(self):
+        el = caldav.partial_calendar_data('VEVENT', ['SUMMARY'])
+        self.assertEqual(
+            '{urn:ietf:params:xml:ns:caldav}calendar-data', el.tag)
+        [vcalendar] = el
+        self.assertEqual('VCALENDAR', vcalendar.get('name'))
+        self.assertEqual(
+            ['allprop', 'comp', 'comp'],
+            [child.tag.split('}')[1] for child in vcalendar])
+        (vtimezone, vevent) = vcalendar[1:]
+        self.assertEqual(
+            ['allprop', 'allcomp'],
+            [child.tag.split('}')[1] for child in vtimezone])
+        self.assertEqual('VEVENT', vevent.get('name'))
+        self.assertEqual(
+            ['SUMMARY', 'UID'], [child.get('name') for child in vevent])
+
+
+class CalendarQueryTests(ServerTestCase):
+
+    def test_calendar_query(self):
+        self.server.put_resource('/cal/a.ics', b'BEGIN:VCALENDAR\r\n')
+        self.server.put_resource('/cal/b.ics', b'BEGIN:VCALENDAR\r\n')
+        self.assertEqual(
+            ['/cal/a.ics', '/cal/b.ics'],
+            [href for (href, status, propstat) in caldav.calendar_query(
+                self.server.url + 'cal/', ['{DAV:}getetag'])])
+
+    def test_getprop(self):
+        etag = self.server.put_resource('/cal/a.ics', b'BEGIN:VCALENDAR\r\n')
+        [(href, status, propstat)] = caldav.getprop(
+            self.server.url + 'cal/a.ics', ['{DAV:}getetag'])
+        self.assertEqual('/cal/a.ics', href)
+        self.assertEqual(etag, propstat[0][0].text)
+
+    def test_calendar_multiget(self):
+        for name in 'abcde':
+            self.server.put_resource('/cal/%s.ics' % name, b'BEGIN:VCALENDAR')
+        hrefs = ['/cal/%s.ics' % name for name in 'abcdex']
+        responses = list(caldav.calendar_multiget(
+            self.server.url + 'cal/', hrefs, ['{DAV:}getetag'],
+            batch_size=4))
+        self.assertEqual(hrefs, [r[0] for r in responses])
+        self.assertEqual('HTTP/1.1 404 Not Found', responses[-1][1])
+        self.assertEqual(
+            [('REPORT', '/cal/')] * 2, self.server.requests)
+
+    def test_time_range_query(self):
+        for (name, day) in [('a', b'20170101'), ('b', b'20170105')]:
+            self.server.put_resource(
+                '/cal/%s.ics' % name,
+                b'BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nDTSTART:%sT100000Z'
+                b'\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n' % day)
+        utc = datetime.timezone.utc
+        self.assertEqual(
+            ['/cal/b.ics'],
+            [href for (href, status, propstat) in caldav.calendar_query(
+                self.server.url + 'cal/', ['{DAV:}getetag'],
+                caldav.comp_filter('VCALENDAR', caldav.comp_filter(
+                    'VEVENT', caldav.time_range(
+                        datetime.datetime(2017, 1, 5, tzinfo=utc),
+                        datetime.datetime(2017, 1, 6, tzinfo=utc)))))])
+
+    def test_partial_calendar_data_query(self):
+        self.server.put_resource(
+            '/cal/a.ics',
+            b'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nBEGIN:VEVENT\r\nUID:a\r\n'
+            b'SUMMARY:A\r\nDESCRIPTION:Long\r\n description\r\n'
+            b'BEGIN:VALARM\r\nACTION:DISPLAY\r\nEND:VALARM\r\n'
+            b'END:VEVENT\r\nEND:VCALENDAR\r\n')
+        [(href, status, propstat)] = caldav.calendar_query(
+            self.server.url + 'cal/',
+            [caldav.partial_calendar_data('VEVENT', ['SUMMARY'])])
+        self.assertEqual(
+            ['BEGIN:VCALENDAR', 'VERSION:2.0', 'BEGIN:VEVENT', 'UID:a',
+             'SUMMARY:A', 'END:VEVENT', 'END:VCALENDAR'],
+            propstat[0][0].text.splitlines())
+
+    def test_freebusy_query(self):
+        self.server.put_resource(
+            '/cal/a.ics',
+            b'BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nDTSTART:20170101T100000Z\r\n'
+            b'DTEND:20170101T110000Z\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n')
+        utc = datetime.timezone.utc
+        data = caldav.freebusy_query(
+            self.server.url + 'cal/',
+            datetime.datetime(2017, 1, 1, tzinfo=utc),
+            datetime.datetime(2017, 1, 2, tzinfo=utc))
+        self.assertIn(b'FREEBUSY:20170101T100000Z/20170101T110000Z', data)
+        self.assertEqual([('REPORT', '/cal/')], self.server.requests)
+
+    def test_current_user_principal(self):
+        principal = caldav.get_current_user_principal(self.server.url + 'cal/')
+        self.assertEqual(self.server.url + 'principal/', principal)
+        self.assertEqual(
+            self.server.url + 'inbox/', utils.get_inbox_url(principal))
+
+    def test_compressed_report(self):
+        self.server.content_encoding = 'gzip'
+        for i in range(50):
+            self.server.put_resource(
+                '/cal/%d.ics' % i, b'BEGIN:VCALENDAR\r\n')
+        self.assertEqual(
+            50, len(list(caldav.calendar_query(
+                self.server.url + 'cal/', ['{DAV:}getetag']))))
@@ -17,8 +17,10 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA  02110-1301, USA.
 
+import datetime
+
 from icalendar.cal import Calendar
-from dystros import filters
+from dystros import filters, utils
 
 import unittest
 
@@ -69,3 +71,71 @@ class FilterTests(unittest.TestCase):
             [todo1.subcomponents[0]],
             list(filters.extract_vtodos([('foo.ics', event1), ('bar.ics', todo1)])))
 
+
+EXAMPLE_RECORDS = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:event1\r
+SUMMARY:Trip\r
+DTSTART;VALUE=DATE:20170103\r
+DURATION:P2D\r
+CATEGORIES:Travel,Work\r
+CLASS:PRIVATE\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:event2\r
+SUMMARY:Meeting\r
+DTSTART:20170102T100000Z\r
+DTEND:20170102T110000Z\r
+END:VEVENT\r
+BEGIN:VTODO\r
+UID:todo1\r
+SUMMARY:Due\r
+PRIORITY:3\r
+DUE:20170105T120000\r
+END:VTODO\r
+BEGIN:VTODO\r
+UID:todo2\r
+SUMMARY:Someday\r
+END:VTODO\r
+END:VCALENDAR\r
+"""
+
+
+class RecordTests(unittest.TestCase):
+
+    def test_event_records(self):
+        cal = Calendar.from_ical(EXAMPLE_RECORDS)
+        records = list(filters.event_records([('a.ics', cal)]))
+        self.assertEqual(['event1', 'event2'], [r.uid for r in records])
+        (trip, meeting) = records
+        self.assertEqual(datetime.date(2017, 1, 5), trip.end)
+        self.assertEqual(['Travel', 'Work'], trip.categories)
+        self.assertEqual('PRIVATE', trip.classification)
+        self.assertFalse(hasattr(trip, '__dict__'))
+        self.assertEqual(
+            [utils.keyEvent(c) for c in cal.walk('VEVENT')],
+            [r.sort_key for r in records])
+        self.assertTrue(trip.overlaps(datetime.date(2017, 1, 5), None))
+        self.assertFalse(trip.overlaps(None, datetime.date(2017, 1, 2)))
+
+    def test_from_component(self):
+        cal = Calendar.from_ical(EXAMPLE_RECORDS)
+        [record1, record2] = [
+            filters.EventRecord.from_component(c) for c in cal.walk('VEVENT')]
+        self.assertEqual(
+            (datetime.datetime(2017, 1, 2, 10, tzinfo=datetime.timezone.utc),
+             datetime.datetime(2017, 1, 2, 11, tzinfo=datetime.timezone.utc)),
+            (record2.start, record2.end))
+
+    def test_todo_records(self):
+        cal = Calendar.from_ical(EXAMPLE_RECORDS)
+        records = list(filters.todo_records([('a.ics', cal)]))
+        self.assertEqual(
+            [utils.keyTodo(c) for c in cal.walk('VTODO')],
+            [r.sort_key for r in records])
+        self.assertEqual(
+            (3, datetime.datetime(2017, 1, 5, 12, 0)),
+            (records[0].priority, records[0].due))
+        self.assertEqual((None, None), (records[1].priority, records[1].due))
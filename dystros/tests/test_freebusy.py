@@ -0,0 +1,131 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import datetime
+
+from dystros import freebusy, recur
+from dystros.filters import EventRecord
+from dystros.lazy import LazyCalendar
+
+import unittest
+
+utc = datetime.timezone.utc
+
+
+def at(day, hour, minute=0):
+    return datetime.datetime(2017, 1, day, hour, minute, tzinfo=utc)
+
+
+def event(start, end, status=None, transparency=None):
+    return EventRecord(
+        'uid', 'summary', start, end, status=status, transparency=transparency)
+
+
+RECURRING = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:standup\r
+DTSTART:20161201T093000Z\r
+DTEND:20161201T094500Z\r
+RRULE:FREQ=DAILY\r
+EXDATE:20170103T093000Z\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:standup\r
+RECURRENCE-ID:20170104T093000Z\r
+DTSTART:20170104T093000Z\r
+DTEND:20170104T094500Z\r
+STATUS:TENTATIVE\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+WHOLE_DAY = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:trip\r
+DTSTART;VALUE=DATE:20170103\r
+DURATION:P%dD\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+class BusyPeriodsTests(unittest.TestCase):
+
+    def test_merge(self):
+        self.assertEqual([
+            (at(1, 10), at(1, 12), freebusy.BUSY),
+            (at(1, 13), at(1, 14), freebusy.BUSY)],
+            freebusy.busy_periods([
+                event(at(1, 11), at(1, 12)),
+                event(at(1, 10), at(1, 11)),
+                event(at(1, 10, 30), at(1, 11, 30)),
+                event(at(1, 13), at(1, 14))], at(1, 0), at(2, 0)))
+
+    def test_busy_wins(self):
+        self.assertEqual([
+            (at(1, 9), at(1, 10), freebusy.BUSY_TENTATIVE),
+            (at(1, 10), at(1, 11), freebusy.BUSY),
+            (at(1, 11), at(1, 12), freebusy.BUSY_TENTATIVE)],
+            freebusy.busy_periods([
+                event(at(1, 9), at(1, 12), status='TENTATIVE'),
+                event(at(1, 10), at(1, 11))], at(1, 0), at(2, 0)))
+
+    def test_ignored(self):
+        self.assertEqual([], freebusy.busy_periods([
+            event(at(1, 9), at(1, 10), status='CANCELLED'),
+            event(at(1, 9), at(1, 10), transparency='TRANSPARENT'),
+            event(at(1, 9), None),
+            event(at(3, 9), at(3, 10))], at(1, 0), at(2, 0)))
+
+    def test_clipped(self):
+        self.assertEqual(
+            [(at(1, 0), at(1, 2), freebusy.BUSY)],
+            freebusy.busy_periods(
+                [event(datetime.datetime(2016, 12, 31, 22, tzinfo=utc),
+                       at(1, 2))], at(1, 0), at(2, 0)))
+
+
+class LocalFreeBusyTests(unittest.TestCase):
+
+    def test_recurring(self):
+        cal = freebusy.local_freebusy(
+            [('a.ics', LazyCalendar(RECURRING, '"1"'))], at(2, 0), at(5, 0),
+            recur.ExpansionCache())
+        [fb] = cal.walk('VFREEBUSY')
+        self.assertEqual(
+            [(at(2, 9, 30), at(2, 9, 45), 'BUSY'),
+             (at(4, 9, 30), at(4, 9, 45), 'BUSY-TENTATIVE')],
+            [(p.dt[0], p.dt[1], p.params['FBTYPE'])
+             for p in fb['FREEBUSY']])
+        self.assertEqual(at(2, 0), fb['DTSTART'].dt)
+
+    def test_whole_day_duration(self):
+        for days in (1, 2):
+            cal = freebusy.local_freebusy(
+                [('a.ics', LazyCalendar(WHOLE_DAY % days, '"1"'))],
+                at(1, 0), at(10, 0), recur.ExpansionCache())
+            [fb] = cal.walk('VFREEBUSY')
+            period = fb['FREEBUSY']
+            self.assertEqual(
+                (at(3, 0), at(3 + days, 0), 'BUSY'),
+                (period.dt[0], period.dt[1], period.params['FBTYPE']))
@@ -0,0 +1,194 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import datetime
+import os
+import shutil
+import tempfile
+
+from icalendar.cal import Calendar
+
+from dystros import githubsync, utils
+from dystros.tests.server import ServerTestCase
+
+import unittest
+
+
+class Repository(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Issue(object):
+
+    def __init__(self, number, title, state='open', updated_at=None):
+        self.url = 'https://api.github.com/repos/jelmer/dystros/issues/%d' % (
+            number)
+        self.html_url = 'https://github.com/jelmer/dystros/issues/%d' % number
+        self.title = title
+        self.body = 'Body of %s' % title
+        self.state = state
+        self.repository = Repository('dystros')
+        self.milestone = None
+        self.created_at = datetime.datetime(2017, 1, 1, 10, 0)
+        self.closed_at = None
+        self.labels = []
+        self.updated_at = updated_at
+
+
+class FakeGitHub(object):
+    """Stand-in for `github.Github`, answering from a list of issues."""
+
+    def __init__(self, issues):
+        self.issues = issues
+        self.queries = []
+
+    def search_issues(self, query):
+        self.queries.append(query)
+        since = None
+        for term in query.split():
+            if term.startswith('updated:>='):
+                since = datetime.datetime.strptime(
+                    term[len('updated:>='):], '%Y-%m-%dT%H:%M:%SZ').replace(
+                        tzinfo=datetime.timezone.utc)
+        return [issue for issue in self.issues
+                if since is None or issue.updated_at >= since]
+
+
+class FailingExecutor(object):
+    """Stand-in for `utils.WriteExecutor` for which all writes fail."""
+
+    def __init__(self):
+        self._results = []
+
+    def add_member(self, url, content_type, content, key=None):
+        self._results.append(utils.WriteResult(
+            key, 'POST', url, 500, Exception('failed')))
+
+    def wait(self):
+        results, self._results = self._results, []
+        return results
+
+
+def _time(day, hour=0):
+    return datetime.datetime(
+        2017, 1, day, hour, tzinfo=datetime.timezone.utc)
+
+
+class IssueQueryTests(unittest.TestCase):
+
+    def test_full(self):
+        self.assertEqual('assignee:jelmer', githubsync.issue_query('jelmer'))
+
+    def test_since(self):
+        self.assertEqual(
+            'assignee:jelmer updated:>=2017-01-02T10:00:00Z',
+            githubsync.issue_query('jelmer', _time(2, 10)))
+
+
+class WatermarkTests(unittest.TestCase):
+
+    def setUp(self):
+        super(WatermarkTests, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_roundtrip(self):
+        path = os.path.join(self.path, 'sub', 'state.json')
+        watermark = githubsync.Watermark(path)
+        self.assertIs(None, watermark.last_success)
+        self.assertTrue(watermark.full_due())
+        watermark.save(_time(1), full=True)
+        watermark.save(_time(2))
+        watermark = githubsync.Watermark(path)
+        self.assertEqual(_time(2), watermark.last_success)
+        self.assertEqual(_time(1), watermark.last_full)
+        self.assertFalse(watermark.full_due(now=_time(7)))
+        self.assertTrue(watermark.full_due(now=_time(8)))
+
+
+class SynchronizeTests(ServerTestCase):
+
+    def setUp(self):
+        super(SynchronizeTests, self).setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.watermark = githubsync.Watermark(
+            os.path.join(path, 'state.json'))
+
+    def synchronize(self, client, now, **kwargs):
+        with utils.WriteExecutor(2) as executor:
+            return githubsync.synchronize(
+                client, self.url, 'jelmer', executor, self.watermark,
+                now=now, **kwargs)
+
+    def summaries(self):
+        ret = []
+        for (etag, content_type, data) in self.server.resources.values():
+            todo = Calendar.from_ical(data).subcomponents[0]
+            ret.append((str(todo['SUMMARY']), str(todo['STATUS'])))
+        return sorted(ret)
+
+    def test_incremental(self):
+        issues = [Issue(1, 'first', updated_at=_time(1)),
+                  Issue(2, 'second', updated_at=_time(1))]
+        client = FakeGitHub(issues)
+        results = self.synchronize(client, _time(2))
+        self.assertEqual(['POST', 'POST'], [r.method for r in results])
+        self.assertEqual(['assignee:jelmer'], client.queries)
+        self.assertEqual(_time(2), self.watermark.last_full)
+
+        # Nothing changed, so nothing is written.
+        self.assertEqual([], self.synchronize(client, _time(3)))
+
+        issues[1].state = 'closed'
+        issues[1].updated_at = _time(3, 12)
+        results = self.synchronize(client, _time(4))
+        self.assertEqual(['PUT'], [r.method for r in results])
+        self.assertEqual(
+            ['assignee:jelmer',
+             'assignee:jelmer updated:>=2017-01-02T00:00:00Z',
+             'assignee:jelmer updated:>=2017-01-03T00:00:00Z'],
+            client.queries)
+        self.assertEqual(_time(4), self.watermark.last_success)
+        self.assertEqual(_time(2), self.watermark.last_full)
+        self.assertEqual(
+            [('dystros: first', 'NEEDS-ACTION'),
+             ('dystros: second', 'COMPLETED')], self.summaries())
+
+    def test_full(self):
+        client = FakeGitHub([Issue(1, 'first', updated_at=_time(1))])
+        self.synchronize(client, _time(2))
+        self.synchronize(client, _time(3), full=True)
+        self.synchronize(client, _time(12))
+        self.assertEqual(
+            ['assignee:jelmer', 'assignee:jelmer', 'assignee:jelmer'],
+            client.queries)
+        self.assertEqual(_time(12), self.watermark.last_full)
+        self.assertEqual(1, len(self.server.resources))
+
+    def test_failure_keeps_watermark(self):
+        client = FakeGitHub([Issue(1, 'first', updated_at=_time(1))])
+        executor = FailingExecutor()
+        results = githubsync.synchronize(
+            client, self.url, 'jelmer', executor, self.watermark,
+            now=_time(2))
+        self.assertEqual([500], [r.status for r in results])
+        self.assertIs(None, self.watermark.last_success)
@@ -0,0 +1,70 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import datetime
+import random
+
+from dystros.filters import EventRecord, days_overlap
+from dystros.intervals import IntervalIndex
+
+import unittest
+
+
+class IntervalIndexTests(unittest.TestCase):
+
+    def test_empty(self):
+        index = IntervalIndex([])
+        self.assertEqual(0, len(index))
+        self.assertEqual([], index.on_day(datetime.date(2017, 1, 1)))
+
+    def test_on_day(self):
+        trip = EventRecord(
+            'trip', 'Trip', datetime.date(2017, 1, 3),
+            datetime.date(2017, 1, 6))
+        meeting = EventRecord(
+            'meeting', 'Meeting', datetime.datetime(2017, 1, 4, 10, 0))
+        index = IntervalIndex([meeting, trip])
+        self.assertEqual([], index.on_day(datetime.date(2017, 1, 2)))
+        self.assertEqual(
+            [trip, meeting], index.on_day(datetime.date(2017, 1, 4)))
+        self.assertEqual([trip], index.on_day(datetime.date(2017, 1, 6)))
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(42)
+        base = datetime.date(2017, 1, 1)
+        events = []
+        for i in range(500):
+            start = base + datetime.timedelta(rng.randrange(365))
+            if rng.random() < 0.2:
+                end = None
+            else:
+                end = start + datetime.timedelta(rng.randrange(
+                    60 if rng.random() < 0.05 else 5))
+            events.append(EventRecord(str(i), str(i), start, end))
+        index = IntervalIndex(events)
+        for i in range(200):
+            start = base + datetime.timedelta(rng.randrange(-10, 375))
+            end = start + datetime.timedelta(rng.randrange(1, 20))
+            expected = sorted(
+                [ev for ev in events if days_overlap(
+                    ev.start, ev.end, start, end - datetime.timedelta(1))],
+                key=lambda ev: ev.sort_key)
+            self.assertEqual(
+                [ev.uid for ev in expected],
+                [ev.uid for ev in index.overlapping(start, end)])
@@ -0,0 +1,192 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import contextlib
+import threading
+import time
+
+from icalendar.cal import Calendar
+
+from dystros import launchpadsync, utils
+from dystros.tests.server import ServerTestCase
+
+import unittest
+
+
+class Remote(object):
+    """Stand-in for a launchpadlib entry.
+
+    Each attribute access takes a little while, like a round trip would.
+    """
+
+    def __init__(self, tracker, **attrs):
+        self._tracker = tracker
+        self._attrs = attrs
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        with self._tracker.enter():
+            return self._attrs[name]
+
+
+class Tracker(object):
+    """Keeps track of the number of concurrent attribute accesses."""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.current = 0
+        self.maximum = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def enter(self):
+        with self._lock:
+            self.current += 1
+            self.maximum = max(self.maximum, self.current)
+        time.sleep(self.delay)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.current -= 1
+
+
+def make_task(tracker, number, title='title', is_complete=False):
+    bug = Remote(tracker, id=number, title=title, tags=['tag'],
+                 description='Description of %s' % title)
+    target = Remote(tracker, name='dystros')
+    return Remote(
+        tracker,
+        self_link='https://api.launchpad.net/devel/dystros/+bug/%d' % number,
+        web_link='https://bugs.launchpad.net/dystros/+bug/%d' % number,
+        bug=bug, target=target, is_complete=is_complete)
+
+
+class Launchpad(object):
+    """Stand-in for a launchpadlib client.
+
+    Records the threads that use it, since real clients are not
+    thread-safe.
+    """
+
+    def __init__(self, tasks):
+        self._tasks = dict((task.self_link, task) for task in tasks)
+        self.threads = set()
+
+    def load(self, url):
+        self.threads.add(threading.get_ident())
+        return self._tasks[url]
+
+
+class LaunchpadFactory(object):
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.clients = []
+
+    def __call__(self):
+        client = Launchpad(self.tasks)
+        self.clients.append(client)
+        return client
+
+
+class PrefetchTests(unittest.TestCase):
+
+    def test_order(self):
+        tracker = Tracker()
+        tasks = [make_task(tracker, i) for i in range(10)]
+        login = LaunchpadFactory(tasks)
+        self.assertEqual(
+            list(range(10)),
+            [info.bug_id
+             for info in launchpadsync.prefetch(tasks, 4, login)])
+
+    def test_concurrent(self):
+        tracker = Tracker()
+        tasks = [make_task(tracker, i) for i in range(8)]
+        login = LaunchpadFactory(tasks)
+        list(launchpadsync.prefetch(tasks, 4, login))
+        self.assertGreater(tracker.maximum, 1)
+        self.assertLessEqual(tracker.maximum, 4)
+
+    def test_client_per_thread(self):
+        tracker = Tracker()
+        tasks = [make_task(tracker, i) for i in range(8)]
+        login = LaunchpadFactory(tasks)
+        list(launchpadsync.prefetch(tasks, 4, login))
+        self.assertLessEqual(len(login.clients), 4)
+        for client in login.clients:
+            self.assertEqual(1, len(client.threads))
+
+    def test_serial(self):
+        tracker = Tracker(delay=0)
+        tasks = [make_task(tracker, i) for i in range(3)]
+        list(launchpadsync.prefetch(tasks, 1, LaunchpadFactory(tasks)))
+        self.assertEqual(1, tracker.maximum)
+
+    def test_no_login(self):
+        # Without a way to create clients, tasks are fetched serially.
+        tracker = Tracker()
+        tasks = [make_task(tracker, i) for i in range(4)]
+        self.assertEqual(
+            list(range(4)),
+            [info.bug_id for info in launchpadsync.prefetch(tasks, 4)])
+        self.assertEqual(1, tracker.maximum)
+
+    def test_fetch_task(self):
+        tracker = Tracker(delay=0)
+        info = launchpadsync.fetch_task(
+            make_task(tracker, 1, 'Crash', is_complete=True))
+        self.assertEqual(launchpadsync.TaskInfo(
+            self_link='https://api.launchpad.net/devel/dystros/+bug/1',
+            web_link='https://bugs.launchpad.net/dystros/+bug/1',
+            bug_id=1, bug_title='Crash', target_name='dystros',
+            is_complete=True, tags=['tag'],
+            description='Description of Crash'), info)
+
+
+class SyncTasksTests(ServerTestCase):
+
+    def sync(self, tasks):
+        with utils.WriteExecutor(2) as executor:
+            seen = launchpadsync.sync_tasks(
+                tasks, self.url, executor, 4, LaunchpadFactory(tasks))
+            return seen, executor.wait()
+
+    def test_sync(self):
+        tracker = Tracker(delay=0)
+        tasks = [make_task(tracker, 1, 'first'), make_task(tracker, 2)]
+        (seen, results) = self.sync(tasks)
+        self.assertEqual(2, seen)
+        self.assertEqual(['POST', 'POST'], [r.method for r in results])
+
+        # Unchanged tasks are not written again.
+        del self.server.requests[:]
+        (seen, results) = self.sync(tasks)
+        self.assertEqual([], results)
+        self.assertEqual(['REPORT'], [m for (m, p) in self.server.requests])
+
+        tasks[0] = make_task(tracker, 1, 'first', is_complete=True)
+        (seen, results) = self.sync(tasks)
+        self.assertEqual(['PUT'], [r.method for r in results])
+        statuses = sorted(
+            str(Calendar.from_ical(data).subcomponents[0]['STATUS'])
+            for (etag, content_type, data) in self.server.resources.values())
+        self.assertEqual(['COMPLETED', 'NEEDS-ACTION'], statuses)
@@ -0,0 +1,108 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+from dystros import filters
+from dystros.lazy import ComponentSummary, LazyCalendar, scan
+
+import unittest
+
+EXAMPLE = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VTIMEZONE\r
+TZID:Europe/London\r
+BEGIN:STANDARD\r
+DTSTART:19701025T020000\r
+END:STANDARD\r
+END:VTIMEZONE\r
+BEGIN:VEVENT\r
+UID:event1\r
+DTSTART;TZID="Europe/London":20170101T100000\r
+CATEGORIES:Travel,Work\\, mostly\r
+CATEGORIES:Visit\r
+ ors\r
+BEGIN:VALARM\r
+UID:alarm\r
+END:VALARM\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+EXAMPLE_VTODO = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VTODO\r
+UID:todo1\r
+SUMMARY:do something\r
+END:VTODO\r
+END:VCALENDAR\r
+"""
+
+
+class ScanTests(unittest.TestCase):
+
+    def test_scan(self):
+        self.assertEqual([
+            ComponentSummary('VTIMEZONE', None, None, []),
+            ComponentSummary(
+                'VEVENT', 'event1', '20170101T100000',
+                ['Travel', 'Work, mostly', 'Visitors'])], scan(EXAMPLE))
+
+    def test_scan_empty(self):
+        self.assertEqual([], scan(b''))
+
+
+class LazyCalendarTests(unittest.TestCase):
+
+    def test_not_parsed(self):
+        cal = LazyCalendar(EXAMPLE_VTODO)
+        self.assertEqual(set(['VTODO']), cal.component_names)
+        self.assertFalse(cal.parsed)
+
+    def test_delegates(self):
+        cal = LazyCalendar(EXAMPLE_VTODO.decode('utf-8'))
+        self.assertEqual('VTODO', cal.subcomponents[0].name)
+        self.assertEqual('2.0', cal['VERSION'])
+        self.assertTrue(cal.parsed)
+        self.assertIn(b'UID:todo1', cal.to_ical())
+
+    def test_extract_skips_unparsed(self):
+        event = LazyCalendar(EXAMPLE)
+        todo = LazyCalendar(EXAMPLE_VTODO)
+        self.assertEqual(
+            ['event1'],
+            [str(ev['UID']) for ev in filters.extract_vevents(
+                [('event.ics', event), ('todo.ics', todo)])])
+        self.assertFalse(todo.parsed)
+
+    def test_with_category(self):
+        event = LazyCalendar(EXAMPLE)
+        todo = LazyCalendar(EXAMPLE_VTODO)
+        self.assertEqual(
+            ['event.ics'],
+            [href for (href, cal) in filters.with_category(
+                [('event.ics', event), ('todo.ics', todo)], 'Visitors')])
+        self.assertFalse(event.parsed)
+
+    def test_scan_components_kept(self):
+        cal = LazyCalendar(EXAMPLE)
+        first = cal.scan_components(['VEVENT'], ['UID'])
+        self.assertEqual('event1', first[0][1][0].value)
+        self.assertIs(first, cal.scan_components(['VEVENT'], ['UID']))
+        self.assertFalse(cal.parsed)
@@ -0,0 +1,54 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+from dystros import caldav, metrics
+from dystros.tests.server import ServerTestCase
+
+import unittest
+
+
+@unittest.skipIf(prometheus_client is None, 'prometheus_client not available')
+class RequestMetricsTests(ServerTestCase):
+
+    def setUp(self):
+        super(RequestMetricsTests, self).setUp()
+        self.registry = prometheus_client.CollectorRegistry()
+        self.metrics = metrics.RequestMetrics(self.registry).install()
+        self.addCleanup(self.metrics.uninstall)
+
+    def sample(self, name, **labels):
+        return self.registry.get_sample_value(name, labels)
+
+    def test_report(self):
+        self.server.put_resource('/cal/a.ics', b'BEGIN:VCALENDAR\r\n')
+        list(caldav.calendar_query(
+            self.server.url + 'cal/', ['{DAV:}getetag']))
+        labels = {'method': 'REPORT', 'url_template': '/cal/',
+                  'status': '207'}
+        self.assertEqual(1, self.sample(
+            'dystros_http_request_latency_seconds_count', **labels))
+        self.assertGreater(self.sample(
+            'dystros_http_request_response_size_bytes_sum', **labels), 0)
+        self.assertGreater(self.sample(
+            'dystros_http_request_size_bytes_sum', **labels), 0)
@@ -0,0 +1,141 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import datetime
+
+from dystros import recur
+from dystros.lazy import LazyCalendar
+
+import unittest
+
+DAILY = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:standup\r
+SUMMARY:Standup\r
+DTSTART;TZID=Europe/London:20000101T093000\r
+DURATION:PT15M\r
+RRULE:FREQ=DAILY\r
+EXDATE;TZID=Europe/London:20170103T093000\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:standup\r
+RECURRENCE-ID;TZID=Europe/London:20170104T093000\r
+SUMMARY:Late standup\r
+DTSTART;TZID=Europe/London:20170104T140000\r
+DURATION:PT15M\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:standup\r
+RECURRENCE-ID;TZID=Europe/London:20161231T093000\r
+SUMMARY:Postponed standup\r
+DTSTART;TZID=Europe/London:20170102T160000\r
+DURATION:PT15M\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+WEEKLY = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:weekly\r
+SUMMARY:Bins\r
+DTSTART;VALUE=DATE:20170102\r
+RRULE:FREQ=WEEKLY;UNTIL=20170116\r
+RDATE;VALUE=DATE:20170125\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:single\r
+SUMMARY:Once\r
+DTSTART;VALUE=DATE:20170103\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+def day(*args):
+    return datetime.date(2017, *args)
+
+
+class OccurrencesTests(unittest.TestCase):
+
+    def occurrences(self, data, start, end, etag='"1"', cache=None):
+        if cache is None:
+            cache = recur.ExpansionCache()
+        return sorted(
+            (r.sort_key, r.summary) for r in recur.occurrences(
+                [('a.ics', LazyCalendar(data, etag))], start, end, cache))
+
+    def test_overrides_and_exdates(self):
+        self.assertEqual([
+            ((day(1, 1), (9, 30)), 'Standup'),
+            ((day(1, 2), (9, 30)), 'Standup'),
+            ((day(1, 2), (16, 0)), 'Postponed standup'),
+            ((day(1, 4), (14, 0)), 'Late standup'),
+            ((day(1, 5), (9, 30)), 'Standup')],
+            self.occurrences(DAILY, day(1, 1), day(1, 6)))
+
+    def test_long_running_daily(self):
+        start = datetime.date(2030, 3, 1)
+        occurrences = self.occurrences(
+            DAILY, start, start + datetime.timedelta(31))
+        self.assertEqual(31, len(occurrences))
+        # Wall clock time is kept across daylight saving changes.
+        self.assertEqual(
+            set([(9, 30)]), set(key[1] for (key, summary) in occurrences))
+
+    def test_recurrence_id(self):
+        [record] = recur.occurrences(
+            [('a.ics', LazyCalendar(DAILY))],
+            datetime.date(2020, 6, 1), datetime.date(2020, 6, 2))
+        self.assertEqual(record.start, record.recurrence_id)
+        self.assertEqual(datetime.timedelta(minutes=15),
+                         record.end - record.start)
+        self.assertEqual('Europe/London', str(record.start.tzinfo))
+
+    def test_dates_until_rdate(self):
+        self.assertEqual([
+            ((day(1, 2), (0, 0)), 'Bins'),
+            ((day(1, 3), (0, 0)), 'Once'),
+            ((day(1, 9), (0, 0)), 'Bins'),
+            ((day(1, 16), (0, 0)), 'Bins'),
+            ((day(1, 25), (0, 0)), 'Bins')],
+            self.occurrences(WEEKLY, day(1, 1), day(2, 1)))
+
+    def test_cache(self):
+        cache = recur.ExpansionCache()
+        expected = self.occurrences(DAILY, day(1, 1), day(2, 1), cache=cache)
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+        self.assertEqual(
+            expected,
+            self.occurrences(DAILY, day(1, 1), day(2, 1), cache=cache))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        self.occurrences(DAILY, day(1, 1), day(2, 1), '"2"', cache=cache)
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+        self.occurrences(DAILY, day(1, 1), day(2, 1), None, cache=cache)
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_cache_evicts(self):
+        cache = recur.ExpansionCache(max_size=2)
+        for i in range(3):
+            cache.set(i, [])
+        self.assertIs(None, cache.get(0))
+        self.assertEqual([], cache.get(2))
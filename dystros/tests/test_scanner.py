@@ -0,0 +1,336 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import datetime
+from io import BytesIO
+
+from icalendar.cal import Calendar
+
+from dystros import filters, scanner
+from dystros.lazy import LazyCalendar
+
+import unittest
+
+EXAMPLE = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//dystros//test//EN\r
+BEGIN:VEVENT\r
+UID:event1\r
+DTSTAMP:20170101T090000Z\r
+DTSTART;TZID="America/New_York":20170101T100000\r
+DURATION:PT1H30M\r
+SUMMARY:Meeting\\, with "quotes"\\; and more\r
+DESCRIPTION:A long description that is folded over \r
+ multiple lines\\nwith a newline\r
+LOCATION:Room 1\r
+CATEGORIES:Work,Travel\\, abroad\r
+CATEGORIES:Visitors\r
+RRULE:FREQ=WEEKLY;COUNT=3\r
+EXDATE;TZID=America/New_York:20170108T100000,20170115T100000\r
+EXDATE;TZID=America/New_York:20170122T100000\r
+PRIORITY:3\r
+URL:http://example.com/?a=b,c\r
+BEGIN:VALARM\r
+ACTION:DISPLAY\r
+DESCRIPTION:Alarm\r
+TRIGGER:-PT15M\r
+END:VALARM\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:event1\r
+RECURRENCE-ID;TZID=America/New_York:20170108T100000\r
+DTSTAMP:20170101T090000Z\r
+DTSTART;VALUE=DATE:20170109\r
+DTEND;VALUE=DATE:20170110\r
+SUMMARY:Moved\r
+END:VEVENT\r
+BEGIN:VTODO\r
+UID:todo1\r
+DTSTAMP:20170101T090000Z\r
+DUE:20170201T120000\r
+STATUS:NEEDS-ACTION\r
+SUMMARY:Floating\r
+PRIORITY:1\r
+END:VTODO\r
+END:VCALENDAR\r
+"""
+
+WINDOWS_TIMEZONE = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:Microsoft Exchange Server 2010\r
+BEGIN:VEVENT\r
+UID:event1\r
+DTSTART;TZID=W. Europe Standard Time:20170105T100000\r
+DTEND;TZID="W. Europe Standard Time":20170705T110000\r
+EXDATE;TZID=W. Europe Standard Time:20170112T100000\r
+SUMMARY:Before the timezone\r
+END:VEVENT\r
+BEGIN:VTIMEZONE\r
+TZID:W. Europe Standard Time\r
+BEGIN:STANDARD\r
+DTSTART:16010101T030000\r
+TZOFFSETFROM:+0200\r
+TZOFFSETTO:+0100\r
+RRULE:FREQ=YEARLY;INTERVAL=1;BYDAY=-1SU;BYMONTH=10\r
+END:STANDARD\r
+BEGIN:DAYLIGHT\r
+DTSTART:16010101T020000\r
+TZOFFSETFROM:+0100\r
+TZOFFSETTO:+0200\r
+RRULE:FREQ=YEARLY;INTERVAL=1;BYDAY=-1SU;BYMONTH=3\r
+END:DAYLIGHT\r
+END:VTIMEZONE\r
+BEGIN:VEVENT\r
+UID:event2\r
+DTSTART;TZID=W. Europe Standard Time:20170705T100000\r
+SUMMARY:After the timezone\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+PROPS = ['UID', 'DTSTAMP', 'DTSTART', 'DTEND', 'DUE', 'DURATION', 'SUMMARY',
+         'DESCRIPTION', 'LOCATION', 'CATEGORIES', 'RRULE', 'EXDATE',
+         'RECURRENCE-ID', 'PRIORITY', 'STATUS', 'URL']
+
+
+def icalendar_value(component, name):
+    """Convert a property parsed by icalendar to what the scanner returns."""
+    value = component[name]
+    values = value if isinstance(value, list) else [value]
+    if name in scanner.DATE_PROPERTIES or name in scanner.DURATION_PROPERTIES:
+        return value.dt
+    elif name in scanner.DATE_LIST_PROPERTIES:
+        return [d.dt for v in values for d in v.dts]
+    elif name in scanner.INTEGER_PROPERTIES:
+        return int(value)
+    elif name in scanner.TEXT_LIST_PROPERTIES:
+        return [str(c) for v in values for c in v.cats]
+    elif name == 'RRULE':
+        return value.to_ical().decode('utf-8')
+    else:
+        return str(value)
+
+
+class ScannerTests(unittest.TestCase):
+
+    def test_matches_icalendar(self):
+        components = [
+            c for c in Calendar.from_ical(EXAMPLE).subcomponents]
+        scanned = list(scanner.scan_components(EXAMPLE, None, PROPS))
+        self.assertEqual(
+            [c.name for c in components], [s[0] for s in scanned])
+        for (component, (name, values)) in zip(components, scanned):
+            for (prop, value) in zip(PROPS, values):
+                if prop not in component:
+                    self.assertIs(None, value, prop)
+                    continue
+                self.assertEqual(
+                    icalendar_value(component, prop), value.value, prop)
+                if not isinstance(component[prop], list):
+                    self.assertEqual(
+                        dict(component[prop].params), value.params, prop)
+
+    def test_streaming(self):
+        self.assertEqual(
+            list(scanner.scan_components(EXAMPLE, ['VTODO'], PROPS)),
+            list(scanner.scan_components(BytesIO(EXAMPLE), ['VTODO'], PROPS)))
+
+    def test_nested_ignored(self):
+        [(name, (description, )), (name, (missing, ))] = list(
+            scanner.scan_components(EXAMPLE, ['VEVENT'], ['DESCRIPTION']))
+        self.assertIs(None, missing)
+        self.assertEqual(
+            'A long description that is folded over multiple lines\n'
+            'with a newline', description.value)
+
+    def test_vtimezone(self):
+        props = ['UID', 'DTSTART', 'DTEND', 'EXDATE']
+        expected = dict(
+            (str(c['UID']), [icalendar_value(c, prop) for prop in props[1:]
+                             if prop in c])
+            for c in Calendar.from_ical(WINDOWS_TIMEZONE).walk('VEVENT'))
+        scanned = dict(
+            (values[0].value, [v.value for v in values[1:] if v is not None])
+            for (name, values) in scanner.scan_components(
+                WINDOWS_TIMEZONE, ['VEVENT'], props))
+        self.assertEqual(expected, scanned)
+        self.assertEqual(
+            [datetime.timedelta(hours=1), datetime.timedelta(hours=2)],
+            [dt.utcoffset() for dt in scanned['event1'][:2]])
+        self.assertEqual(
+            datetime.timedelta(hours=2), scanned['event2'][0].utcoffset())
+
+    def test_unknown_timezone(self):
+        self.assertEqual(
+            datetime.datetime(2017, 1, 1, 10, 0),
+            scanner.decode_date('20170101T100000', 'Nowhere/Special'))
+
+    def test_decode_duration(self):
+        self.assertEqual(
+            -datetime.timedelta(weeks=1, days=2, hours=3),
+            scanner.decode_duration('-P1W2DT3H'))
+        self.assertRaises(ValueError, scanner.decode_duration, 'PX')
+
+
+TIMEZONES = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//dystros//test//EN\r
+X-WR-CALNAME:Feed\r
+BEGIN:VTIMEZONE\r
+TZID:Europe/London\r
+BEGIN:STANDARD\r
+DTSTART:19701025T020000\r
+TZOFFSETFROM:+0100\r
+TZOFFSETTO:+0000\r
+END:STANDARD\r
+END:VTIMEZONE\r
+BEGIN:VTIMEZONE\r
+TZID:Europe/Paris\r
+BEGIN:STANDARD\r
+DTSTART:19701025T030000\r
+TZOFFSETFROM:+0200\r
+TZOFFSETTO:+0100\r
+END:STANDARD\r
+END:VTIMEZONE\r
+BEGIN:VEVENT\r
+UID:london\r
+DTSTAMP:20170101T090000Z\r
+DTSTART;TZID=Europe/\r
+ London:20170101T100000\r
+SUMMARY:In London\r
+END:VEVENT\r
+BEGIN:VJOURNAL\r
+UID:journal\r
+SUMMARY:Skipped\r
+END:VJOURNAL\r
+BEGIN:VEVENT\r
+UID:utc\r
+DTSTAMP:20170101T090000Z\r
+DTSTART:20170102T100000Z\r
+SUMMARY:Anywhere\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+class SplitTests(unittest.TestCase):
+
+    def split(self, data):
+        return list(scanner.split_calendar(BytesIO(data)))
+
+    def test_split(self):
+        [(name1, uid1, data1), (name2, uid2, data2)] = self.split(EXAMPLE)
+        self.assertEqual(('VEVENT', 'event1'), (name1, uid1))
+        self.assertEqual(('VTODO', 'todo1'), (name2, uid2))
+        # The override ends up in the same object as the recurring event.
+        cal = Calendar.from_ical(data1)
+        self.assertEqual('2.0', cal['VERSION'])
+        self.assertEqual(
+            ['VEVENT', 'VEVENT'], [c.name for c in cal.subcomponents])
+        self.assertEqual(
+            ['todo1'],
+            [str(c['UID']) for c in Calendar.from_ical(data2).subcomponents])
+
+    def test_timezones(self):
+        [(name1, uid1, data1), (name2, uid2, data2)] = self.split(TIMEZONES)
+        self.assertEqual(['london', 'utc'], [uid1, uid2])
+        self.assertEqual(
+            [('VTIMEZONE', 'Europe/London'), ('VEVENT', 'london')],
+            [(c.name, str(c.get('TZID', c.get('UID'))))
+             for c in Calendar.from_ical(data1).subcomponents])
+        cal = Calendar.from_ical(data2)
+        self.assertEqual('Feed', cal['X-WR-CALNAME'])
+        self.assertEqual(['VEVENT'], [c.name for c in cal.subcomponents])
+
+    def test_incremental(self):
+        lines = TIMEZONES.replace(b'END:VCALENDAR\r\n', b''.join(
+            b'BEGIN:VEVENT\r\nUID:event%d\r\nEND:VEVENT\r\n' % i
+            for i in range(10)) + b'END:VCALENDAR\r\n').splitlines(True)
+        consumed = []
+
+        def read():
+            for line in lines:
+                consumed.append(line)
+                yield line
+        split = scanner.split_calendar(read())
+        self.assertEqual('london', next(split)[1])
+        self.assertEqual('utc', next(split)[1])
+        self.assertLess(len(consumed), len(lines) - 20)
+        self.assertEqual(12, 2 + len(list(split)))
+
+    def test_not_adjacent(self):
+        # Components with the same UID are only combined if they are
+        # adjacent; otherwise the UID is reported again.
+        data = (b'BEGIN:VCALENDAR\r\n' + b''.join(
+            b'BEGIN:VEVENT\r\nUID:%s\r\nEND:VEVENT\r\n' % uid
+            for uid in (b'a', b'b', b'a')) + b'END:VCALENDAR\r\n')
+        self.assertEqual(
+            ['a', 'b', 'a'], [uid for (name, uid, data) in self.split(data)])
+
+    def test_missing_uid(self):
+        self.assertRaises(KeyError, self.split, EXAMPLE.replace(
+            b'UID:todo1\r\n', b''))
+
+
+class AddPropertiesTests(unittest.TestCase):
+
+    def test_add(self):
+        [(name, uid, data)] = list(scanner.split_calendar(
+            BytesIO(EXAMPLE), ['VTODO']))
+        data = scanner.add_properties(
+            data, [('METHOD', 'REQUEST'), ('VERSION', '3.0')],
+            [('CATEGORIES', scanner.encode_text('Travel, abroad')),
+             ('STATUS', 'CANCELLED'), ('LOCATION', 'Home')], ['VTODO'])
+        cal = Calendar.from_ical(data)
+        self.assertEqual(('REQUEST', '2.0'), (cal['METHOD'], cal['VERSION']))
+        [todo] = cal.subcomponents
+        # Existing properties are kept, unless they can occur more than
+        # once.
+        self.assertEqual(
+            ('NEEDS-ACTION', 'Home'), (todo['STATUS'], todo['LOCATION']))
+        [(name, (categories, ))] = scanner.scan_components(
+            data, ['VTODO'], ['CATEGORIES'])
+        self.assertEqual(['Travel, abroad'], categories.value)
+
+    def test_other_components(self):
+        data = scanner.add_properties(
+            EXAMPLE, [], [('LOCATION', 'Home')], ['VTODO'])
+        self.assertEqual(
+            ['Room 1', None, 'Home'],
+            [values[0] and values[0].value for (name, values) in
+             scanner.scan_components(data, None, ['LOCATION'])])
+
+    def test_encode_text(self):
+        text = 'a,b;c\\d\ne'
+        self.assertEqual('a\\,b\\;c\\\\d\\ne', scanner.encode_text(text))
+        self.assertEqual(text, scanner.decode_text(scanner.encode_text(text)))
+
+
+class ExtractTests(unittest.TestCase):
+
+    def test_extract_vtodos(self):
+        for calendar in [LazyCalendar(EXAMPLE), Calendar.from_ical(EXAMPLE)]:
+            self.assertEqual(
+                [('todo1', 1)],
+                [(uid.value, priority.value)
+                 for (uid, priority) in filters.extract_vtodos(
+                     [('a.ics', calendar)], props=['UID', 'PRIORITY'])])
@@ -0,0 +1,85 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from dystros import config
+
+import unittest
+
+# Modules that are slow to import, and should only be loaded when used.
+HEAVY_MODULES = ['configobj', 'concurrent.futures', 'defusedxml', 'icalendar',
+                 'jinja2', 'urllib.request']
+
+# Time budget for importing dystros.utils, in seconds. This is generous;
+# the import takes ~0.1s on a typical machine.
+IMPORT_BUDGET = 0.5
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import dystros.utils
+elapsed = time.perf_counter() - start
+json.dump({'elapsed': elapsed, 'modules': sorted(sys.modules)}, sys.stdout)
+"""
+
+
+class ImportTests(unittest.TestCase):
+
+    def setUp(self):
+        super(ImportTests, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.config_home = os.path.join(self.path, 'config')
+
+    def import_utils(self):
+        env = dict(os.environ)
+        env['XDG_CONFIG_HOME'] = self.config_home
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        env['PYTHONPATH'] = os.pathsep.join(
+            [root] + [p for p in [env.get('PYTHONPATH')] if p])
+        output = subprocess.check_output(
+            [sys.executable, '-c', SCRIPT], env=env)
+        return json.loads(output.decode('utf-8'))
+
+    def test_no_heavy_imports(self):
+        modules = self.import_utils()['modules']
+        self.assertEqual(
+            [], [name for name in HEAVY_MODULES if name in modules])
+
+    def test_no_config_io(self):
+        self.import_utils()
+        self.assertFalse(os.path.exists(self.config_home))
+
+    def test_budget(self):
+        # Take the best of a few runs, to be less sensitive to load.
+        elapsed = min(self.import_utils()['elapsed'] for i in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+
+class ConfigTests(unittest.TestCase):
+
+    def test_memoised(self):
+        self.assertIs(config.GetConfig(), config.GetConfig())
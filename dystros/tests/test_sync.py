@@ -0,0 +1,124 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import shutil
+import tempfile
+from unittest import mock
+from xml.etree import ElementTree as ET
+
+from dystros import caldav, sync
+from dystros.tests.server import ServerTestCase
+
+
+class SyncTests(ServerTestCase):
+
+    def setUp(self):
+        super(SyncTests, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def synchronize(self):
+        state = sync.SyncState(self.path)
+        del self.server.requests[:]
+        del self.server.fetched[:]
+        sync.synchronize(self.url, state)
+        return dict(sync.iter_objects(state))
+
+    def test_sync_collection(self):
+        self.server.put_resource('/cal/a.ics', b'a')
+        (token, responses) = caldav.sync_collection(
+            self.url, ['{DAV:}getetag'])
+        self.assertEqual(self.server.sync_token(), token)
+        self.assertEqual(['/cal/a.ics'], [r[0] for r in responses])
+
+    def test_sync_collection_invalid_token(self):
+        self.assertRaises(
+            caldav.InvalidSyncToken, caldav.sync_collection,
+            self.url, ['{DAV:}getetag'], 'bogus')
+
+    def test_fetch_objects(self):
+        etag = self.server.put_resource('/cal/a.ics', b'a')
+        self.assertEqual(
+            [('/cal/a.ics', etag, b'a'), ('/cal/missing.ics', None, None)],
+            list(sync.fetch_objects(
+                self.url, ['/cal/a.ics', '/cal/missing.ics'])))
+
+    def test_incremental(self):
+        self.server.put_resource('/cal/a.ics', b'a')
+        self.server.put_resource('/cal/b.ics', b'b')
+        self.assertEqual(
+            {'/cal/a.ics': b'a', '/cal/b.ics': b'b'}, self.synchronize())
+        self.assertEqual(
+            ['REPORT', 'REPORT'], [r[0] for r in self.server.requests])
+        self.server.put_resource('/cal/b.ics', b'B')
+        self.server.put_resource('/cal/c.ics', b'c')
+        self.server.delete_resource('/cal/a.ics')
+        self.assertEqual(
+            {'/cal/b.ics': b'B', '/cal/c.ics': b'c'}, self.synchronize())
+        self.assertEqual(['/cal/b.ics', '/cal/c.ics'], self.server.fetched)
+        self.assertEqual(
+            {'/cal/b.ics': b'B', '/cal/c.ics': b'c'}, self.synchronize())
+        self.assertEqual(
+            [('REPORT', '/cal/')], self.server.requests)
+
+    def test_invalid_token_falls_back(self):
+        self.server.put_resource('/cal/a.ics', b'a')
+        self.server.put_resource('/cal/b.ics', b'b')
+        self.synchronize()
+        state = sync.SyncState(self.path)
+        state.token = 'expired'
+        state.save()
+        self.server.delete_resource('/cal/a.ics')
+        self.server.put_resource('/cal/c.ics', b'c')
+        self.assertEqual(
+            {'/cal/b.ics': b'b', '/cal/c.ics': b'c'}, self.synchronize())
+        self.assertEqual(['/cal/c.ics'], self.server.fetched)
+        self.assertEqual(
+            self.server.sync_token(), sync.SyncState(self.path).token)
+
+    def test_truncated(self):
+        self.server.sync_limit = 2
+        for name in 'abcde':
+            self.server.put_resource('/cal/%s.ics' % name, name.encode())
+        self.assertEqual(
+            dict(('/cal/%s.ics' % name, name.encode()) for name in 'abcde'),
+            self.synchronize())
+        self.assertEqual(
+            ['REPORT'] * 4, [r[0] for r in self.server.requests])
+        self.assertEqual(
+            self.server.sync_token(), sync.SyncState(self.path).token)
+        self.server.delete_resource('/cal/a.ics')
+        self.server.put_resource('/cal/b.ics', b'B')
+        self.server.put_resource('/cal/f.ics', b'f')
+        self.assertEqual(
+            {'/cal/b.ics': b'B', '/cal/c.ics': b'c', '/cal/d.ics': b'd',
+             '/cal/e.ics': b'e', '/cal/f.ics': b'f'}, self.synchronize())
+        self.assertEqual(['/cal/b.ics', '/cal/f.ics'], self.server.fetched)
+
+    def test_response_without_propstat(self):
+        etag = self.server.put_resource('/cal/a.ics', b'a')
+        getetag = ET.Element('{DAV:}getetag')
+        getetag.text = etag
+        responses = [
+            ('/cal/a.ics', None, [(getetag, 'HTTP/1.1 200 OK')]),
+            ('/cal/b.ics', 'HTTP/1.1 403 Forbidden', None)]
+        with mock.patch.object(
+                caldav, 'sync_collection',
+                return_value=(self.server.sync_token(), responses)):
+            self.assertEqual({'/cal/a.ics': b'a'}, self.synchronize())
@@ -0,0 +1,323 @@
+# Dystros
+# Copyright (C) 2016 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+import datetime
+import os
+import shutil
+import tempfile
+import urllib.parse
+from unittest import mock
+
+from icalendar.cal import Calendar, Event
+
+from dystros import caldav, sync, utils
+from dystros.tests.server import ServerTestCase
+
+import unittest
+
+EXAMPLE = b"""\
+BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:%(component)s\r
+UID:%(uid)s\r
+SUMMARY:%(summary)s\r
+END:%(component)s\r
+END:VCALENDAR\r
+"""
+
+
+def example(uid, summary='summary', component='VEVENT'):
+    return EXAMPLE % {
+        b'uid': uid.encode('utf-8'), b'summary': summary.encode('utf-8'),
+        b'component': component.encode('utf-8')}
+
+
+class DateTests(unittest.TestCase):
+
+    def test_asdate(self):
+        self.assertEqual(
+            datetime.date(2017, 1, 2),
+            utils.asdate(datetime.datetime(2017, 1, 2, 10, 0)))
+        self.assertEqual(
+            datetime.date(2017, 1, 2), utils.asdate(datetime.date(2017, 1, 2)))
+
+    def test_parse_date(self):
+        self.assertEqual(
+            datetime.date(2017, 1, 2), utils.parse_date('20170102'))
+
+    def test_overlaps(self):
+        ev = Event()
+        ev.add('DTSTART', datetime.datetime(2017, 1, 2, 10, 0))
+        ev.add('DTEND', datetime.date(2017, 1, 4))
+        self.assertTrue(utils.overlaps(ev, datetime.date(2017, 1, 4), None))
+        self.assertTrue(utils.overlaps(
+            ev, datetime.date(2016, 1, 1), datetime.date(2017, 1, 2)))
+        self.assertFalse(utils.overlaps(ev, datetime.date(2017, 1, 5), None))
+        self.assertFalse(utils.overlaps(ev, None, datetime.date(2017, 1, 1)))
+
+
+class FingerprintTests(unittest.TestCase):
+
+    def test_none(self):
+        self.assertIs(None, utils.fingerprint(None))
+
+    def test_ordering(self):
+        a = Calendar.from_ical(
+            b'BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:1\r\nSUMMARY:s\r\n'
+            b'END:VEVENT\r\nEND:VCALENDAR\r\n')
+        b = Calendar.from_ical(
+            b'BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nSUMMARY:s\r\nUID:1\r\n'
+            b'END:VEVENT\r\nEND:VCALENDAR\r\n')
+        self.assertEqual(utils.fingerprint(a), utils.fingerprint(b))
+
+    def test_ignores_dtstamp(self):
+        a = Calendar.from_ical(example('uid1'))
+        b = Calendar.from_ical(example('uid1'))
+        b.subcomponents[0].add('DTSTAMP', datetime.datetime(2017, 1, 1))
+        self.assertEqual(utils.fingerprint(a), utils.fingerprint(b))
+
+    def test_changed(self):
+        a = Calendar.from_ical(example('uid1'))
+        b = Calendar.from_ical(example('uid1'))
+        b.subcomponents[0]['SUMMARY'] = 'other'
+        self.assertNotEqual(utils.fingerprint(a), utils.fingerprint(b))
+
+    def test_bytes(self):
+        self.assertEqual(
+            utils.fingerprint(Calendar.from_ical(example('uid1'))),
+            utils.fingerprint(example('uid1')))
+
+    def test_parameters(self):
+        a = (b'BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:1\r\n'
+             b'DTSTART;VALUE=DATE-TIME;TZID="Europe/London":20170101T100000'
+             b'\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n')
+        b = (b'BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:1\r\n'
+             b'DTSTART;TZID=Europe/London;VALUE=DATE-TIME:20170101T100000'
+             b'\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n')
+        self.assertEqual(utils.fingerprint(a), utils.fingerprint(b))
+
+    def test_lazy(self):
+        self.assertEqual(
+            utils.fingerprint(Calendar.from_ical(example('uid1'))),
+            utils.fingerprint(utils.LazyCalendar(example('uid1'))))
+
+
+class CompressedWriteTests(ServerTestCase):
+
+    def setUp(self):
+        super(CompressedWriteTests, self).setUp()
+        self.host = urllib.parse.urlsplit(self.server.url).netloc
+        self.addCleanup(utils._no_compression.discard, self.host)
+        self.data = example('uid1', 'x' * utils.COMPRESS_MIN_SIZE)
+
+    def test_compressed(self):
+        self.server.compressed_uploads = True
+        utils.put(self.url + '1.ics', 'text/calendar', self.data,
+                  compress=True)
+        self.assertEqual(self.data, self.server.resources['/cal/1.ics'][2])
+        self.assertEqual([('PUT', '/cal/1.ics')], self.server.requests)
+
+    def test_small_not_compressed(self):
+        data = example('uid1')
+        utils.put(self.url + '1.ics', 'text/calendar', data, compress=True)
+        self.assertEqual(data, self.server.resources['/cal/1.ics'][2])
+
+    def test_unsupported(self):
+        utils.put(self.url + '1.ics', 'text/calendar', self.data,
+                  compress=True)
+        self.assertEqual(self.data, self.server.resources['/cal/1.ics'][2])
+        self.assertEqual([('PUT', '/cal/1.ics')] * 2, self.server.requests)
+        self.assertIn(self.host, utils._no_compression)
+
+        # Later writes go out uncompressed straight away.
+        del self.server.requests[:]
+        utils.put(self.url + '2.ics', 'text/calendar', self.data,
+                  compress=True)
+        self.assertEqual([('PUT', '/cal/2.ics')], self.server.requests)
+
+
+class DiscoveryCacheTests(ServerTestCase):
+
+    def setUp(self):
+        super(DiscoveryCacheTests, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, 'discovery.json')
+        self.use_cache(utils.DiscoveryCache(self.path))
+        self.addCleanup(utils.set_discovery_cache, utils.DiscoveryCache())
+
+    def use_cache(self, cache):
+        self.cache = cache
+        utils.set_discovery_cache(cache)
+
+    def propfinds(self):
+        return [path for (method, path) in self.server.requests
+                if method == 'PROPFIND']
+
+    def test_add_member(self):
+        for i in range(3):
+            utils.add_member(self.url, 'text/calendar', example('uid%d' % i))
+        self.assertEqual(['/cal/'], self.propfinds())
+        self.assertEqual(3, len(self.server.resources))
+
+    def test_principal_and_inbox(self):
+        for i in range(2):
+            principal = utils.get_current_user_principal(self.url)
+            self.assertEqual(self.server.url + 'inbox/',
+                             utils.get_inbox_url(principal))
+        self.assertEqual(['/cal/', '/principal/'], self.propfinds())
+
+    def test_persistent(self):
+        utils.get_addmember_url(self.url)
+        self.use_cache(utils.DiscoveryCache(self.path))
+        self.assertEqual(self.url + '?add-member',
+                         utils.get_addmember_url(self.url))
+        self.assertEqual(['/cal/'], self.propfinds())
+
+    def test_expired(self):
+        self.use_cache(utils.DiscoveryCache(self.path, ttl=0))
+        utils.get_addmember_url(self.url)
+        utils.get_addmember_url(self.url)
+        self.assertEqual(['/cal/', '/cal/'], self.propfinds())
+
+    def test_disabled(self):
+        utils.set_discovery_cache(None)
+        utils.get_addmember_url(self.url)
+        utils.get_addmember_url(self.url)
+        self.assertEqual(['/cal/', '/cal/'], self.propfinds())
+
+    def test_invalidated_on_404(self):
+        self.cache.lookup(
+            'add-member', self.url, lambda url: url + '?moved')
+        utils.add_member(self.url, 'text/calendar', example('uid1'))
+        self.assertEqual(
+            [('POST', '/cal/?moved'), ('PROPFIND', '/cal/'),
+             ('POST', '/cal/?add-member')], self.server.requests)
+        self.assertEqual(1, len(self.server.resources))
+
+        # The rediscovered URL was stored.
+        self.use_cache(utils.DiscoveryCache(self.path))
+        self.assertEqual(self.url + '?add-member',
+                         utils.get_addmember_url(self.url))
+
+
+class GetAllCalendarsTests(ServerTestCase):
+
+    def setUp(self):
+        super(GetAllCalendarsTests, self).setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        patch = mock.patch.object(sync, 'xdg_cache_home', path)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def hrefs(self, **kwargs):
+        del self.server.requests[:]
+        del self.server.fetched[:]
+        return sorted(
+            href for (href, calendar) in utils.get_all_calendars(
+                self.url, **kwargs))
+
+    def test_incremental(self):
+        self.server.put_resource('/cal/1.ics', example('uid1'))
+        self.server.put_resource('/cal/2.ics', example('uid2'))
+        self.assertEqual(
+            ['/cal/1.ics', '/cal/2.ics'], self.hrefs(incremental=True))
+        self.server.delete_resource('/cal/1.ics')
+        self.server.put_resource('/cal/3.ics', example('uid3'))
+        self.assertEqual(
+            ['/cal/2.ics', '/cal/3.ics'], self.hrefs(incremental=True))
+        self.assertEqual(['/cal/3.ics'], self.server.fetched)
+
+    def test_incremental_filter(self):
+        vtodo = caldav.comp_filter('VCALENDAR', caldav.comp_filter('VTODO'))
+        self.assertRaises(
+            ValueError, utils.get_all_calendars, self.url,
+            filter=vtodo, incremental=True)
+        self.assertRaises(
+            ValueError, utils.get_all_calendars, self.url, incremental=True,
+            calendar_data=caldav.partial_calendar_data('VTODO', ['UID']))
+        self.assertEqual([], self.server.requests)
+
+
+class UIDIndexTests(ServerTestCase):
+
+    def test_get_uid_index(self):
+        etag1 = self.server.put_resource('/cal/1.ics', example('uid1'))
+        etag2 = self.server.put_resource(
+            '/cal/2.ics', example('uid2', component='VTODO'))
+        index = utils.get_uid_index(self.url)
+        self.assertEqual(['uid1', 'uid2'], sorted(index))
+        (href, etag, calendar) = index['uid2']
+        self.assertEqual(('/cal/2.ics', etag2), (href, etag))
+        self.assertEqual('VTODO', calendar.subcomponents[0].name)
+        self.assertEqual(('/cal/1.ics', etag1), index['uid1'][:2])
+
+    def test_get_fingerprint_index(self):
+        etag = self.server.put_resource('/cal/1.ics', example('uid1'))
+        index = utils.get_fingerprint_index(self.url)
+        self.assertEqual(
+            {'uid1': ('/cal/1.ics', etag,
+                      utils.fingerprint(example('uid1')))}, index)
+
+    def test_create_or_update_with_index(self):
+        etag = self.server.put_resource('/cal/1.ics', example('uid1', 'old'))
+        index = utils.get_uid_index(self.url)
+        del self.server.requests[:]
+        (old, new, href, etag, todo) = utils.create_or_update_calendar_item(
+            self.url, 'VEVENT', 'uid1', index=index)
+        self.assertEqual(('/cal/1.ics', etag), (href, etag))
+        self.assertEqual('old', todo['SUMMARY'])
+        todo['SUMMARY'] = 'new'
+        self.assertEqual('new', new.subcomponents[0]['SUMMARY'])
+        self.assertEqual('old', old.subcomponents[0]['SUMMARY'])
+        (old, new, href, etag, todo) = utils.create_or_update_calendar_item(
+            self.url, 'VEVENT', 'uid2', index=index)
+        self.assertEqual((None, None, None), (old, href, etag))
+        self.assertEqual('uid2', todo['UID'])
+        self.assertEqual([], self.server.requests)
+
+
+class WriteExecutorTests(ServerTestCase):
+
+    def test_writes(self):
+        etag = self.server.put_resource('/cal/1.ics', example('uid1'))
+        self.server.put_resource('/cal/2.ics', example('uid2'))
+        with utils.WriteExecutor(jobs=3) as executor:
+            executor.put(self.url + '1.ics', 'text/calendar',
+                         example('uid1', 'new'), if_match=[etag], key='1')
+            executor.put(self.url + '2.ics', 'text/calendar',
+                         example('uid2', 'new'), if_match=['"bogus"'],
+                         key='2')
+            for i in range(5):
+                executor.add_member(self.url, 'text/calendar',
+                                    example('new%d' % i), key='new%d' % i)
+            results = executor.wait()
+        self.assertEqual(
+            ['1', '2', 'new0', 'new1', 'new2', 'new3', 'new4'],
+            [r.key for r in results])
+        self.assertEqual(
+            [(True, False), (False, True)],
+            [(r.ok, r.conflict) for r in results[:2]])
+        self.assertEqual(
+            [(201, 'POST')] * 5, [(r.status, r.method) for r in results[2:]])
+        self.assertEqual(1, utils.log_write_results(results))
+        self.assertEqual(7, len(self.server.resources))
+        self.assertEqual(
+            example('uid1', 'new'), self.server.resources['/cal/1.ics'][2])
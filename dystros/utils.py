@@ -19,24 +19,37 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA  02110-1301, USA.
 
-import argparse
+import collections
 
-from defusedxml.ElementTree import fromstring as xmlparse
 # Hmm, defusedxml doesn't have XML generation functions? :(
 from xml.etree import ElementTree as ET
 
 import datetime
-from icalendar.cal import Calendar, component_factory
-from icalendar.prop import vDDDTypes
+import hashlib
+import json
+import logging
 import optparse
 import os
+import threading
+import time
+import urllib.error
 import urllib.parse
-import urllib.request
 
-from dystros import caldav
+from xdg.BaseDirectory import xdg_cache_home
+
+from dystros import caldav, filters, scanner, session, sync
 from dystros.config import GetConfig
+from dystros.lazy import LazyCalendar
+
+# icalendar, urllib.request and concurrent.futures are slow to import, and
+# not needed by every script; they are imported when first used.
+
+_opener_installed = False
+_opener_lock = threading.Lock()
+
 
 def install_opener():
+    import urllib.request
     auth_handler = urllib.request.HTTPBasicAuthHandler()
     config = GetConfig()
     if 'password' in config and 'user' in config:
@@ -48,7 +61,23 @@ def install_opener():
     opener.addheaders = [('User-Agent', 'dystros/calutils')]
     urllib.request.install_opener(opener)
 
-install_opener()
+
+def urlopen(url):
+    """Open a URL with urllib, using the configured credentials.
+
+    The urllib opener is installed on first use.
+
+    :param url: URL to open
+    :return: A file-like object
+    """
+    global _opener_installed
+    import urllib.request
+    with _opener_lock:
+        if not _opener_installed:
+            install_opener()
+            _opener_installed = True
+    return urllib.request.urlopen(url)
+
 
 class CalendarOptionGroup(optparse.OptionGroup):
     """Return a optparser OptionGroup.
@@ -62,7 +91,7 @@ class CalendarOptionGroup(optparse.OptionGroup):
         optparse.OptionGroup.__init__(self, parser, "Calendar Settings")
         config = GetConfig()
         self.add_option('--url', type=str, dest="url", help="Calendar URL.",
-                        default=config['default_url'])
+                        default=config.get('default_url'))
 
 
 def add_calendar_arguments(parser):
@@ -73,7 +102,7 @@ def add_calendar_arguments(parser):
     group = parser.add_argument_group("Calendar Settings")
     config = GetConfig()
     group.add_argument('--url', type=str, dest="url", help="Calendar URL.",
-                       default=config['default_url'])
+                       default=config.get('default_url'))
 
 
 def statuschar(evstatus):
@@ -106,7 +135,31 @@ def asdate(dt):
         a_date = dt.date()
     else:
         a_date = dt
-    return dt
+    return a_date
+
+
+def parse_date(text):
+    """Parse a date in YYYYMMDD format.
+
+    :param text: Text to parse
+    :return: A date
+    """
+    return datetime.datetime.strptime(text, "%Y%m%d").date()
+
+
+def overlaps(component, start, end):
+    """Check whether a component overlaps with a range of days.
+
+    :param component: Component with DTSTART and optionally DTEND
+    :param start: First day of the range, or None
+    :param end: Last day of the range (inclusive), or None
+    :return: Boolean
+    """
+    try:
+        dtend = component['DTEND'].dt
+    except KeyError:
+        dtend = None
+    return filters.days_overlap(component['DTSTART'].dt, dtend, start, end)
 
 
 def keyEvent(a):
@@ -114,79 +167,333 @@ def keyEvent(a):
 
     :param a: First event
     """
-    a = a['DTSTART'].dt
-    if getattr(a, "date", None):
-        a_date = a.date()
-        a = (a.hour, a.minute)
-    else:
-        a_date = a
-        a = (0, 0)
-    return (a_date, a)
+    return filters.event_sort_key(a['DTSTART'].dt)
 
 
-DEFAULT_PRIORITY = 10
-DEFAULT_DUE_DATE = datetime.date(datetime.MAXYEAR, 1, 1)
+DEFAULT_PRIORITY = filters.DEFAULT_PRIORITY
+DEFAULT_DUE_DATE = filters.DEFAULT_DUE_DATE
 
 
 def keyTodo(a):
     priority = a.get('PRIORITY')
     if priority is not None:
         priority = int(priority)
-    else:
-        priority = DEFAULT_PRIORITY
     due = a.get('DUE')
-    if due:
-        if getattr(due.dt, "date", None):
-            due_date = due.dt.date()
-            due_time = (due.dt.hour, due.dt.minute)
-        else:
-            due_date = due.dt
-            due_time = (0, 0)
-    else:
-        due_date = DEFAULT_DUE_DATE
-        due_time = None
-    return (priority, due_date, due_time, a['SUMMARY'])
-
-
-def get_all_calendars(url, depth=None, filter=None):
+    return filters.todo_sort_key(
+        priority, due.dt if due else None, a['SUMMARY'])
+
+
+def get_all_calendars(url, depth=None, filter=None, incremental=False,
+                      cache=None, calendar_data=None):
+    """Retrieve all calendar objects in a collection.
+
+    :param url: URL of the collection
+    :param depth: Optional depth
+    :param filter: Optional filter to apply
+    :param incremental: Keep a local copy of the collection and only fetch
+        objects that changed since the last run. Can not be combined with
+        filter or calendar_data; callers should filter the results
+        themselves.
+    :param cache: Optional `ObjectCache`; if set, only etags are listed and
+        only objects that are not in the cache are fetched
+    :param calendar_data: Optional calendar-data element, to retrieve only
+        some components and properties (see `caldav.calendar_data`)
+    :return: Iterator over (href, LazyCalendar) tuples
+    :raise ValueError: if incremental is combined with filter or
+        calendar_data
+    """
+    if incremental:
+        if filter is not None or calendar_data is not None:
+            raise ValueError(
+                'filter and calendar_data are not supported in incremental '
+                'mode')
+        return _get_all_incremental(url)
+    return _get_all_calendars(url, depth, filter, cache, calendar_data)
+
+
+def _get_all_incremental(url):
+    state = sync.SyncState.for_collection(url)
+    sync.synchronize(url, state)
+    for href, calendar in _iter_local(state):
+        yield href, calendar
+
+
+def _get_all_calendars(url, depth, filter, cache, calendar_data):
+    if cache is not None:
+        for href, etag, data in _get_all_cached(
+                url, depth, filter, cache, calendar_data):
+            yield href, LazyCalendar(data, etag)
+        return
+    if calendar_data is None:
+        calendar_data = '{urn:ietf:params:xml:ns:caldav}calendar-data'
     for (href, status, propstat) in caldav.calendar_query(
-            url, ['{DAV:}getetag', '{urn:ietf:params:xml:ns:caldav}calendar-data'], filter):
+            url, ['{DAV:}getetag', calendar_data], filter, depth):
         data = None
+        etag = None
         for prop, prop_status in propstat:
             if prop.tag == '{urn:ietf:params:xml:ns:caldav}calendar-data':
                 data = prop.text
+            elif prop.tag == '{DAV:}getetag':
+                etag = prop.text
         assert data is not None, "data missing for %r" % href
-        yield href, Calendar.from_ical(data)
+        yield href, LazyCalendar(data, etag)
+
+
+def _iter_local(state):
+    for href, data in sync.iter_objects(state):
+        yield href, LazyCalendar(data, state.etags.get(href))
+
+
+def get_local_calendars(url):
+    """Retrieve the local copy of a collection, without contacting the server.
+
+    The local copy is the one kept up to date by `get_all_calendars` in
+    incremental mode.
+
+    :param url: URL of the collection
+    :return: Iterator over (href, LazyCalendar) tuples
+    """
+    return _iter_local(sync.SyncState.for_collection(url))
+
+
+def _get_all_cached(url, depth, filter, cache, calendar_data=None):
+    if calendar_data is not None:
+        variant = ET.tostring(calendar_data).decode('utf-8')
+    else:
+        variant = None
+    stale = []
+    for (href, status, propstat) in caldav.calendar_query(
+            url, ['{DAV:}getetag'], filter, depth):
+        etag = None
+        for prop, prop_status in propstat:
+            if prop.tag == '{DAV:}getetag':
+                etag = prop.text
+        data = None if etag is None else cache.get(url, href, etag, variant)
+        if data is None:
+            stale.append(href)
+        else:
+            yield href, etag, data
+    for (href, etag, data) in sync.fetch_objects(
+            url, stale, calendar_data=calendar_data):
+        if data is None:
+            continue
+        cache.set(url, href, etag, data, variant)
+        yield href, etag, data
 
 
 def get(url):
-    req = urllib.request.Request(url=url, method='GET')
-    with urllib.request.urlopen(req) as f:
+    with session.request('GET', url) as f:
         assert f.status == 200, f.status
-        return (f.get_header('ETag'), f.read())
+        return (f.getheader('ETag'), f.read())
 
 
-def put(url, content_type, data, if_match=None):
-    req = urllib.request.Request(url=url, data=data, method='PUT')
-    if if_match is not None:
-        req.add_header('If-Match', ', '.join(if_match))
-    req.add_header('Content-Type', content_type)
-    with urllib.request.urlopen(req) as f:
+# Bodies smaller than this are not worth compressing.
+COMPRESS_MIN_SIZE = 16384
+
+# Hosts that rejected a compressed request body.
+_no_compression = set()
+
+
+def _send(method, url, data, headers):
+    with session.request(method, url, body=data, headers=headers) as f:
         pass
     assert f.status in (201, 204, 200), f.status
+    return f.status
 
 
-def post(url, content_type, data, if_match=None):
-    req = urllib.request.Request(url=url, data=data, method='POST')
+def _write(method, url, content_type, data, if_match=None, compress=False):
+    headers = {'Content-Type': content_type}
     if if_match is not None:
-        req.add_header('If-Match', ', '.join(if_match))
-    req.add_header('Content-Type', content_type)
-    with urllib.request.urlopen(req) as f:
-        pass
-    assert f.status in (201, 204, 200), f.status
+        headers['If-Match'] = ', '.join(if_match)
+    host = urllib.parse.urlsplit(url).netloc
+    if (compress and len(data) >= COMPRESS_MIN_SIZE and
+            host not in _no_compression):
+        import gzip
+        try:
+            return _send(method, url, gzip.compress(data),
+                         dict(headers, **{'Content-Encoding': 'gzip'}))
+        except urllib.error.HTTPError as e:
+            if e.code != 415:
+                raise
+            logging.info('%s does not accept compressed bodies', host)
+            _no_compression.add(host)
+    return _send(method, url, data, headers)
+
+
+def put(url, content_type, data, if_match=None, compress=False):
+    """Store a resource.
+
+    :param url: URL to write to
+    :param content_type: Content type of data
+    :param data: Contents (as bytes)
+    :param if_match: Optional list of etags the current resource must match
+    :param compress: Whether to send large bodies gzip-compressed. If the
+        server responds with 415 Unsupported Media Type, the body is sent
+        again uncompressed, and later writes to that host are not
+        compressed.
+    :return: HTTP status
+    """
+    return _write('PUT', url, content_type, data, if_match, compress)
 
 
-def get_addmember_url(url):
+def post(url, content_type, data, if_match=None, compress=False):
+    """Post data to a URL; see `put` for the parameters."""
+    return _write('POST', url, content_type, data, if_match, compress)
+
+
+# How long discovered URLs are trusted, in seconds.
+DEFAULT_DISCOVERY_TTL = 24 * 60 * 60
+
+
+class DiscoveryCache(object):
+    """Cache of discovered URLs, such as principals and add-member URLs.
+
+    Entries are kept in memory, and optionally in a JSON file so that they
+    can be reused by later runs. They expire after `ttl` seconds. Once
+    installed, entries are also dropped as soon as a request for either
+    the URL they were discovered from or the URL they resolved to returns
+    404 Not Found.
+
+    :param path: File to store the cache in, or None to keep it in memory
+    :param ttl: Time to live of entries, in seconds
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_DISCOVERY_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls, ttl=DEFAULT_DISCOVERY_TTL):
+        """Open the default cache, under the XDG cache directory."""
+        return cls(os.path.join(xdg_cache_home, 'dystros', 'discovery.json'),
+                   ttl=ttl)
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        self._entries = {}
+        if self.path is None:
+            return self._entries
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return self._entries
+        except ValueError:
+            logging.warning('Ignoring corrupt discovery cache %s', self.path)
+            return self._entries
+        for (kind, url, value, expires) in state:
+            self._entries[(kind, url)] = (value, expires)
+        return self._entries
+
+    def _save(self):
+        if self.path is None:
+            return
+        state = [[kind, url, value, expires]
+                 for ((kind, url), (value, expires)) in self._entries.items()]
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning('Unable to write discovery cache %s: %s',
+                            self.path, e)
+
+    def lookup(self, kind, url, discover):
+        """Look up a discovered URL, discovering it if necessary.
+
+        :param kind: Kind of URL (e.g. 'add-member')
+        :param url: URL the value is discovered from
+        :param discover: Function that discovers the value, given url
+        :return: The (possibly cached) result of discover(url)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._load().get((kind, url))
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        value = discover(url)
+        with self._lock:
+            self._load()[(kind, url)] = (value, now + self.ttl)
+            self._save()
+        return value
+
+    def invalidate(self, url):
+        """Drop the entries discovered from or resolving to a URL.
+
+        :param url: URL that is no longer valid
+        :return: Whether any entries were dropped
+        """
+        with self._lock:
+            entries = self._load()
+            stale = [key for (key, (value, expires)) in entries.items()
+                     if url in (key[1], value)]
+            for key in stale:
+                del entries[key]
+            if stale:
+                self._save()
+        return bool(stale)
+
+    def __call__(self, info):
+        """Invalidate entries for URLs that were not found.
+
+        :param info: A `session.RequestInfo`
+        """
+        if info.status == 404 and self.invalidate(info.url):
+            logging.info('Dropped cached discovery results for %s', info.url)
+
+    def install(self):
+        """Start invalidating entries on 404 responses.
+
+        :return: self
+        """
+        session.add_request_hook(self)
+        return self
+
+    def uninstall(self):
+        """Stop invalidating entries on 404 responses."""
+        session.remove_request_hook(self)
+
+
+_discovery_cache = None
+_discovery_cache_set = False
+_discovery_cache_lock = threading.Lock()
+
+
+def set_discovery_cache(cache):
+    """Set the cache used for service discovery in this process.
+
+    Unless this is called, discovered URLs are only cached in memory.
+
+    :param cache: A `DiscoveryCache`, or None to disable caching
+    """
+    global _discovery_cache, _discovery_cache_set
+    with _discovery_cache_lock:
+        if _discovery_cache is not None:
+            _discovery_cache.uninstall()
+        _discovery_cache = cache
+        _discovery_cache_set = True
+        if cache is not None:
+            cache.install()
+
+
+def _discover(kind, url, discover):
+    global _discovery_cache, _discovery_cache_set
+    with _discovery_cache_lock:
+        if not _discovery_cache_set:
+            _discovery_cache = DiscoveryCache().install()
+            _discovery_cache_set = True
+        cache = _discovery_cache
+    if cache is None:
+        return discover(url)
+    return cache.lookup(kind, url, discover)
+
+
+def _get_addmember_url(url):
     for (href, href_status, propstat) in caldav.getprop(url, ['{DAV:}add-member']):
         if href_status == 'HTTP/1.1 404 Not Found':
             raise KeyError(url)
@@ -197,6 +504,16 @@ def get_addmember_url(url):
     raise KeyError(url)
 
 
+def get_addmember_url(url):
+    """Get the URL to POST new members of a collection to.
+
+    :param url: URL of the collection
+    :return: add-member URL
+    :raise KeyError: if the collection does not support add-member
+    """
+    return _discover('add-member', url, _get_addmember_url)
+
+
 def get_by_uid(url, component, uid, depth='1'):
     uidprop = ET.Element('{urn:ietf:params:xml:ns:caldav}calendar-data')
     uidprop.set('name', 'UID')
@@ -218,50 +535,314 @@ def get_by_uid(url, component, uid, depth='1'):
             if prop.tag == '{DAV:}getetag':
                 etag = prop.text
         assert data is not None, "data missing for %r" % href
-        return (href, etag, Calendar.from_ical(data))
+        return (href, etag, LazyCalendar(data, etag))
     raise KeyError(uid)
 
 
-def add_member(url, content_type, content):
+def add_member(url, content_type, content, compress=False):
     """Add a new member to a collection.
 
     :param url: URL of collection
     :param content_type; Content type of new member
     :param content: Content (as bytes)
+    :param compress: Whether to compress large contents (see `put`)
     """
     addmember_url = get_addmember_url(url)
-    post(addmember_url, content_type, content)
+    try:
+        return post(addmember_url, content_type, content, compress=compress)
+    except urllib.error.HTTPError as e:
+        if e.code != 404:
+            raise
+    # The add-member URL may have been cached; the 404 dropped it from the
+    # cache, so discover it again.
+    addmember_url = get_addmember_url(url)
+    return post(addmember_url, content_type, content, compress=compress)
 
 
-def get_inbox_url(principal):
+class WriteResult(collections.namedtuple(
+        'WriteResult', ['key', 'method', 'url', 'status', 'error'])):
+    """Result of a write submitted to a `WriteExecutor`.
+
+    :ivar key: Key the write was submitted with
+    :ivar method: HTTP method
+    :ivar url: URL that was written to
+    :ivar status: HTTP status, or None if no response was received
+    :ivar error: Exception raised by the write, or None if it succeeded
+    """
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def conflict(self):
+        """Whether the write failed because its If-Match did not match."""
+        return self.status == 412
+
+
+class WriteExecutor(object):
+    """Run PUT and POST requests concurrently.
+
+    At most `jobs` requests are in flight at any time; submitting more
+    blocks until a slot is available.
+
+    :param jobs: Maximum number of concurrent requests
+    :param compress: Whether to compress large bodies (see `put`)
+    """
+
+    def __init__(self, jobs=1, compress=False):
+        import concurrent.futures
+        self.compress = compress
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs)
+        self._slots = threading.BoundedSemaphore(jobs)
+        self._pending = []
+
+    def _run(self, key, method, url, fn, *args):
+        try:
+            status = fn(*args)
+        except urllib.error.HTTPError as e:
+            return WriteResult(key, method, url, e.code, e)
+        except Exception as e:
+            return WriteResult(key, method, url, None, e)
+        else:
+            return WriteResult(key, method, url, status, None)
+        finally:
+            self._slots.release()
+
+    def _submit(self, key, method, url, fn, *args):
+        self._slots.acquire()
+        self._pending.append(self._executor.submit(
+            self._run, key, method, url, fn, *args))
+
+    def put(self, url, content_type, data, if_match=None, key=None):
+        """Submit a PUT request; see `put`."""
+        self._submit(key, 'PUT', url, put, url, content_type, data, if_match,
+                     self.compress)
+
+    def post(self, url, content_type, data, if_match=None, key=None):
+        """Submit a POST request; see `post`."""
+        self._submit(key, 'POST', url, post, url, content_type, data,
+                     if_match, self.compress)
+
+    def add_member(self, url, content_type, content, key=None):
+        """Submit the addition of a new member; see `add_member`."""
+        self._submit(key, 'POST', url, add_member, url, content_type, content,
+                     self.compress)
+
+    def wait(self):
+        """Wait for all submitted writes to finish.
+
+        :return: List of `WriteResult` objects, in submission order
+        """
+        pending, self._pending = self._pending, []
+        return [f.result() for f in pending]
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+def log_write_results(results):
+    """Log failed writes.
+
+    :param results: Iterable over `WriteResult` objects
+    :return: Number of failed writes
+    """
+    failed = 0
+    for result in results:
+        if result.ok:
+            continue
+        failed += 1
+        if result.conflict:
+            logging.warning(
+                'Conflict writing %s (%s): item was modified on the server',
+                result.key, result.url)
+        else:
+            logging.error('Failed to write %s (%s): %s',
+                          result.key, result.url, result.error)
+    return failed
+
+
+def _get_inbox_url(principal):
     for href, status, propstat in caldav.getprop(principal, ["{urn:ietf:params:xml:ns:caldav}schedule-inbox-URL"]):
         return urllib.parse.urljoin(principal, propstat[0][0][0].text)
     return None
 
 
-def create_or_update_calendar_item(collection_url, component_name, uid):
+def get_inbox_url(principal):
+    """Get the scheduling inbox of a principal.
+
+    :param principal: URL of the principal
+    :return: URL of the inbox, or None
+    """
+    return _discover('schedule-inbox', principal, _get_inbox_url)
+
+
+def get_current_user_principal(url):
+    """Get the principal of the current user.
+
+    :param url: URL to discover the principal from
+    :return: URL of the principal
+    """
+    return _discover(
+        'current-user-principal', url, caldav.get_current_user_principal)
+
+
+def get_uid_index(url, filter=None):
+    """Build an index of the items in a collection by UID.
+
+    This retrieves the whole collection in a single query, which is much
+    cheaper than calling `get_by_uid` for many items.
+
+    :param url: URL of the collection
+    :param filter: Optional filter to apply
+    :return: Dictionary mapping UIDs to (href, etag, LazyCalendar) tuples
+    """
+    ret = {}
+    for (href, etag, calendar) in _iter_collection(url, filter):
+        for summary in calendar.scan():
+            if summary.uid is not None:
+                ret[summary.uid] = (href, etag, calendar)
+    return ret
+
+
+def _iter_collection(url, filter):
+    for (href, status, propstat) in caldav.calendar_query(
+            url, ['{DAV:}getetag', '{urn:ietf:params:xml:ns:caldav}calendar-data'],
+            filter):
+        etag = None
+        data = None
+        for prop, prop_status in propstat:
+            if prop.tag == '{urn:ietf:params:xml:ns:caldav}calendar-data':
+                data = prop.text
+            if prop.tag == '{DAV:}getetag':
+                etag = prop.text
+        assert data is not None, "data missing for %r" % href
+        calendar = LazyCalendar(data, etag)
+        yield (href, etag, calendar)
+
+
+def get_fingerprint_index(url, filter=None):
+    """Build an index of the fingerprints of the items in a collection.
+
+    Like `get_uid_index`, but only the fingerprint of each item is kept,
+    rather than its contents, so that memory use does not grow with the
+    size of the items.
+
+    :param url: URL of the collection
+    :param filter: Optional filter to apply
+    :return: Dictionary mapping UIDs to (href, etag, fingerprint) tuples
+    """
+    ret = {}
+    for (href, etag, calendar) in _iter_collection(url, filter):
+        digest = fingerprint(calendar)
+        for summary in calendar.scan():
+            if summary.uid is not None:
+                ret[summary.uid] = (href, etag, digest)
+    return ret
+
+
+def create_or_update_calendar_item(collection_url, component_name, uid,
+                                   index=None):
     """Create or update a calendar item by UID.
 
     :param collection_url: URL of collection to search in
     :param component_name: Component name (VTODO, VEVENT, etc)
     :param uid: UID value
+    :param index: Optional UID index, as returned by `get_uid_index`; if
+        not specified, the server is queried for the UID
     :return: (href, etag, old, new), where old and new are Calendar items
         New items will have the first three elements set to None
     """
+    from icalendar.cal import Calendar, ComponentFactory
     try:
-        (href, etag, old) = get_by_uid(collection_url, component_name, uid)
+        if index is not None:
+            (href, etag, old) = index[uid]
+        else:
+            (href, etag, old) = get_by_uid(collection_url, component_name, uid)
     except KeyError:
         etag = None
         props = {'UID': uid}
-        todo = component_factory[component_name](**props)
+        todo = ComponentFactory()[component_name](**props)
         old = None
         href = None
         new = Calendar()
         new.add_component(todo)
     else:
         new = Calendar.from_ical(old.to_ical())
-        for component in old.subcomponents:
+        for component in new.subcomponents:
             if component.name == component_name:
                 todo = component
                 break
     return (old, new, href, etag, todo)
+
+
+# Properties that change without the content changing.
+VOLATILE_PROPERTIES = frozenset(['DTSTAMP'])
+
+
+def _digest(name, lines, children):
+    h = hashlib.sha256(name)
+    for line in sorted(lines) + sorted(children):
+        h.update(b'\n')
+        h.update(line)
+    return h.hexdigest().encode('ascii')
+
+
+def _calendar_digest(data, ignore):
+    ignore = set(name.encode('ascii') for name in ignore)
+    # Stack of [name, lines, child digests]
+    stack = []
+    ret = None
+    for line in scanner.unfolded_lines(data):
+        (name, params, value) = scanner.split_line(line)
+        if name == b'BEGIN':
+            stack.append([value.upper(), [], []])
+        elif name == b'END':
+            digest = _digest(*stack.pop())
+            if stack:
+                stack[-1][2].append(digest)
+            else:
+                ret = digest
+        elif stack and name not in ignore:
+            # Parameters are normalised, since their order and quoting
+            # may change when an object is serialised again.
+            params = sorted(scanner.parse_params(params).items())
+            stack[-1][1].append(name + b''.join(
+                (';%s=%s' % param).encode('utf-8') for param in params) +
+                b':' + value)
+    return ret
+
+
+def fingerprint(calendar, ignore=VOLATILE_PROPERTIES):
+    """Compute a fingerprint of the contents of a calendar object.
+
+    The fingerprint does not depend on the order of properties or
+    components, and ignores volatile properties such as DTSTAMP; two
+    objects have the same fingerprint if they only differ in those.
+
+    The content lines are compared as they are serialised, so unparsed
+    objects (bytes, or a `LazyCalendar` that has not been accessed) are
+    not parsed.
+
+    :param calendar: A `Calendar`, `LazyCalendar` or bytes, or None
+    :param ignore: Names of properties to ignore
+    :return: Fingerprint, as str; None if calendar is None
+    """
+    if calendar is None:
+        return None
+    if isinstance(calendar, LazyCalendar):
+        if calendar.parsed:
+            # The parsed calendar may have been modified.
+            calendar = calendar.calendar.to_ical()
+        else:
+            calendar = calendar.data
+    elif not isinstance(calendar, bytes):
+        calendar = calendar.to_ical()
+    return _calendar_digest(calendar, ignore).decode('ascii')
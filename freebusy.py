@@ -24,15 +24,40 @@
 import datetime
 import optparse
 import os
-import pytz
 import sys
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from dystros import utils
+from dystros import caldav, freebusy, utils
 
-parser = optparse.OptionParser("travel")
+parser = optparse.OptionParser("freebusy")
 parser.add_option_group(utils.CalendarOptionGroup(parser))
+parser.add_option('--from', type=str, dest='start', help='First day (YYYYMMDD); defaults to today.')
+parser.add_option('--to', type=str, dest='end', help='Last day (YYYYMMDD); defaults to a week after the first day.')
+parser.add_option('--server', action='store_true', default=False,
+                  help='Ask the server, rather than computing free/busy information locally.')
+parser.add_option('--offline', action='store_true', default=False,
+                  help='Use the local copy of the calendar without synchronizing it first.')
 opts, args = parser.parse_args()
 
-sys.stdout.buffer.write(utils.freebusy_query(opts.url, start=datetime.datetime(2000, 1, 1).replace(tzinfo=pytz.timezone('UTC')), end=datetime.datetime.utcnow().replace(tzinfo=pytz.timezone('UTC'))))
+if opts.start:
+    start = utils.parse_date(opts.start)
+else:
+    start = datetime.date.today()
+if opts.end:
+    end = utils.parse_date(opts.end) + datetime.timedelta(1)
+else:
+    end = start + datetime.timedelta(7)
+
+start = datetime.datetime.combine(start, datetime.time()).astimezone()
+end = datetime.datetime.combine(end, datetime.time()).astimezone()
+
+if opts.server:
+    sys.stdout.buffer.write(caldav.freebusy_query(opts.url, start, end))
+else:
+    if opts.offline:
+        cals = utils.get_local_calendars(opts.url)
+    else:
+        cals = utils.get_all_calendars(opts.url, incremental=True)
+    sys.stdout.buffer.write(
+        freebusy.local_freebusy(cals, start, end).to_ical())
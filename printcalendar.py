@@ -27,39 +27,68 @@ import sys
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from dystros import caldav, filters, utils
+from dystros import cache, caldav, filters, recur, utils
 
 parser = optparse.OptionParser("travel")
 parser.add_option_group(utils.CalendarOptionGroup(parser))
+parser.add_option('--incremental', action='store_true', default=False,
+                  help='Only fetch items that changed since the last run.')
+parser.add_option('--no-cache', action='store_true', default=False,
+                  help='Do not use the local object cache.')
 parser.add_option('--category', type=str, dest='category', help='Only display this category.')
+parser.add_option('--from', type=str, dest='start', help='Only display events on or after this date (YYYYMMDD).')
+parser.add_option('--to', type=str, dest='end', help='Only display events on or before this date (YYYYMMDD). '
+                  'Recurring events are expanded if both --from and --to are set.')
 opts, args = parser.parse_args()
 
-def filter_fn(component):
-    if opts.category and (
-        not 'CATEGORIES' in component or
-        not opts.category in component['CATEGORIES']):
+start = utils.parse_date(opts.start) if opts.start else None
+end = utils.parse_date(opts.end) if opts.end else None
+
+# Properties used below; only these are retrieved from the server.
+PROPERTIES = ['SUMMARY', 'DTSTART', 'DTEND', 'DURATION', 'LOCATION', 'STATUS',
+              'CATEGORIES', 'RRULE', 'RDATE', 'EXDATE', 'RECURRENCE-ID']
+
+def filter_fn(record):
+    if opts.category and opts.category not in record.categories:
+         return False
+    if not record.overlaps(start, end):
          return False
     return True
 
-cals = utils.get_all_calendars(opts.url, filter=caldav.comp_filter("VCALENDAR", caldav.comp_filter("VEVENT")))
+if start is not None or end is not None:
+    vevent_filter = caldav.comp_filter("VEVENT", caldav.time_range(
+        start, end + datetime.timedelta(1) if end is not None else None))
+else:
+    vevent_filter = caldav.comp_filter("VEVENT")
+
+if opts.incremental:
+    # The local copy is complete; records are filtered below.
+    cals = utils.get_all_calendars(opts.url, incremental=True)
+else:
+    cals = utils.get_all_calendars(
+        opts.url, filter=caldav.comp_filter("VCALENDAR", vevent_filter),
+        cache=None if opts.no_cache else cache.ObjectCache.default(),
+        calendar_data=caldav.partial_calendar_data('VEVENT', PROPERTIES))
+if opts.category:
+    cals = filters.with_category(cals, opts.category)
+
+if start is not None and end is not None:
+    records = recur.occurrences(cals, start, end + datetime.timedelta(1))
+else:
+    # Without a window, recurring events are only listed once.
+    records = filters.event_records(cals)
 
-vevents = list(filter(filter_fn, filters.extract_vevents(cals)))
-vevents.sort(key=utils.keyEvent)
+vevents = list(filter(filter_fn, records))
+vevents.sort(key=lambda record: record.sort_key)
 
 for vevent in vevents:
-    summary = vevent['SUMMARY']
-    location = vevent.get('LOCATION')
-    dtstart = vevent['DTSTART'].dt
-    if isinstance(dtstart, datetime.datetime):
-        sys.stdout.write('%12s ' % dtstart.strftime('%d %b %H:%M'))
+    if isinstance(vevent.start, datetime.datetime):
+        sys.stdout.write('%12s ' % vevent.start.strftime('%d %b %H:%M'))
     else:
-        try:
-            dtend = vevent['DTEND'].dt
-        except KeyError:
-            dtend = None
-        sys.stdout.write('%12s ' % utils.format_daterange(dtstart, dtend))
-    sys.stdout.write("%s" % summary)
-    if location:
-        sys.stdout.write(" @ %s" % location.replace('\n', ' / '))
-    sys.stdout.write(utils.statuschar(vevent.get('STATUS')))
+        sys.stdout.write(
+            '%12s ' % utils.format_daterange(vevent.start, vevent.end))
+    sys.stdout.write("%s" % vevent.summary)
+    if vevent.location:
+        sys.stdout.write(" @ %s" % vevent.location.replace('\n', ' / '))
+    sys.stdout.write(utils.statuschar(vevent.status))
     sys.stdout.write("\n")
@@ -28,9 +28,9 @@ import sys
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from dystros import caldav, filters, utils
+from dystros import caldav, intervals, recur, utils
 
-parser = optparse.OptionParser("printday DATE")
+parser = optparse.OptionParser("printday DATE[-DATE] [DATE[-DATE]...]")
 parser.add_option_group(utils.CalendarOptionGroup(parser))
 opts, args = parser.parse_args()
 
@@ -38,38 +38,43 @@ if len(args) < 1:
     parser.print_usage()
     sys.exit(1)
 
-day = utils.asdate(datetime.datetime.strptime(args[0], "%Y%m%d"))
+days = []
+for arg in args:
+    if '-' in arg:
+        (first, last) = [utils.parse_date(d) for d in arg.split('-', 1)]
+    else:
+        first = last = utils.parse_date(arg)
+    while first <= last:
+        days.append(first)
+        first += datetime.timedelta(1)
+
+# Properties used below; only these are retrieved from the server.
+PROPERTIES = ['SUMMARY', 'DTSTART', 'DTEND', 'DURATION', 'LOCATION', 'STATUS',
+              'RRULE', 'RDATE', 'EXDATE', 'RECURRENCE-ID']
 
-cals = utils.get_all_props(opts.url, filter=caldav.comp_filter("VCALENDAR", caldav.comp_filter("VEVENT")))
+cals = utils.get_all_calendars(
+    opts.url, filter=caldav.comp_filter("VCALENDAR", caldav.comp_filter(
+        "VEVENT", caldav.time_range(
+            min(days), max(days) + datetime.timedelta(1)))),
+    calendar_data=caldav.partial_calendar_data('VEVENT', PROPERTIES))
 
-vevents = list(filters.extract_vevents(cals))
-vevents.sort(key=utils.keyEvent)
+index = intervals.IntervalIndex(recur.occurrences(
+    cals, min(days), max(days) + datetime.timedelta(1)))
 
-for vevent in vevents:
-    if not (day == utils.asdate(vevent['DTSTART'].dt) or
-       (day >= utils.asdate(vevent['DTSTART'].dt) and
-        day <= utils.asdate(vevent['DTEND'].dt))):
-        continue
-    summary = vevent['SUMMARY']
-    location = vevent.get('LOCATION')
-    dtstart = vevent['DTSTART'].dt
-    if isinstance(dtstart, datetime.datetime):
-        sys.stdout.write('%s' % dtstart.strftime('%H:%M'))
-        try:
-            dtend = vevent['DTEND'].dt
-        except KeyError:
-            dtend = None
+for day in days:
+    if len(days) > 1:
+        sys.stdout.write("%s\n" % day.strftime("%a %d %b %Y"))
+    for vevent in index.on_day(day):
+        if isinstance(vevent.start, datetime.datetime):
+            sys.stdout.write('%s' % vevent.start.strftime('%H:%M'))
+            if vevent.end is not None:
+                sys.stdout.write('-%s' % vevent.end.strftime('%H:%M'))
+            sys.stdout.write(' ')
         else:
-            sys.stdout.write('-%s' % dtend.strftime('%H:%M'))
-        sys.stdout.write(' ')
-    else:
-        try:
-            dtend = vevent['DTEND'].dt
-        except KeyError:
-            dtend = None
-        sys.stdout.write('%s ' % utils.format_daterange(dtstart, dtend))
-    sys.stdout.write("%s" % summary)
-    if location:
-        sys.stdout.write(" @ %s" % location.replace('\n', ' / '))
-    sys.stdout.write(utils.statuschar(vevent.get('STATUS')))
-    sys.stdout.write("\n")
+            sys.stdout.write(
+                '%s ' % utils.format_daterange(vevent.start, vevent.end))
+        sys.stdout.write("%s" % vevent.summary)
+        if vevent.location:
+            sys.stdout.write(" @ %s" % vevent.location.replace('\n', ' / '))
+        sys.stdout.write(utils.statuschar(vevent.status))
+        sys.stdout.write("\n")
@@ -31,5 +31,6 @@ setup(name="dystros",
       author_email="jelmer@jelmer.uk",
       license="Apache v2 or later",
       url="https://www.jelmer.uk/projects/dystros",
-      requires=['jinja2', 'icalendar', 'defusedxml'],
+      requires=['jinja2', 'icalendar', 'defusedxml', 'dateutil'],
+      python_requires='>=3.7',
       packages=['dystros'])
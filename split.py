@@ -24,26 +24,11 @@
 import hashlib
 import logging
 import optparse
-import urllib.request, urllib.parse, urllib.error
+import urllib.parse
 import os
-from icalendar.cal import Calendar
-from icalendar.prop import vUri, vText
 import sys
 
-from dystros import caldav, utils
-
-def StripStamps(c):
-    if c is None:
-        return None
-    c = Calendar.from_ical(c.to_ical())
-    for sc in c.subcomponents:
-        if 'DTSTAMP' in sc:
-            del sc['DTSTAMP']
-    return c.to_ical()
-
-
-def hasChanged(a, b):
-    return StripStamps(a) != StripStamps(b)
+from dystros import scanner, utils
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -62,9 +47,13 @@ parser.add_option("--invite", dest="invite", action="store_true", help="Store as
 parser.add_option("--prefix", dest="prefix", default="unknown", help="Filename prefix")
 parser.add_option('--category', dest='category', default=None, help="Category to add.")
 parser.add_option('--status', dest='status', type="choice", choices=["", "tentative", "confirmed"], default=None, help="Status to set.")
+parser.add_option('--jobs', dest='jobs', type=int, default=1, help="Number of concurrent writes.")
+parser.add_option('--compress', dest='compress', action='store_true', default=False, help="Compress large uploads, if the server supports it.")
 opts, args = parser.parse_args()
 
-cup = caldav.get_current_user_principal(opts.url)
+utils.set_discovery_cache(utils.DiscoveryCache.default())
+
+cup = utils.get_current_user_principal(opts.url)
 logging.info('Current user principal: %s', cup)
 inbox_url = utils.get_inbox_url(cup)
 logging.info('Inbox URL: %s', inbox_url)
@@ -80,52 +69,57 @@ except IndexError:
     f = sys.stdin.buffer
     import_url = None
 else:
-    f = urllib.request.urlopen(import_url)
-
-orig = Calendar.from_ical(f.read())
-
-other = []
-items = {}
-for component in orig.subcomponents:
-    if component.name in ('VEVENT', 'VTODO'):
-        try:
-            items[component['UID']] = component
-        except KeyError:
-            raise KeyError('missing UID for %s in %s' % (component.name, url))
+    f = utils.urlopen(import_url)
+
+index = utils.get_fingerprint_index(target_collection_url)
+logging.info('Found %d existing items', len(index))
+
+executor = utils.WriteExecutor(opts.jobs, compress=opts.compress)
+
+calendar_props = []
+if import_url is not None:
+    calendar_props.append(('X-IMPORTED-FROM-URL', import_url))
+# If this is not an iTIP request, then make it one.
+if opts.invite:
+    calendar_props.append(('METHOD', 'REQUEST'))
+component_props = []
+if opts.category:
+    component_props.append(
+        ('CATEGORIES', scanner.encode_text(opts.category)))
+if opts.status:
+    component_props.append(('STATUS', opts.status.upper()))
+
+# The feed is split one object at a time, so that large feeds don't have to
+# be held in memory. Objects are compared and written as they are, without
+# parsing them. Only the fingerprints of the existing items are kept.
+seen = set()
+for (name, uid, data) in scanner.split_calendar(f):
+    if uid in seen:
+        # Components with the same UID are only combined if they are
+        # adjacent in the feed (see scanner.split_calendar).
+        logging.warning(
+            'Skipping %s %s: it is not next to the other components with '
+            'the same UID (e.g. a recurrence override), which were already '
+            'imported', name, uid)
+        continue
+    seen.add(uid)
+    data = scanner.add_properties(
+        data, calendar_props, component_props, [name])
+    try:
+        (href, etag, digest) = index[uid]
+    except KeyError:
+        executor.add_member(target_collection_url, 'text/calendar', data,
+                            key=uid)
     else:
-        other.append(component)
-
-seen = 0
-changed = 0
-added = 0
-for (uid, ev) in items.items():
-    seen += 1
-    (old, todo, new, href, etag, ev) = utils.create_or_update_calendar_item(
-        target_collection_url, "VEVENT", uid)
-    out = Calendar()
-    if import_url is not None:
-        out['X-IMPORTED-FROM-URL'] = vUri(import_url)
-    # If this is not an iTIP request, then make it one.
-    if "METHOD" not in out and opts.invite:
-        out["METHOD"] = "REQUEST"
-    out.update(list(orig.items()))
-    for c in other:
-        out.add_component(c)
-    if opts.category:
-        if isinstance(ev.get('CATEGORIES', ''), vText):
-            ev['CATEGORIES'] = [ev['CATEGORIES']]
-        ev.setdefault('categories', []).append(vText(opts.category))
-    if opts.status and 'STATUS' not in ev:
-        ev['STATUS'] = opts.status.upper()
-    out.add_component(ev)
-    write = hasChanged(old, out)
-    if write:
-        if old is None:
-           added += 1
-           utils.add_member(target_collection_url, 'text/calendar', out.to_ical())
-        else:
-           changed += 1
-           utils.put(href, 'text/calendar', out.to_ical(), if_match=[etag])
+        if digest != utils.fingerprint(data):
+            executor.put(urllib.parse.urljoin(target_collection_url, href),
+                         'text/calendar', data, if_match=[etag], key=uid)
+
+results = executor.wait()
+executor.shutdown()
+utils.log_write_results(results)
+changed = len([r for r in results if r.ok and r.method == 'PUT'])
+added = len([r for r in results if r.ok and r.method == 'POST'])
 
 logger.info('Processed %s. Seen %d, updated %d, new %d', opts.prefix,
-             seen, changed, added)
+             len(seen), changed, added)
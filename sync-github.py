@@ -23,15 +23,25 @@
 import github
 
 import argparse
-from icalendar.cal import Calendar, Todo
-from icalendar.prop import vDatetime
+import datetime
+import logging
 from dystros.config import GetConfig
-from dystros import utils, version_string
-import urllib.parse
+from dystros import githubsync, metrics, utils, version_string
 from prometheus_client import CollectorRegistry, Counter, Gauge, push_to_gateway
 
+# Assignee used when neither --assignee nor github_assignee is set.
+DEFAULT_ASSIGNEE = 'jelmer'
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--prometheus', type=str, help='Prometheus host to connect to.', default=None)
+parser.add_argument('--jobs', type=int, help='Number of concurrent writes.', default=1)
+parser.add_argument('--assignee', type=str, default=None,
+                    help='GitHub login of the assignee (defaults to the '
+                         'github_assignee setting).')
+parser.add_argument('--full', action='store_true',
+                    help='Reconcile all issues, not just recently updated ones.')
+parser.add_argument('--full-interval', type=int, default=7,
+                    help='Number of days between full reconciles.')
 utils.add_calendar_arguments(parser)
 
 registry = CollectorRegistry()
@@ -50,9 +60,14 @@ tasks_updated_counter = Counter(
     'Number of tasks that was updated',
     registry=registry)
 
+metrics.RequestMetrics(registry).install()
+utils.set_discovery_cache(utils.DiscoveryCache.default())
+
 
 flags = parser.parse_args()
 
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 config = GetConfig()
 kwargs = {}
 try:
@@ -63,39 +78,31 @@ except KeyError:
 
 gh = github.MainClass.Github(**kwargs, user_agent='dystros')
 
-state_map = {
-        "open": "NEEDS-ACTION",
-        "closed": "COMPLETED",
-        }
-
-for issue in gh.search_issues(query="assignee:jelmer"):
-    (old, new, href, etag, todo) = utils.create_or_update_calendar_item(flags.url, "VTODO", issue.url)
-    todo["CLASS"] = "PUBLIC"
-    todo["DESCRIPTION"] =  issue.body
-    todo["URL"] = issue.html_url
-    todo["SUMMARY"] = "%s: %s" % (issue.repository.name, issue.title)
-    todo["X-GITHUB-URL"] = issue.url
-    todo["STATUS"] = state_map[issue.state]
-    if issue.milestone and issue.milestone.url:
-        todo["X-MILESTONE"] = issue.milestone.url
-    if issue.created_at:
-        todo["CREATED"] = vDatetime(issue.created_at)
-    if issue.closed_at:
-        todo["COMPLETED"] = vDatetime(issue.closed_at)
-    for label in issue.labels:
-        todo["X-LABEL"] = label.name
-
-    if etag is None:
-        print("Adding todo item for %r" % issue.title)
-        utils.add_member(flags.url, 'text/calendar', new.to_ical())
+assignee = flags.assignee or config.get('github_assignee')
+if assignee is None:
+    # Deprecated: the assignee used to be hard-coded.
+    logging.warning(
+        'Neither --assignee nor github_assignee is set; defaulting to %r. '
+        'This default is deprecated and will be removed.',
+        DEFAULT_ASSIGNEE)
+    assignee = DEFAULT_ASSIGNEE
+
+watermark = githubsync.Watermark.for_query(flags.url, assignee)
+
+with utils.WriteExecutor(flags.jobs) as executor:
+    results = githubsync.synchronize(
+        gh, flags.url, assignee, executor, watermark, full=flags.full,
+        full_interval=datetime.timedelta(days=flags.full_interval))
+
+for result in results:
+    if not result.ok:
+        continue
+    if result.method == 'POST':
         tasks_created_counter.inc()
     else:
-        url = urllib.parse.urljoin(flags.url, href)
-        if new != old:
-            print("Updating todo item for %r" % issue.title)
-            utils.put(url, 'text/calendar', new.to_ical(), if_match=[etag])
         tasks_updated_counter.inc()
 
-last_success_gauge.set_to_current_time()
+if utils.log_write_results(results) == 0:
+    last_success_gauge.set_to_current_time()
 if flags.prometheus:
     push_to_gateway(flags.prometheus, job='sync-github', registry=registry)
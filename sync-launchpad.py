@@ -25,11 +25,9 @@ from launchpadlib.launchpad import Launchpad
 from xdg.BaseDirectory import xdg_cache_home
 
 import argparse
-from icalendar.cal import Calendar, Todo
-from icalendar.prop import vDatetime
+import logging
 import os
-from dystros import utils, version_string
-import urllib.parse
+from dystros import launchpadsync, metrics, utils, version_string
 from prometheus_client import CollectorRegistry, Counter, Gauge, push_to_gateway
 
 registry = CollectorRegistry()
@@ -48,63 +46,50 @@ tasks_updated_counter = Counter(
     'Number of tasks that was updated',
     registry=registry)
 
+metrics.RequestMetrics(registry).install()
+utils.set_discovery_cache(utils.DiscoveryCache.default())
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--prometheus', type=str, help='Prometheus host to connect to.', default=None)
+parser.add_argument('--jobs', type=int, help='Number of concurrent writes.', default=1)
+parser.add_argument('--prefetch-jobs', type=int,
+                    default=launchpadsync.DEFAULT_PREFETCH_JOBS,
+                    help='Number of bug tasks to fetch concurrently.')
 utils.add_calendar_arguments(parser)
 
 flags = parser.parse_args()
 
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 launchpad = Launchpad.get_token_and_login(
         'dystros', 'production',
         os.path.join(xdg_cache_home, 'dystros'))
 
-STATUSES = [
-    'New',
-    'Incomplete',
-    'Confirmed',
-    'Triaged',
-    'In Progress',
-    'Fix Committed',
-    'Fix Released',
-    'Won\'t Fix',
-]
-
-for task in launchpad.bugs.searchTasks(assignee=launchpad.me, status=STATUSES):
-    print("Processing %s" % task.bug.id)
-    (old, new, href, etag, todo) = utils.create_or_update_calendar_item(flags.url, "VTODO", task.self_link)
-    todo["CLASS"] = "PUBLIC"
-    todo["URL"] = task.web_link
-    todo["SUMMARY"] = "%s: %s" % (task.target.name, task.bug.title)
-
-    if task.is_complete:
-        todo["STATUS"] = "COMPLETED"
-    else:
-        todo["STATUS"] = "NEEDS-ACTION"
-
-    if task.date_created and False:
-        todo["CREATED"] = vDatetime(task.date_created)
-    if task.date_closed and False:
-        todo["COMPLETED"] = vDatetime(task.date_closed)
 
-    # TODO(jelmer): Set RELATED-TO (SIBLING) based on task.related_tasks
+def login():
+    # launchpadlib clients are not thread-safe; give each prefetch worker
+    # its own client, sharing the credentials.
+    return Launchpad(launchpad.credentials, None, None,
+                     service_root='production')
 
-    # TODO(jelmer): Set COMMENT field based on task.messages
 
-    todo["CATEGORIES"] = task.bug.tags
+tasks = launchpad.bugs.searchTasks(
+    assignee=launchpad.me, status=launchpadsync.STATUSES)
 
-    todo["DESCRIPTION"] =  task.bug.description
+with utils.WriteExecutor(flags.jobs) as executor:
+    launchpadsync.sync_tasks(tasks, flags.url, executor,
+                             jobs=flags.prefetch_jobs, login=login)
+    results = executor.wait()
 
-    if etag is None:
-        print("Adding todo item for %r" % task.self_link)
-        utils.add_member(flags.url, 'text/calendar', new.to_ical())
+for result in results:
+    if not result.ok:
+        continue
+    if result.method == 'POST':
         tasks_created_counter.inc()
     else:
-        url = urllib.parse.urljoin(flags.url, href)
-        if new.to_ical() != old.to_ical():
-            print("Updating todo item for %r" % task.bug.title)
-            utils.put(url, 'text/calendar', new.to_ical(), if_match=[etag])
-            tasks_updated_counter.inc()
+        tasks_updated_counter.inc()
 
-last_success_gauge.set_to_current_time()
+if utils.log_write_results(results) == 0:
+    last_success_gauge.set_to_current_time()
 if flags.prometheus:
     push_to_gateway(flags.prometheus, job='sync-launchpad', registry=registry)
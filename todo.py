@@ -27,30 +27,39 @@ import sys
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from dystros import filters, utils
+from dystros import cache, caldav, filters, utils
 
 parser = optparse.OptionParser("travel")
 parser.add_option_group(utils.CalendarOptionGroup(parser))
+parser.add_option('--incremental', action='store_true', default=False,
+                  help='Only fetch items that changed since the last run.')
+parser.add_option('--no-cache', action='store_true', default=False,
+                  help='Do not use the local object cache.')
 opts, args = parser.parse_args()
 
-cals = utils.get_all_calendars(opts.url, filter=caldav.comp_filter("VCALENDAR", caldav.comp_filter("VTODO")))
+# Properties used below; only these are retrieved from the server.
+PROPERTIES = ['STATUS', 'SUMMARY', 'LOCATION', 'PRIORITY', 'DUE']
 
-vtodos = list(filters.extract_vtodos(cals))
+if opts.incremental:
+    # The local copy is complete; records are filtered below.
+    cals = utils.get_all_calendars(opts.url, incremental=True)
+else:
+    cals = utils.get_all_calendars(
+        opts.url, filter=caldav.comp_filter("VCALENDAR", caldav.comp_filter("VTODO")),
+        cache=None if opts.no_cache else cache.ObjectCache.default(),
+        calendar_data=caldav.partial_calendar_data('VTODO', PROPERTIES))
 
-vtodos.sort(key=utils.keyTodo)
+vtodos = [vtodo for vtodo in filters.todo_records(cals)
+          if vtodo.status not in ('COMPLETED', 'CANCELLED')]
+
+vtodos.sort(key=lambda record: record.sort_key)
 
 for vtodo in vtodos:
-    status = str(vtodo.get('STATUS', 'NEEDS-ACTION'))
-    if status in ('COMPLETED', 'CANCELLED'):
-        continue
-    summary = vtodo['SUMMARY']
-    location = vtodo.get('LOCATION')
-    priority = vtodo.get('PRIORITY')
-    if priority is not None:
-        sys.stdout.write("(%d) " % priority)
-    sys.stdout.write("%s" % summary)
-    if location:
-        sys.stdout.write(" @ %s" % location)
-    if 'DUE' in vtodo:
-        sys.stdout.write(" (due %s)" % vtodo['DUE'].dt.strftime("%Y %b %d"))
+    if vtodo.priority is not None:
+        sys.stdout.write("(%d) " % vtodo.priority)
+    sys.stdout.write("%s" % vtodo.summary)
+    if vtodo.location:
+        sys.stdout.write(" @ %s" % vtodo.location)
+    if vtodo.due is not None:
+        sys.stdout.write(" (due %s)" % vtodo.due.strftime("%Y %b %d"))
     sys.stdout.write("\n")
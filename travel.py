@@ -21,10 +21,7 @@
 # MA  02110-1301, USA.
 
 
-from icalendar.cal import Calendar
-import collections
 import datetime
-import jinja2
 import logging
 import optparse
 import os
@@ -33,10 +30,14 @@ import urllib.parse
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from dystros import caldav, filters, utils
+from dystros import cache, caldav, filters, utils
 
 parser = optparse.OptionParser("travel")
 parser.add_option_group(utils.CalendarOptionGroup(parser))
+parser.add_option('--incremental', action='store_true', default=False,
+                  help='Only fetch items that changed since the last run.')
+parser.add_option('--no-cache', action='store_true', default=False,
+                  help='Do not use the local object cache.')
 parser.add_option("--format", choices=["text", "html", "now"], default="text", help="Output format")
 parser.add_option("--html-template", type=str, help="Name of HTML template to use.", default="travel.html")
 parser.add_option("--category", type=str, help="Category to select", default="Travel")
@@ -45,74 +46,67 @@ parser.add_option("--show-past-cancelled", action="store_true", default=False, h
 parser.add_option("--tense", choices=["past", "future", "all"], default="all", help="Tense")
 opts, args = parser.parse_args()
 
-TravelEvent = collections.namedtuple("TravelEvent", ["summary", "url", "location", "status", "start", "end"])
+# Properties used below; only these are retrieved from the server.
+PROPERTIES = ['CLASS', 'CATEGORIES', 'SUMMARY', 'STATUS', 'DTSTART', 'DTEND',
+              'DURATION', 'URL', 'LOCATION']
 
-cals = utils.get_all_calendars(opts.url, filter=caldav.comp_filter("VCALENDAR", caldav.comp_filter("VEVENT")))
+if opts.incremental:
+    # The local copy is complete; records are filtered below.
+    cals = utils.get_all_calendars(opts.url, incremental=True)
+else:
+    cals = utils.get_all_calendars(
+        opts.url, filter=caldav.comp_filter("VCALENDAR", caldav.comp_filter("VEVENT")),
+        cache=None if opts.no_cache else cache.ObjectCache.default(),
+        calendar_data=caldav.partial_calendar_data('VEVENT', PROPERTIES))
 
 travelevs = {}
 
-for ev in filters.extract_vevents(cals):
-    if ev.get('CLASS') not in (None, 'DEFAULT', 'PUBLIC', 'PRIVATE'):
+for ev in filters.event_records(cals):
+    if ev.classification not in (None, 'DEFAULT', 'PUBLIC', 'PRIVATE'):
         logging.info('Skipping %s because it is not public (%s)',
-            ev['SUMMARY'], ev['CLASS'])
+            ev.summary, ev.classification)
         continue
-    if not 'CATEGORIES' in ev:
+    if not ev.categories:
         logging.info('Skipping %s because it does not have categories.',
-            ev['SUMMARY'])
+            ev.summary)
         continue
-    try:
-        status = ev['STATUS']
-    except KeyError:
-        status = None
-    start = ev['DTSTART'].dt
-    try:
-        end = ev['DTEND'].dt
-    except KeyError:
-        try:
-            duration = ev['DURATION'].dt
-        except KeyError:
-            end = None
-        else:
-            end = start + (duration - datetime.timedelta(0, 1))
-    try:
-        url = ev['URL']
-    except KeyError:
-        url = None
-
-    if ev['CATEGORIES'] == opts.category or opts.category in ev['CATEGORIES']:
-        if ev.get('CLASS') in ('CONFIDENTIAL', 'PRIVATE'):
+    url = ev.url
+
+    if opts.category in ev.categories:
+        if ev.classification in ('CONFIDENTIAL', 'PRIVATE'):
             summary = "Away"
             url = None
         else:
-            summary = ev['SUMMARY']
+            summary = ev.summary
 
-        if ev.get('CLASS') == 'CONFIDENTIAL':
+        if ev.classification == 'CONFIDENTIAL':
             location = None
         else:
-            try:
-                location = ev['LOCATION']
-            except KeyError:
-                location = None
+            location = ev.location
             if location == summary:
                 location = None
-    elif opts.obscured_category and (
-            ev['CATEGORIES'] == opts.obscured_category or
-            opts.obscured_category in ev['CATEGORIES']):
+    elif opts.obscured_category and opts.obscured_category in ev.categories:
         location = None
         summary = opts.obscured_category
     else:
         # TODO(jelmer): There must be a cleaner way of doing this..
         logging.info(
             'Skipping %s because it does not have right categories (%s)',
-            ev['SUMMARY'], ev.get('CATEGORIES'))
+            ev.summary, ', '.join(ev.categories))
         continue
-    travelev = TravelEvent(summary=summary, url=url, location=location,
-        status=status, start=start, end=end)
+    end = ev.end
+    if end is not None and not isinstance(end, datetime.datetime):
+        # The end of a whole-day event is exclusive; show the last day of
+        # the event instead, e.g. "3-4 Jan" for a two-day event.
+        end = max(ev.start, end - datetime.timedelta(1))
+    travelev = filters.EventRecord(
+        ev.uid, summary, ev.start, end, location=location,
+        status=ev.status, url=url)
     travelevs.setdefault(travelev.start.year, []).append(travelev)
 
 
 def evsortkey(ev):
-    return ev.start.isoformat()
+    return ev.sort_key
 
 
 if not opts.show_past_cancelled:
@@ -177,6 +171,7 @@ if opts.format == "text":
             f.write(utils.statuschar(ev.status))
             f.write("\n")
 elif opts.format == "html":
+    import jinja2
     env = jinja2.Environment(loader=jinja2.FileSystemLoader('templates'))
     template = env.get_template(opts.html_template)
     def status_char(status):